@@ -0,0 +1,90 @@
+import numpy as np
+import torch
+from vapo.agent.core.rollout import RolloutEngine
+from vapo.agent.core.metrics import MetricsAccumulator
+from vapo.agent.core.checkpoint import snapshot
+from vapo.agent.core.utils import cluster_stats
+from vapo.agent.networks.actor_network import CNNPolicyDenseNet
+from vapo.agent.networks.critic_network import CNNCriticDenseNet
+from benchmarks.common import DEVICE, SyntheticEnv, make_net_cfg, random_obs
+
+
+class RolloutSuite():
+    '''
+        Policy forward to act in the env, numpy observations
+        to numpy actions.
+    '''
+    params = ([1, 8], [64, 128])
+    param_names = ["n_obs", "img_size"]
+
+    def setup(self, n_obs, img_size):
+        env = SyntheticEnv(img_size)
+        policy = CNNPolicyDenseNet(env.observation_space,
+                                   env.action_space.shape[0],
+                                   action_space=env.action_space,
+                                   **make_net_cfg()).to(DEVICE)
+        self.rollout = RolloutEngine(policy, env.transform_obs, DEVICE)
+        rng = np.random.RandomState(0)
+        self.obs = [random_obs(env.observation_space, rng)
+                    for _ in range(n_obs)]
+
+    def time_act_batch(self, n_obs, img_size):
+        self.rollout.act_batch(self.obs, deterministic=False)
+
+
+class MetricsSuite():
+    '''
+        Training losses of one episode: add() per update, one flush()
+    '''
+    params = ([100, 1000],)
+    param_names = ["n_updates"]
+
+    def setup(self, n_updates):
+        self.metrics = MetricsAccumulator({"critic_loss": ["mean", "max"],
+                                           "actor_loss": "mean"})
+        self.values = torch.rand(n_updates, 3, device=DEVICE)
+
+    def time_add_flush(self, n_updates):
+        for v in self.values:
+            self.metrics.add("critic_loss", v[0])
+            self.metrics.add("actor_loss", v[1])
+            self.metrics.add("ent_coef", v[2])
+        self.metrics.flush(prefix="train/")
+
+
+class CheckpointSuite():
+    '''
+        Cpu copy of the SAC checkpoint done before the background write
+    '''
+    def setup(self):
+        env = SyntheticEnv(64)
+        net_cfg = make_net_cfg()
+        action_dim = env.action_space.shape[0]
+        policy = CNNPolicyDenseNet(env.observation_space, action_dim,
+                                   action_space=env.action_space, **net_cfg)
+        critics = [CNNCriticDenseNet(env.observation_space, action_dim,
+                                     **net_cfg) for _ in range(4)]
+        self.state = {"actor_dict": policy.state_dict()}
+        for i, critic in enumerate(critics):
+            self.state["critic_%d_dict" % i] = critic.state_dict()
+
+    def time_snapshot(self):
+        snapshot(self.state)
+
+
+class ClusterStatsSuite():
+    '''
+        Affordance cluster statistics of the target search
+    '''
+    params = ([64, 200], [2, 10])
+    param_names = ["img_size", "n_clusters"]
+
+    def setup(self, img_size, n_clusters):
+        rng = np.random.RandomState(0)
+        self.masks = torch.as_tensor(
+            rng.randint(0, n_clusters + 1, (img_size, img_size)),
+            device=DEVICE)
+        self.probs = torch.rand((img_size, img_size), device=DEVICE)
+
+    def time_cluster_stats(self, img_size, n_clusters):
+        cluster_stats(self.masks, self.probs)
@@ -0,0 +1,111 @@
+import torch
+import torch.nn.functional as F
+from vapo.agent.networks.networks_common import \
+    CNNCommon, SpatialSoftmax, get_concat_features
+from vapo.agent.networks.actor_network import CNNPolicyDenseNet
+from vapo.agent.networks.critic_network import CNNCriticDenseNet
+from benchmarks.common import DEVICE, make_obs_space, make_action_space, \
+    make_net_cfg, random_batch, random_actions
+
+
+class CNNCommonSuite():
+    '''
+        Image encoder forward, gripper cam rgb + depth (+ affordance)
+    '''
+    params = ([1, 32, 256], [64, 128], [False, True])
+    param_names = ["batch_size", "img_size", "use_aff"]
+
+    def setup(self, batch_size, img_size, use_aff):
+        self.net = CNNCommon(4, img_size, out_feat=16,
+                             use_affordance=use_aff,
+                             activation=F.relu).to(DEVICE)
+        channels = 5 if use_aff else 4
+        self.x = torch.rand((batch_size, channels, img_size, img_size),
+                            device=DEVICE)
+
+    def time_forward(self, batch_size, img_size, use_aff):
+        with torch.no_grad():
+            self.net(self.x)
+
+
+class SpatialSoftmaxSuite():
+    params = ([1, 32, 256], [64, 128])
+    param_names = ["batch_size", "img_size"]
+
+    def setup(self, batch_size, img_size):
+        # Size of the CNNCommon feature maps
+        encoder = CNNCommon(4, img_size, out_feat=16)
+        h = encoder.spatial_softmax.num_rows
+        w = encoder.spatial_softmax.num_cols
+        self.net = SpatialSoftmax(h, w).to(DEVICE)
+        self.x = torch.rand((batch_size, 64, h, w), device=DEVICE)
+
+    def time_forward(self, batch_size, img_size):
+        with torch.no_grad():
+            self.net(self.x)
+
+
+class ConcatFeaturesSuite():
+    '''
+        Observation dict to policy features, incl. the gripper cam encoder
+    '''
+    params = ([1, 32, 256], [64, 128], [False, True])
+    param_names = ["batch_size", "img_size", "use_aff"]
+
+    def setup(self, batch_size, img_size, use_aff):
+        obs_space = make_obs_space(img_size, use_aff)
+        net_cfg = make_net_cfg(use_aff)
+        policy = CNNPolicyDenseNet(obs_space, 5,
+                                   action_space=make_action_space(),
+                                   **net_cfg).to(DEVICE)
+        self.aff_cfg = net_cfg.affordance
+        self.cnn_gripper = policy.cnn_gripper
+        self.obs = random_batch(obs_space, batch_size)
+        if(batch_size == 1):
+            # Single observations are unbatched, as in the rollout
+            self.obs = {k: v[0] for k, v in self.obs.items()}
+
+    def time_get_concat_features(self, batch_size, img_size, use_aff):
+        with torch.no_grad():
+            get_concat_features(self.aff_cfg, self.obs,
+                                None, self.cnn_gripper)
+
+
+class DenseNetSuite():
+    '''
+        Forward + backward of the default actor and critic
+        (config/agent/default.yaml net_cfg)
+    '''
+    params = ([32, 256], [64, 128])
+    param_names = ["batch_size", "img_size"]
+
+    def setup(self, batch_size, img_size):
+        obs_space = make_obs_space(img_size)
+        action_space = make_action_space()
+        net_cfg = make_net_cfg()
+        action_dim = action_space.shape[0]
+        self.policy = CNNPolicyDenseNet(obs_space, action_dim,
+                                        action_space=action_space,
+                                        **net_cfg).to(DEVICE)
+        self.critic = CNNCriticDenseNet(obs_space, action_dim,
+                                        **net_cfg).to(DEVICE)
+        self.obs = random_batch(obs_space, batch_size)
+        self.actions = random_actions(action_space, batch_size)
+
+    def time_actor_forward(self, batch_size, img_size):
+        with torch.no_grad():
+            self.policy.act(self.obs, deterministic=False)
+
+    def time_actor_forward_backward(self, batch_size, img_size):
+        self.policy.zero_grad()
+        _, log_probs = self.policy.act(self.obs, deterministic=False,
+                                       reparametrize=True)
+        log_probs.mean().backward()
+
+    def time_critic_forward(self, batch_size, img_size):
+        with torch.no_grad():
+            self.critic(self.obs, self.actions)
+
+    def time_critic_forward_backward(self, batch_size, img_size):
+        self.critic.zero_grad()
+        self.critic(self.obs, self.actions).mean().backward()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from vapo.agent.core.replay_buffer import ReplayBuffer
+from benchmarks.common import DEVICE, LOG, make_obs_space, random_obs
+
+# Distinct observations the buffer transitions point to,
+# keeps memory bounded for large fills
+N_UNIQUE_OBS = 64
+
+
+def fill_buffer(buffer, obs_space, n, seed=0):
+    rng = np.random.RandomState(seed)
+    pool = [random_obs(obs_space, rng) for _ in range(N_UNIQUE_OBS)]
+    for i in range(n):
+        buffer.add_transition(pool[i % N_UNIQUE_OBS],
+                              rng.uniform(-1, 1, 5).astype("float32"),
+                              float(rng.rand()),
+                              pool[(i + 1) % N_UNIQUE_OBS],
+                              bool(rng.rand() < 0.01))
+    return pool
+
+
+class ReplayBufferSuite():
+    '''
+        add_transition and sample (incl. host to device copy) of a
+        full buffer, i.e. adding evicts the oldest transition.
+    '''
+    params = ([32, 256], [64, 128], [1000, 10000])
+    param_names = ["batch_size", "img_size", "buffer_fill"]
+
+    def setup(self, batch_size, img_size, buffer_fill):
+        obs_space = make_obs_space(img_size)
+        self.buffer = ReplayBuffer(buffer_fill, dict_state=True,
+                                   logger=LOG, device=DEVICE)
+        self.pool = fill_buffer(self.buffer, obs_space, buffer_fill)
+        self.action = np.zeros(5, dtype="float32")
+
+    def time_add_transition(self, batch_size, img_size, buffer_fill):
+        self.buffer.add_transition(self.pool[0], self.action, 0.0,
+                                   self.pool[1], False)
+
+    def time_sample(self, batch_size, img_size, buffer_fill):
+        self.buffer.sample(batch_size)
+
+
+class ReplayBufferIOSuite():
+    '''
+        save() of all the transitions (one .npy file each)
+        and load() of the saved folder. Batch size does not apply.
+    '''
+    params = ([64, 128], [100, 500])
+    param_names = ["img_size", "buffer_fill"]
+
+    def setup(self, img_size, buffer_fill):
+        self.tmp_dir = tempfile.mkdtemp(prefix="vapo_bench_")
+        self.save_dir = os.path.join(self.tmp_dir, "replay_buffer")
+        self.buffer = ReplayBuffer(buffer_fill, dict_state=True,
+                                   logger=LOG, device=DEVICE)
+        fill_buffer(self.buffer, make_obs_space(img_size), buffer_fill)
+        self.buffer.save(self.save_dir)
+        self.max_size = buffer_fill
+
+    def teardown(self, img_size, buffer_fill):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def time_save(self, img_size, buffer_fill):
+        # Save is incremental, write all the transitions again
+        self.buffer.last_saved_idx = -1
+        self.buffer.save(self.save_dir)
+
+    def time_load(self, img_size, buffer_fill):
+        buffer = ReplayBuffer(self.max_size, dict_state=True,
+                              logger=LOG, device=DEVICE)
+        buffer.load(self.save_dir)
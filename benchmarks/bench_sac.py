@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import torch
+from vapo.agent.core.sac import SAC
+from benchmarks.common import DEVICE, LOG, SyntheticEnv, make_net_cfg, \
+    random_batch, random_actions
+from benchmarks.bench_replay_buffer import fill_buffer
+
+
+class SACUpdateSuite():
+    '''
+        update: one SAC._update, both critics, actor, entropy coefficient
+        and target networks.
+        train_update: replay buffer sample, augmentation, td target
+        and _update, i.e. the learning part of a training step.
+    '''
+    params = ([32, 256], [64, 128], [1000, 10000])
+    param_names = ["batch_size", "img_size", "buffer_fill"]
+
+    def setup(self, batch_size, img_size, buffer_fill):
+        # SAC creates ./results and the save dir
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp(prefix="vapo_bench_")
+        os.chdir(self.tmp_dir)
+        env = SyntheticEnv(img_size)
+        self.agent = SAC(env, save_dir=os.path.join(self.tmp_dir, "models"),
+                         batch_size=batch_size, buffer_size=buffer_fill,
+                         net_cfg=make_net_cfg(), log=LOG, device=DEVICE)
+        self.states = random_batch(env.observation_space, batch_size)
+        self.actions = random_actions(env.action_space, batch_size)
+        self.td_target = torch.rand(batch_size, device=DEVICE)
+        fill_buffer(self.agent._replay_buffer, env.observation_space,
+                    buffer_fill)
+
+    def teardown(self, batch_size, img_size, buffer_fill):
+        self.agent._checkpoints.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def time_update(self, batch_size, img_size, buffer_fill):
+        self.agent._update(self.td_target, self.states, self.actions)
+
+    def time_train_update(self, batch_size, img_size, buffer_fill):
+        self.agent._train_update()
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+from vapo.wrappers.augmentation import BatchAugmentation
+from vapo.wrappers.affordance.aff_cache import AffordanceCache
+from vapo.wrappers.synthetic_env import SyntheticPlayTable
+from vapo.wrappers.utils import depth_preprocessing
+from benchmarks.common import DEVICE, CONFIG_DIR, make_wrapped_env
+
+
+class BatchAugmentationSuite():
+    '''
+        Train transforms of the replay buffer batches (rl_transforms)
+    '''
+    params = ([32, 256], [64, 128])
+    param_names = ["batch_size", "img_size"]
+
+    def setup(self, batch_size, img_size):
+        cfg = OmegaConf.create({"img_size": img_size})
+        cfg.transforms = OmegaConf.load(
+            os.path.join(CONFIG_DIR, "transforms", "rl_transforms.yaml"))
+        self.augmentation = BatchAugmentation.from_cfg(
+            cfg.transforms.train, img_size)
+        self.x = torch.randint(0, 256, (batch_size, 3, img_size, img_size),
+                               device=DEVICE)
+
+    def time_augment(self, batch_size, img_size):
+        self.augmentation(self.x)
+
+
+class PreprocessingSuite():
+    params = ([64, 128],)
+    param_names = ["img_size"]
+
+    def setup(self, img_size):
+        rng = np.random.RandomState(0)
+        self.depth = rng.uniform(0.5, 1.5, (200, 200)).astype(np.float32)
+        self.rgb = rng.randint(0, 256, (200, 200, 3)).astype(np.uint8)
+        self.tcp_pos = np.zeros(3)
+        self.cache = AffordanceCache()
+        self.cache.update("gripper", self.rgb, self.tcp_pos,
+                          np.zeros((1, img_size, img_size)))
+        self.img_size = img_size
+
+    def time_depth_preprocessing(self, img_size):
+        depth_preprocessing(self.depth, img_size)
+
+    def time_aff_cache_get(self, img_size):
+        self.cache.get("gripper", self.rgb, self.tcp_pos)
+
+
+class SyntheticEnvSuite():
+    '''
+        Cost of the synthetic env itself, to subtract from
+        the wrapper benchmarks
+    '''
+    def setup(self):
+        self.env = SyntheticPlayTable(lift_steps=None, seed=0)
+        self.env.reset()
+        self.action = np.zeros(7)
+
+    def time_step(self):
+        self.env.step(self.action)
+
+
+class EnvWrapperSuite():
+    '''
+        AffordanceWrapperSim on the synthetic env: observation
+        processing and a full step (reward, termination, observation).
+    '''
+    params = ([64, 128],)
+    param_names = ["img_size"]
+
+    def setup(self, img_size):
+        self.env = make_wrapped_env(img_size, lift_steps=None)
+        self.env.reset()
+        self.obs = self.env.get_obs()
+        self.action = np.zeros(5)
+
+    def teardown(self, img_size):
+        self.env.close()
+
+    def time_observation(self, img_size):
+        self.env.observation(self.obs)
+
+    def time_step(self, img_size):
+        # Zero actions keep the tcp inside the termination radius
+        self.env.move_to_target(self.env.get_target_pos()[0])
+        self.env.step(self.action)
@@ -0,0 +1,151 @@
+import logging
+import os
+import numpy as np
+import torch
+from gym import spaces
+from omegaconf import OmegaConf
+from vapo.wrappers.utils import get_obs_space
+
+# Benchmarks run on cpu, without pybullet or the affordance package
+DEVICE = "cpu"
+LOG = logging.getLogger("benchmarks")
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(
+                          os.path.abspath(__file__))), "config")
+
+
+def affordance_cfg(use_aff=False):
+    '''
+        Same structure as cfg.affordance. model_path is an existing
+        file when use_aff, networks only check that the checkpoint exists.
+    '''
+    model_path = os.path.abspath(__file__) if use_aff else os.devnull
+    return OmegaConf.create({
+        "static_cam": {"use": False,
+                       "model_path": os.devnull,
+                       "img_size": 200},
+        "gripper_cam": {"use": use_aff,
+                        "use_distance": False,
+                        "densify_reward": False,
+                        "target_in_obs": False,
+                        "model_path": model_path}})
+
+
+def make_obs_space(img_size=64, use_aff=False, channels=3,
+                   task="pickup"):
+    '''
+        Observation space of the tabletop env wrapper
+        (cfg_tabletop env_wrapper): gripper cam rgb + depth and robot obs.
+    '''
+    cam_cfg = OmegaConf.create({
+        "gripper": {"use_img": True, "use_depth": True},
+        "static": {"use_img": False, "use_depth": False}})
+    return get_obs_space(affordance_cfg(use_aff),
+                         cam_cfg.gripper, cam_cfg.static,
+                         channels, img_size,
+                         use_robot_obs=True, task=task)
+
+
+def make_action_space(task="pickup"):
+    # Same as AffordanceWrapperSim
+    _action_space = np.ones(5) if task == "pickup" else np.ones(7)
+    return spaces.Box(_action_space * -1, _action_space)
+
+
+def make_net_cfg(use_aff=False, actor_net="CNNPolicyDenseNet",
+                 critic_net="CNNCriticDenseNet"):
+    # config/agent/default.yaml net_cfg
+    return OmegaConf.create({
+        "hidden_dim": 256,
+        "latent_dim": 16,
+        "activation": "relu",
+        "n_layers": 4,
+        "affordance": affordance_cfg(use_aff),
+        "actor_net": actor_net,
+        "critic_net": critic_net})
+
+
+def random_obs(obs_space, rng=np.random):
+    '''
+        Single observation with the dtypes of the env wrapper:
+        uint8 images, float depth/affordance/robot obs.
+    '''
+    obs = {}
+    for k, space in obs_space.spaces.items():
+        if("img_obs" in k):
+            obs[k] = rng.randint(0, 256, space.shape).astype("uint8")
+        elif(k.endswith("_aff")):
+            obs[k] = (rng.rand(*space.shape) > 0.5).astype("uint8")
+        else:
+            obs[k] = rng.rand(*space.shape).astype("float32")
+    return obs
+
+
+def random_batch(obs_space, batch_size, device=DEVICE):
+    '''
+        Batch of transformed observations {key: torch.tensor(B, ...)},
+        as fed to the networks after augmentation.
+    '''
+    return {k: torch.rand((batch_size, *space.shape), device=device)
+            for k, space in obs_space.spaces.items()}
+
+
+def random_actions(action_space, batch_size, device=DEVICE):
+    low = torch.tensor(action_space.low, device=device)
+    high = torch.tensor(action_space.high, device=device)
+    return low + torch.rand((batch_size, len(low)), device=device) \
+        * (high - low)
+
+
+class SyntheticEnv():
+    '''
+        Spaces and observation transforms of the env wrapper,
+        enough to construct a SAC agent.
+    '''
+    def __init__(self, img_size=64, use_aff=False, task="pickup"):
+        self.observation_space = make_obs_space(img_size, use_aff, task=task)
+        self.action_space = make_action_space(task)
+        self.viz = False
+
+    def transform_obs(self, obs_dct, split="validation"):
+        return obs_dct
+
+    def augment_batch(self, *obs_dcts):
+        return list(obs_dcts)
+
+
+def make_wrapped_env(img_size=64, **env_kwargs):
+    '''
+        SyntheticPlayTable in the AffordanceWrapperSim of cfg_tabletop.
+        The wrapper builds its transforms with the affordance package,
+        raises NotImplementedError (case skipped) if it is not installed.
+    '''
+    try:
+        from vapo.wrappers.affordance.aff_wrapper_sim import \
+            AffordanceWrapperSim
+    except ImportError as e:
+        raise NotImplementedError("Env wrapper needs %s" % e.name)
+    from vapo.wrappers.synthetic_env import SyntheticPlayTable
+    transforms_dir = os.path.join(CONFIG_DIR, "transforms")
+    cfg = OmegaConf.create({"img_size": img_size})
+    cfg.affordance = affordance_cfg()
+    cfg.affordance.transforms = OmegaConf.load(
+        os.path.join(transforms_dir, "aff_transforms.yaml"))
+    cfg.transforms = OmegaConf.load(
+        os.path.join(transforms_dir, "rl_transforms.yaml"))
+    cameras = {"static": {"name": "static", "width": 200, "height": 200},
+               "gripper": {"name": "gripper", "width": 200, "height": 200}}
+    env = SyntheticPlayTable(cameras=cameras, seed=0, **env_kwargs)
+    return AffordanceWrapperSim(env, 100,
+                                train=True,
+                                affordance_cfg=cfg.affordance,
+                                viz=False,
+                                save_images=False,
+                                img_size=img_size,
+                                transforms=cfg.transforms,
+                                use_pos=True,
+                                use_aff_termination=False,
+                                max_target_dist=0.1,
+                                gripper_cam=OmegaConf.create(
+                                    {"use_img": True, "use_depth": True}),
+                                static_cam=OmegaConf.create(
+                                    {"use_img": False, "use_depth": False}))
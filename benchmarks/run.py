@@ -0,0 +1,286 @@
+'''
+    Runs the microbenchmarks of this folder.
+    Benchmarks follow the asv layout: classes in bench_*.py modules with
+    params / param_names, setup(*params), optional teardown(*params)
+    and time_* methods. Every combination of params is one case.
+    Results can be stored in a sqlite history and compared to a saved
+    baseline (see tracker.py), the exit code is 1 on regressions.
+
+    usage (from the repository root):
+        python -m benchmarks.run [--filter regex] [--quick]
+            [--repeat 10] [--min-time 0.05] [--threads N]
+            [--output results.json]
+            [--history benchmark_history.sqlite]
+            [--save-baseline main] [--baseline main]
+            [--tolerances benchmarks/tolerances.yaml]
+    Cases whose setup raises NotImplementedError (i.e. missing optional
+    packages) are reported as skipped. Baseline cases that were neither
+    run, skipped nor filtered out fail the comparison as missing.
+'''
+import argparse
+import glob
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from benchmarks.tracker import TOLERANCES, FAILING, History, config_hash, \
+    load_tolerances, compare, print_report
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def discover():
+    '''
+        returns: list of (module name, class name, class)
+    '''
+    suites = []
+    files = sorted(glob.glob(os.path.join(BENCH_DIR, "bench_*.py")))
+    for f in files:
+        name = os.path.splitext(os.path.basename(f))[0]
+        module = importlib.import_module("benchmarks.%s" % name)
+        for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+            if(cls.__module__ == module.__name__
+               and any(m.startswith("time_") for m in dir(cls))):
+                suites.append((name, cls_name, cls))
+    return suites
+
+
+def get_cases(cls, quick=False):
+    '''
+        returns: list of {param_name: value}
+    '''
+    params = getattr(cls, "params", [])
+    param_names = getattr(cls, "param_names", [])
+    if(len(params) > 0 and not isinstance(params[0], (list, tuple))):
+        params = [params]
+    if(quick):
+        # Smallest case only
+        params = [p[:1] for p in params]
+    return [dict(zip(param_names, values))
+            for values in itertools.product(*params)]
+
+
+def case_id(module, cls_name, method, params):
+    p = ",".join("%s=%s" % (k, str(v)) for k, v in params.items())
+    return "%s.%s.%s[%s]" % (module, cls_name, method, p)
+
+
+def time_fn(fn, repeat, min_time, warmup=2):
+    '''
+        Calls per sample are calibrated so one sample lasts
+        at least min_time seconds.
+        returns: np.array of seconds per call, one per sample
+    '''
+    for _ in range(warmup):
+        fn()
+    number = 1
+    while(True):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if(elapsed >= min_time or number >= 2**16):
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return np.array(samples), number
+
+
+def mem_peak(fn):
+    '''
+        Peak memory in MB allocated during one call: python/numpy
+        allocations (tracemalloc) plus torch cuda allocations.
+        torch cpu tensors are not traced.
+    '''
+    import torch
+    use_cuda = torch.cuda.is_available() and torch.cuda.is_initialized()
+    if(use_cuda):
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        cuda_start = torch.cuda.memory_allocated()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if(use_cuda):
+        torch.cuda.synchronize()
+        peak += torch.cuda.max_memory_allocated() - cuda_start
+    return peak / 2**20
+
+
+def get_stats(samples, number):
+    return {"min": float(samples.min()),
+            "median": float(np.median(samples)),
+            "p95": float(np.percentile(samples, 95)),
+            "mean": float(samples.mean()),
+            "std": float(samples.std()),
+            "max": float(samples.max()),
+            "repeat": len(samples),
+            "number": number}
+
+
+def get_settings():
+    '''
+        Measurement settings which change the results, part of
+        the config hash of every case
+    '''
+    import torch
+    from benchmarks.common import DEVICE
+    return {"device": DEVICE,
+            "torch_threads": torch.get_num_threads(),
+            "cuda": torch.cuda.is_available()}
+
+
+def get_meta():
+    import torch
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": platform.node(),
+            "processor": platform.processor() or platform.machine(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads()}
+
+
+def run(filter_regex=None, quick=False, repeat=10, min_time=0.05):
+    '''
+        returns: results,
+        skipped cases [{name, reason}] (setup raised NotImplementedError),
+        deselected case names (by filter_regex or quick)
+    '''
+    pattern = re.compile(filter_regex) if filter_regex else None
+    settings = get_settings()
+    results, skipped, deselected = [], [], []
+    for module, cls_name, cls in discover():
+        methods = sorted(m for m in dir(cls) if m.startswith("time_"))
+        run_cases = get_cases(cls, quick)
+        for params in get_cases(cls):
+            ids = {m: case_id(module, cls_name, m, params) for m in methods}
+            if(params not in run_cases):
+                deselected.extend(ids.values())
+                continue
+            selected = [m for m in methods
+                        if pattern is None or pattern.search(ids[m])]
+            deselected.extend(ids[m] for m in methods if m not in selected)
+            if(len(selected) == 0):
+                continue
+            suite = cls()
+            args = list(params.values())
+            try:
+                if(hasattr(suite, "setup")):
+                    suite.setup(*args)
+            except NotImplementedError as e:
+                # asv convention, case not applicable
+                for m in selected:
+                    skipped.append({"name": ids[m], "reason": str(e)})
+                    print("%-80s skipped: %s" % (ids[m], e))
+                continue
+            try:
+                for m in selected:
+                    fn = getattr(suite, m)
+                    samples, number = time_fn(lambda: fn(*args),
+                                              repeat, min_time)
+                    stats = get_stats(samples, number)
+                    stats["mem_peak_mb"] = mem_peak(lambda: fn(*args))
+                    res = {"name": ids[m],
+                           "benchmark": "%s.%s.%s" % (module, cls_name, m),
+                           "params": params,
+                           "config_hash": config_hash(params, settings),
+                           "stats": stats}
+                    results.append(res)
+                    print("%-80s %10.3f ms  (p95 %.3f, %.1f MB)"
+                          % (ids[m], stats["median"] * 1000,
+                             stats["p95"] * 1000, stats["mem_peak_mb"]))
+                    sys.stdout.flush()
+            finally:
+                if(hasattr(suite, "teardown")):
+                    suite.teardown(*args)
+    return results, skipped, deselected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default=None,
+                        help="Only run cases whose id matches this regex")
+    parser.add_argument("--quick", action="store_true",
+                        help="Only the first value of every param")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="Minimum seconds per sample")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch intra-op threads")
+    parser.add_argument("--output", default=None,
+                        help="Write the results to this json file")
+    parser.add_argument("--history", default=None,
+                        help="Append the results to this sqlite file")
+    parser.add_argument("--save-baseline", default=None, metavar="NAME",
+                        help="Store the results as baseline NAME "
+                             "in the history")
+    parser.add_argument("--baseline", default=None, metavar="NAME",
+                        help="Compare to baseline NAME of the history, "
+                             "exit code 1 on regressions")
+    parser.add_argument("--tolerances", default=TOLERANCES,
+                        help="Relative tolerances of the comparison")
+    args = parser.parse_args(argv)
+    if((args.save_baseline or args.baseline) and not args.history):
+        parser.error("--save-baseline and --baseline need --history")
+
+    import torch
+    if(args.threads is not None):
+        torch.set_num_threads(args.threads)
+    results, skipped, deselected = run(args.filter, args.quick,
+                                       args.repeat, args.min_time)
+    meta = get_meta()
+    if(args.output):
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "results": results,
+                       "skipped": skipped}, f, indent=2)
+    if(args.history is None):
+        return 0
+
+    history = History(args.history)
+    try:
+        report = None
+        if(args.baseline):
+            # Before saving, the run may replace the compared baseline
+            report = compare(results, history.get_baseline(args.baseline),
+                             load_tolerances(args.tolerances),
+                             skipped=skipped, deselected=deselected)
+            print_report(report, args.baseline)
+        run_id = history.add_run(meta, results)
+        if(args.save_baseline):
+            history.save_baseline(args.save_baseline, run_id)
+    finally:
+        history.close()
+    if(report is not None
+       and any(e["status"] in FAILING for e in report)):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+'''
+    End-to-end throughput on the synthetic env (no pybullet):
+    - env: env steps/sec of SyntheticPlayTable + AffordanceWrapperSim
+      with random actions
+    - learner: SAC updates/sec from a filled replay buffer
+      (sample, augmentation, td target and update)
+    - train: env steps/sec and updates/sec of VAPOAgent.learn
+    The wrappers and the agent run unmodified, so the affordance
+    package is needed for the image transforms. Metrics logging is
+    disabled.
+
+    usage:
+        python ./benchmarks/throughput.py [throughput.train_steps=2000]
+            [env.physics_latency=0.004 env.render_latency=0.002]
+            [agent.hyperparameters.batch_size=64] [hydra overrides ...]
+'''
+import json
+import logging
+import time
+import hydra
+import numpy as np
+import torch
+from vapo.wrappers.synthetic_env import SyntheticPlayTable
+from vapo.wrappers.affordance.aff_wrapper_sim import AffordanceWrapperSim
+from vapo.agent.vapo_agent import VAPOAgent
+
+
+class CallCounter():
+    '''
+        Replaces obj.name by a wrapper counting its calls
+    '''
+    def __init__(self, obj, name):
+        self.n = 0
+        self._fn = getattr(obj, name)
+        setattr(obj, name, self)
+
+    def __call__(self, *args, **kwargs):
+        self.n += 1
+        return self._fn(*args, **kwargs)
+
+
+def go_to_target(env):
+    # As VAPOAgent.correct_position, with the env target
+    target_pos, _ = env.get_target_pos()
+    env.curr_detected_obj = np.array(target_pos)
+    env.move_to_target(target_pos)
+    return env.observation(env.get_obs())
+
+
+def run_env(env, n_steps, warmup, replay_buffer=None):
+    env.reset()
+    s = go_to_target(env)
+    n_episodes = 0
+    for i in range(warmup + n_steps):
+        if(i == warmup):
+            start = time.perf_counter()
+        a = env.action_space.sample()
+        ns, r, done, info = env.step(a)
+        if(replay_buffer is not None):
+            replay_buffer.add_transition(s, a, r, ns, done)
+        s = ns
+        if(done):
+            n_episodes += 1
+            env.reset()
+            s = go_to_target(env)
+    elapsed = time.perf_counter() - start
+    return {"env/steps_per_sec": n_steps / elapsed,
+            "env/episodes": n_episodes,
+            "env/time": elapsed}
+
+
+def run_updates(agent, n_updates, warmup):
+    for i in range(warmup + n_updates):
+        if(i == warmup):
+            start = time.perf_counter()
+        agent._train_update()
+    if(agent.device != "cpu"):
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return {"learner/updates_per_sec": n_updates / elapsed,
+            "learner/time": elapsed}
+
+
+def run_train(agent, env, n_steps, learn_cfg):
+    env_steps = CallCounter(env, "step")
+    train_steps = CallCounter(agent, "training_step")
+    updates = CallCounter(agent, "_train_update")
+    start = time.perf_counter()
+    agent.learn(total_timesteps=n_steps,
+                log_interval=learn_cfg.log_interval,
+                full_eval_interval=learn_cfg.full_eval_interval,
+                max_episode_length=learn_cfg.max_episode_length,
+                n_eval_ep=learn_cfg.n_eval_ep)
+    elapsed = time.perf_counter() - start
+    # Includes the evaluation episodes of learn
+    return {"train/env_steps_per_sec": env_steps.n / elapsed,
+            "train/train_steps_per_sec": train_steps.n / elapsed,
+            "train/updates_per_sec": updates.n / elapsed,
+            "train/env_steps": env_steps.n,
+            "train/updates": updates.n,
+            "train/episodes": agent.episode - 1,
+            "train/time": elapsed}
+
+
+@hydra.main(config_path="../config", config_name="cfg_throughput")
+def main(cfg):
+    log = logging.getLogger(__name__)
+    if(cfg.agent.hyperparameters.device == "auto"):
+        cfg.agent.hyperparameters.device = \
+            "cuda" if torch.cuda.is_available() else "cpu"
+
+    bench_cfg = cfg.throughput
+    learn_cfg = cfg.agent.learn_config
+    max_ts = learn_cfg.max_episode_length
+    env = SyntheticPlayTable(**cfg.env)
+    training_env = AffordanceWrapperSim(env, max_ts,
+                                        train=True,
+                                        affordance_cfg=cfg.affordance,
+                                        viz=False,
+                                        save_images=False,
+                                        **cfg.env_wrapper)
+    sac_cfg = {"env": training_env,
+               "eval_env": None,
+               "model_name": cfg.model_name,
+               "save_dir": cfg.agent.save_dir,
+               "net_cfg": cfg.agent.net_cfg,
+               "train_mean_n_ep": cfg.agent.train_mean_n_ep,
+               "save_replay_buffer": False,
+               "log": log,
+               **cfg.agent.hyperparameters}
+    agent = VAPOAgent(cfg, sac_cfg=sac_cfg, wandb_login=None)
+
+    results = {"device": agent.device,
+               "batch_size": agent.batch_size}
+    # Transitions also fill the replay buffer for the learner
+    n_env_steps = max(bench_cfg.env_steps, agent.batch_size)
+    results.update(run_env(training_env, n_env_steps, bench_cfg.warmup,
+                           agent._replay_buffer))
+    results.update(run_updates(agent, bench_cfg.updates, bench_cfg.warmup))
+    results.update(run_train(agent, training_env,
+                             bench_cfg.train_steps, learn_cfg))
+    agent._checkpoints.close()
+    training_env.close()
+
+    for k, v in results.items():
+        log.info("%-45s %s" % (k, "%.3f" % v if isinstance(v, float) else v))
+    with open("throughput.json", "w") as f:
+        json.dump({k: (float(v) if isinstance(v, (float, np.floating)) else v)
+                   for k, v in results.items()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+'''
+    Benchmark history and regression checks.
+    Every run of benchmarks/run.py with --history is stored in a sqlite
+    file, a run can be saved as a named baseline and later runs are
+    compared against it with per benchmark tolerances (tolerances.yaml).
+'''
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from omegaconf import OmegaConf
+
+TOLERANCES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "tolerances.yaml")
+# Statuses of the comparison which fail the run
+FAILING = ["regression", "missing"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT, git_commit TEXT, machine TEXT, meta TEXT);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER REFERENCES runs(id),
+    name TEXT, benchmark TEXT, params TEXT, config_hash TEXT,
+    median REAL, p95 REAL, min REAL, mean REAL, std REAL,
+    mem_peak_mb REAL);
+CREATE INDEX IF NOT EXISTS results_name ON results (name);
+CREATE TABLE IF NOT EXISTS baselines (
+    baseline TEXT, name TEXT, run_id INTEGER, config_hash TEXT,
+    median REAL, p95 REAL, mem_peak_mb REAL,
+    PRIMARY KEY (baseline, name));
+"""
+
+
+def config_hash(params, settings):
+    '''
+        Cases are only compared when the benchmark params and the
+        measurement settings (device, threads, ...) are the same.
+    '''
+    s = json.dumps({"params": params, "settings": settings},
+                   sort_keys=True, default=str)
+    return hashlib.sha1(s.encode()).hexdigest()[:12]
+
+
+class History():
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add_run(self, meta, results):
+        '''
+            returns: id of the new run
+        '''
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO runs (date, git_commit, machine, meta) "
+                "VALUES (?, ?, ?, ?)",
+                (meta["date"], meta["commit"], meta["machine"],
+                 json.dumps(meta)))
+            run_id = cur.lastrowid
+            self.db.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, r["name"], r["benchmark"],
+                  json.dumps(r["params"], default=str), r["config_hash"],
+                  r["stats"]["median"], r["stats"]["p95"],
+                  r["stats"]["min"], r["stats"]["mean"], r["stats"]["std"],
+                  r["stats"]["mem_peak_mb"])
+                 for r in results])
+        return run_id
+
+    def save_baseline(self, baseline, run_id):
+        '''
+            Cases of run_id replace the cases of the same name in baseline,
+            other cases of the baseline are kept.
+        '''
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO baselines "
+                "SELECT ?, name, run_id, config_hash, median, p95, "
+                "mem_peak_mb FROM results WHERE run_id = ?",
+                (baseline, run_id))
+
+    def get_baseline(self, baseline):
+        '''
+            returns: {case name: {config_hash, median, p95,
+                                  mem_peak_mb, commit}}
+        '''
+        rows = self.db.execute(
+            "SELECT b.name, b.config_hash, b.median, b.p95, b.mem_peak_mb, "
+            "r.git_commit FROM baselines b JOIN runs r ON b.run_id = r.id "
+            "WHERE b.baseline = ?", (baseline,))
+        return {name: {"config_hash": h, "median": median, "p95": p95,
+                       "mem_peak_mb": mem, "commit": commit}
+                for name, h, median, p95, mem, commit in rows}
+
+    def get_case_history(self, name, limit=20):
+        '''
+            returns: list of (date, commit, median, p95, mem_peak_mb),
+            most recent first
+        '''
+        return self.db.execute(
+            "SELECT r.date, r.git_commit, s.median, s.p95, s.mem_peak_mb "
+            "FROM results s JOIN runs r ON s.run_id = r.id "
+            "WHERE s.name = ? ORDER BY r.id DESC LIMIT ?",
+            (name, limit)).fetchall()
+
+
+def load_tolerances(path=TOLERANCES):
+    return OmegaConf.load(path)
+
+
+def get_tolerance(name, tolerances):
+    '''
+        Relative tolerances {time, memory} of a case. The first pattern of
+        tolerances.benchmarks found in the case name overrides the default.
+    '''
+    tol = dict(tolerances.default)
+    for pattern, override in tolerances.get("benchmarks", {}).items():
+        if(re.search(pattern, name)):
+            tol.update(override)
+            break
+    return tol
+
+
+def _rel_change(new, old):
+    if(new is None or old is None or old <= 0):
+        return 0.0
+    return (new - old) / old
+
+
+def compare(results, baseline, tolerances, min_mem_mb=1.0,
+            skipped=(), deselected=()):
+    '''
+        Compares the median time and the memory peak of every case
+        to the baseline. Memory below min_mem_mb is not compared.
+        Skipped cases are always reported, baseline cases without a
+        result are missing unless they were deselected (filter, quick).
+        returns: list of {name, status, time_change, mem_change},
+        status is one of regression, improved, ok, new, changed-config,
+        skipped, missing
+    '''
+    report = []
+    for r in results:
+        name = r["name"]
+        entry = {"name": name, "time_change": None, "mem_change": None}
+        ref = baseline.get(name)
+        if(ref is None):
+            entry["status"] = "new"
+        elif(ref["config_hash"] != r["config_hash"]):
+            entry["status"] = "changed-config"
+        else:
+            tol = get_tolerance(name, tolerances)
+            time_change = _rel_change(r["stats"]["median"], ref["median"])
+            mem_change = 0.0
+            if(max(r["stats"]["mem_peak_mb"] or 0,
+                   ref["mem_peak_mb"] or 0) >= min_mem_mb):
+                mem_change = _rel_change(r["stats"]["mem_peak_mb"],
+                                         ref["mem_peak_mb"])
+            entry["time_change"] = time_change
+            entry["mem_change"] = mem_change
+            if(time_change > tol["time"] or mem_change > tol["memory"]):
+                entry["status"] = "regression"
+            elif(time_change < -tol["time"]):
+                entry["status"] = "improved"
+            else:
+                entry["status"] = "ok"
+        report.append(entry)
+
+    skipped = {s["name"] for s in skipped}
+    ran = {r["name"] for r in results}
+    deselected = set(deselected)
+    for name in sorted(set(baseline) | skipped):
+        if(name in ran or name in deselected):
+            continue
+        report.append({"name": name, "time_change": None, "mem_change": None,
+                       "status": "skipped" if name in skipped else "missing"})
+    return report
+
+
+def print_report(report, baseline_name):
+    def fmt(change):
+        return "      -" if change is None else "%+6.1f%%" % (change * 100)
+
+    print("\nComparison to baseline '%s'" % baseline_name)
+    for entry in report:
+        print("%-80s %s time %s mem  %s"
+              % (entry["name"], fmt(entry["time_change"]),
+                 fmt(entry["mem_change"]), entry["status"]))
+    counts = {}
+    for entry in report:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    print(", ".join("%d %s" % (n, s) for s, n in sorted(counts.items())))
@@ -5,7 +5,8 @@ import logging
 from robot_io.cams.realsense.realsense import Realsense
 from vapo.wrappers.real_world.panda_tabletop_wrapper import PandaEnvWrapper
 from vapo.wrappers.affordance.aff_wrapper_real_world import AffordanceWrapperRealWorld
-from vapo.agent.vapo_agent import VAPOAgent
+from vapo.agent.vapo_real_world import VAPOAgent
+from vapo.agent.core.policy_bundle import load_policy_bundle
 from omegaconf import OmegaConf
 
 
@@ -40,20 +41,39 @@ def main(cfg):
     run_cfg.save_images = cfg.save_images
     log.info("model: %s" % run_cfg.model_name)
 
+    path = "%s/trained_models/%s.pth" % (cfg.test.folder_name,
+                                         cfg.test.model_name)
+    # Policy only bundle (scripts/export_bundle.py) if available,
+    # acts without building the critics and the replay buffer
+    bundle_path = "%s/trained_models/%s.safetensors" % (cfg.test.folder_name,
+                                                        cfg.test.model_name)
+    policy = None
+    if(os.path.exists(bundle_path)):
+        policy = load_policy_bundle(bundle_path, env.observation_space,
+                                    env.action_space, run_cfg.agent.net_cfg,
+                                    device=sac_cfg.get("device", "cuda"),
+                                    log=log)
+    elif(not os.path.exists(path)):
+        print("Model path does not exist: %s \n" % os.path.abspath(path))
+        return
+
     model = VAPOAgent(run_cfg,
                       sac_cfg=sac_cfg,
-                      target_search_mode=run_cfg.target_search,
-                      rand_target=True)
+                      rand_target=True,
+                      policy=policy)
 
     original_dir = hydra.utils.get_original_cwd()
     model_path = os.path.join(original_dir, cfg.resume_model_path)
-    path = "%s/trained_models/%s.pth" % (cfg.test.folder_name,
-                                         cfg.test.model_name)
-    if(os.path.exists(path)):
-        model.load(path, load_replay_buffer=False)
-    else:
-        print("Model path does not exist: %s \n" % os.path.abspath(path))
-        return
+    if(policy is None):
+        model.load(path)
+    if(cfg.test.get("exported_policy")):
+        model.load_exported(os.path.join(cfg.test.folder_name,
+                                         cfg.test.exported_policy))
+    if(cfg.test.get("quantize")):
+        calib_dir = os.path.join(cfg.test.folder_name,
+                                 "trained_models/replay_buffer")
+        model.load_quantized(cfg.test.quantize, calib_dir,
+                             cfg.test.calib_n_samples)
     # model.evaluate(env, deterministic=True,
     #                    **cfg.test.eval_cfg)
     model.tidy_up(env, deterministic=True,
@@ -0,0 +1,48 @@
+import hydra
+import os
+import logging
+import torch
+from vapo.wrappers.play_table_rl import PlayTableRL
+from vapo.wrappers.affordance.aff_wrapper_sim import AffordanceWrapperSim
+from vapo.agent.core.policy_bundle import build_actor, save_bundle
+from vapo.utils.utils import load_cfg
+
+
+@hydra.main(config_path="../config", config_name="cfg_tabletop")
+def main(cfg):
+    '''
+        Writes the policy weights of a trained model to
+        run_dir/trained_models/model_name.safetensors, loaded by the
+        test scripts instead of the full checkpoint.
+        Only the actor is built, the env is used for the spaces.
+    '''
+    log = logging.getLogger(__name__)
+    original_dir = hydra.utils.get_original_cwd()
+    run_dir = os.path.join(original_dir, cfg.test.folder_name)
+    run_dir = os.path.abspath(run_dir)
+    run_cfg, net_cfg, env_wrapper, agent_cfg =\
+        load_cfg(os.path.join(run_dir, ".hydra/config.yaml"),
+                 cfg, optim_res=False)
+    run_cfg.env.show_gui = False
+    max_ts = cfg.agent.learn_config.max_episode_length
+
+    env = PlayTableRL(viz=False, save_images=False, **run_cfg.env)
+    env = AffordanceWrapperSim(env, max_ts,
+                               affordance_cfg=run_cfg.affordance,
+                               **run_cfg.env_wrapper)
+    models_dir = os.path.join(run_dir, "trained_models")
+    path = os.path.join(models_dir, "%s.pth" % cfg.test.model_name)
+    checkpoint = torch.load(path, map_location="cpu")
+    actor = build_actor(env.observation_space, env.action_space,
+                        net_cfg, log=log)
+    actor.load_state_dict(checkpoint['actor_dict'])
+
+    bundle_path = os.path.join(models_dir, "%s.safetensors"
+                               % cfg.test.model_name)
+    save_bundle(actor, env.observation_space, env.action_space, bundle_path)
+    log.info("Saved policy bundle to %s" % bundle_path)
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import hydra
+import os
+import logging
+from vapo.wrappers.play_table_rl import PlayTableRL
+from vapo.wrappers.affordance.aff_wrapper_sim import AffordanceWrapperSim
+from vapo.agent.vapo_agent import VAPOAgent
+from vapo.agent.core.policy_export import export_policy, benchmark_export
+from vapo.utils.utils import load_cfg
+
+
+@hydra.main(config_path="../config", config_name="cfg_tabletop")
+def main(cfg):
+    '''
+        Exports the deterministic policy of a trained model to
+        run_dir/trained_models and compares the cpu latency per action
+        against the eager policy.
+    '''
+    log = logging.getLogger(__name__)
+    original_dir = hydra.utils.get_original_cwd()
+    run_dir = os.path.join(original_dir, cfg.test.folder_name)
+    run_dir = os.path.abspath(run_dir)
+    run_cfg, net_cfg, env_wrapper, agent_cfg =\
+        load_cfg(os.path.join(run_dir, ".hydra/config.yaml"),
+                 cfg, optim_res=False)
+    run_cfg.env.show_gui = False
+    max_ts = cfg.agent.learn_config.max_episode_length
+
+    env = PlayTableRL(viz=False, save_images=False, **run_cfg.env)
+    env = AffordanceWrapperSim(env, max_ts,
+                               affordance_cfg=run_cfg.affordance,
+                               **run_cfg.env_wrapper)
+    sac_cfg = {"env": env,
+               "model_name": run_cfg.model_name,
+               "save_dir": run_cfg.agent.save_dir,
+               "net_cfg": net_cfg,
+               **agent_cfg}
+    model = VAPOAgent(run_cfg, sac_cfg=sac_cfg)
+    models_dir = os.path.join(run_dir, "trained_models")
+    path = os.path.join(models_dir, "%s.pth" % cfg.test.model_name)
+    model.load(path)
+
+    export_format = cfg.test.get("export_format", "torchscript")
+    ext = "onnx" if export_format == "onnx" else "pt"
+    export_path = os.path.join(models_dir, "%s_policy.%s"
+                               % (cfg.test.model_name, ext))
+    export_policy(model._pi, env.observation_space, env.action_space,
+                  export_path, export_format=export_format)
+    log.info("Exported policy to %s" % export_path)
+
+    # Latency per action on cpu, in the hydra run dir
+    benchmark_export(model._pi, env.observation_space, env.action_space,
+                     os.getcwd(),
+                     n_iters=cfg.test.get("benchmark_iters", 200),
+                     log=log)
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
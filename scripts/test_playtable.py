@@ -3,6 +3,7 @@ import os
 from vapo.wrappers.play_table_rl import PlayTableRL
 from vapo.wrappers.affordance.aff_wrapper_sim import AffordanceWrapperSim
 from vapo.agent.vapo_agent import VAPOAgent
+from vapo.agent.core.policy_bundle import load_policy_bundle
 from vapo.utils.utils import load_cfg
 
 
@@ -38,11 +39,31 @@ def main(cfg):
                **agent_cfg}
 
     run_cfg.target_search.mode = 'affordance'
-    model = VAPOAgent(run_cfg,
-                      sac_cfg=sac_cfg)
     path = "%s/trained_models/%s.pth" % (run_dir,
                                          cfg.test.model_name)
-    success = model.load(path)
+    # Policy only bundle (scripts/export_bundle.py) if available,
+    # acts without building the critics and the replay buffer
+    bundle_path = "%s/trained_models/%s.safetensors" % (run_dir,
+                                                        cfg.test.model_name)
+    policy = None
+    if(os.path.isfile(bundle_path)):
+        policy = load_policy_bundle(bundle_path, env.observation_space,
+                                    env.action_space, net_cfg,
+                                    device=sac_cfg.get("device", "cuda"))
+    model = VAPOAgent(run_cfg,
+                      sac_cfg=sac_cfg,
+                      policy=policy)
+    if(policy is not None):
+        success = True
+    else:
+        success = model.load(path)
+    if(success and cfg.test.get("exported_policy")):
+        model.load_exported(os.path.join(run_dir,
+                                         cfg.test.exported_policy))
+    if(success and cfg.test.get("quantize")):
+        calib_dir = os.path.join(run_dir, "trained_models/replay_buffer")
+        model.load_quantized(cfg.test.quantize, calib_dir,
+                             cfg.test.calib_n_samples)
     if(success):
         model.evaluate(env, **cfg.test.eval_cfg)
     env.close()
@@ -0,0 +1,167 @@
+import atexit
+import collections
+import copy
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import threading
+import time
+import torch
+
+
+def snapshot(obj):
+    '''
+        Copy of a (nested) state dict with all tensors in cpu memory,
+        so training can continue while it is written.
+    '''
+    if(torch.is_tensor(obj)):
+        return obj.detach().to("cpu", copy=True)
+    elif(isinstance(obj, dict)):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    elif(isinstance(obj, (list, tuple))):
+        return type(obj)(snapshot(v) for v in obj)
+    return copy.copy(obj)
+
+
+def digest(obj, h=None):
+    '''
+        Content hash of a snapshot: tensor bytes, dtypes and shapes,
+        other values by repr
+    '''
+    top = h is None
+    if(top):
+        h = hashlib.blake2b(digest_size=16)
+    if(torch.is_tensor(obj)):
+        h.update(("%s%s" % (obj.dtype, tuple(obj.shape))).encode())
+        h.update(obj.contiguous().reshape(-1).view(torch.uint8).numpy())
+    elif(isinstance(obj, dict)):
+        h.update(b"{")
+        for k, v in obj.items():
+            h.update(repr(k).encode())
+            digest(v, h)
+        h.update(b"}")
+    elif(isinstance(obj, (list, tuple))):
+        h.update(b"[")
+        for v in obj:
+            digest(v, h)
+        h.update(b"]")
+    else:
+        h.update(repr(obj).encode())
+    return h.hexdigest() if top else None
+
+
+class CheckpointWriter():
+    '''
+        Writes checkpoints on a background thread.
+        - Payloads are snapshotted to cpu memory in save(), the disk
+          I/O happens in the worker.
+        - Files are written to path.tmp and renamed, a crash never
+          leaves a partially written checkpoint.
+        - A save with the same contents (digest of the snapshot) as the
+          previously written file is hardlinked to it instead of
+          serialized again.
+        - Pending writes of the same path are replaced by the newest one.
+        - min_interval: minimum seconds between writes of the same path,
+          unless force=True.
+    '''
+    def __init__(self, min_interval=0, log=None):
+        self.min_interval = min_interval
+        self.log = log if log else logging.getLogger(__name__)
+        self._pending = collections.OrderedDict()
+        self._n_calls = itertools.count()
+        self._written = {}  # path: digest on disk
+        self._last_write = {}  # path: time
+        self._last_path = None  # latest file written by the worker
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="CheckpointWriter")
+        self._thread.start()
+        atexit.register(self.close)
+
+    def save(self, state, path, force=False):
+        '''
+            state: dict to torch.save, or a callable producing it
+            returns: True if the checkpoint was scheduled
+        '''
+        now = time.time()
+        if(not force and
+           now - self._last_write.get(path, -float("inf")) < self.min_interval):
+            return False
+        self._last_write[path] = now
+
+        payload = snapshot(state() if callable(state) else state)
+        with self._cond:
+            self._pending.pop(path, None)
+            self._pending[path] = {"payload": payload}
+            self._cond.notify()
+        return True
+
+    def submit(self, fn, *args):
+        '''
+            Runs fn(*args) in the writer thread, after the pending writes
+        '''
+        with self._cond:
+            self._pending[("call", next(self._n_calls))] = \
+                {"fn": fn, "args": args}
+            self._cond.notify()
+
+    def _write(self, path, job):
+        tmp_path = "%s.tmp" % path
+        src = self._last_path
+        if(os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+        key = digest(job["payload"])
+        if(src is not None and src != path
+           and self._written.get(src) == key and os.path.isfile(src)):
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                # File system without hardlinks
+                shutil.copyfile(src, tmp_path)
+        else:
+            torch.save(job["payload"], tmp_path)
+        os.replace(tmp_path, path)
+        self._written[path] = key
+        self._last_path = path
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while(not self._pending and not self._closed):
+                    self._cond.wait()
+                if(not self._pending and self._closed):
+                    return
+                key, job = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                if("fn" in job):
+                    job["fn"](*job["args"])
+                else:
+                    self._write(key, job)
+            except Exception as e:
+                self.log.error("Checkpoint writer failed on %s: %s"
+                               % (str(key), e))
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self):
+        '''
+            Blocks until all scheduled checkpoints are on disk
+        '''
+        with self._cond:
+            while(self._pending or self._busy):
+                self._cond.wait()
+
+    def close(self):
+        if(self._closed):
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
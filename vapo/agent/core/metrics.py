@@ -0,0 +1,75 @@
+import torch
+
+REDUCTIONS = ["mean", "min", "max", "last"]
+
+
+class MetricsAccumulator():
+    '''
+        Running statistics of scalar training metrics kept on the device
+        of the values, so no host-device sync is needed per update.
+        flush() transfers all the reduced values at once.
+        reductions: {key: reduction or list of reductions},
+        keys not in reductions use default.
+        A key with a list of reductions is logged as key_<reduction>.
+    '''
+    def __init__(self, reductions=None, default="last"):
+        self.reductions = dict(reductions) if reductions else {}
+        self.default = default
+        for red in list(self.reductions.values()) + [default]:
+            red = [red] if isinstance(red, str) else red
+            for r in red:
+                if(r not in REDUCTIONS):
+                    raise ValueError("Unknown reduction %s, options: %s"
+                                     % (r, REDUCTIONS))
+        self.reset()
+
+    def reset(self):
+        self._stats = {}
+        self._count = {}
+
+    def __len__(self):
+        return len(self._stats)
+
+    def add(self, key, value):
+        if(torch.is_tensor(value)):
+            value = value.detach().float()
+        else:
+            value = torch.tensor(float(value))
+        stats = self._stats.get(key)
+        if(stats is None):
+            self._stats[key] = {"sum": value.clone(), "min": value.clone(),
+                                "max": value.clone(), "last": value}
+            self._count[key] = 1
+        else:
+            stats["sum"] = stats["sum"] + value
+            stats["min"] = torch.minimum(stats["min"], value)
+            stats["max"] = torch.maximum(stats["max"], value)
+            stats["last"] = value
+            self._count[key] += 1
+
+    def _reduce(self, key, reduction):
+        stats = self._stats[key]
+        if(reduction == "mean"):
+            return stats["sum"] / self._count[key]
+        return stats[reduction]
+
+    def flush(self, prefix=""):
+        '''
+            returns: {prefix + key: float} and resets the statistics
+        '''
+        names, values = [], []
+        for key in self._stats.keys():
+            reduction = self.reductions.get(key, self.default)
+            if(not isinstance(reduction, str)):
+                for r in reduction:
+                    names.append("%s%s_%s" % (prefix, key, r))
+                    values.append(self._reduce(key, r))
+            else:
+                names.append(prefix + key)
+                values.append(self._reduce(key, reduction))
+        self.reset()
+        if(len(values) == 0):
+            return {}
+        device = values[0].device
+        values = torch.stack([v.to(device) for v in values]).cpu().tolist()
+        return dict(zip(names, values))
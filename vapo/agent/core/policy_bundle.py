@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import struct
+import numpy as np
+import torch
+from vapo.agent.core.policy_export import get_obs_spec, \
+    DeterministicPolicy
+from vapo.agent.core.utils import get_nets, is_img_obs
+
+# Layout of the safetensors format: 8 bytes little endian header size,
+# json header {name: {dtype, shape, data_offsets}, __metadata__: {}}
+# and the raw tensor bytes. Can be memory mapped, no pickle involved.
+_DTYPES = {torch.float32: ("F32", np.float32),
+           torch.float64: ("F64", np.float64),
+           torch.float16: ("F16", np.float16),
+           torch.int64: ("I64", np.int64),
+           torch.int32: ("I32", np.int32),
+           torch.uint8: ("U8", np.uint8),
+           torch.bool: ("BOOL", np.bool_)}
+_NP_DTYPES = {name: np_dtype for name, np_dtype in _DTYPES.values()}
+
+
+def save_bundle(policy, obs_space, action_space, path):
+    '''
+        Writes only the policy weights and the observation/action spec
+        of the policy.
+    '''
+    spec = get_obs_spec(obs_space, action_space)
+    spec["policy"] = type(policy).__name__
+
+    header, arrays, offset = {}, [], 0
+    for name, tensor in policy.state_dict().items():
+        if(tensor.dtype not in _DTYPES):
+            raise TypeError("Cannot store %s of type %s"
+                            % (name, tensor.dtype))
+        array = tensor.detach().cpu().contiguous().numpy()
+        header[name] = {"dtype": _DTYPES[tensor.dtype][0],
+                        "shape": list(array.shape),
+                        "data_offsets": [offset, offset + array.nbytes]}
+        arrays.append(array)
+        offset += array.nbytes
+    header["__metadata__"] = {"spec": json.dumps(spec)}
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # Tensor data aligned to 8 bytes
+    header += b" " * (-len(header) % 8)
+
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for array in arrays:
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_bundle(path):
+    '''
+        Memory maps the policy weights of the bundle.
+        returns: state_dict {name: torch.tensor (cpu)}, spec dict
+    '''
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    spec = json.loads(header.pop("__metadata__")["spec"])
+    data_start = 8 + header_size
+
+    state_dict = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        dtype = _NP_DTYPES[info["dtype"]]
+        count = (end - start) // np.dtype(dtype).itemsize
+        if(count == 0):
+            array = np.zeros(info["shape"], dtype=dtype)
+        else:
+            # Copy on write, the file is never modified
+            array = np.memmap(path, dtype=dtype, mode="c",
+                              offset=data_start + start,
+                              shape=tuple(info["shape"]))
+        state_dict[name] = torch.from_numpy(array)
+    return state_dict, spec
+
+
+def check_spec(spec, obs_space, action_space):
+    '''
+        Raises a ValueError if the bundle was exported for a different
+        observation/action space.
+    '''
+    env_spec = get_obs_spec(obs_space, action_space)
+    for key in ["obs_keys", "obs_shapes"]:
+        if(spec[key] != env_spec[key]):
+            raise ValueError("Bundle %s %s does not match the env: %s"
+                             % (key, str(spec[key]), str(env_spec[key])))
+    for key in ["action_low", "action_high"]:
+        if(not np.allclose(spec[key], env_spec[key])):
+            raise ValueError("Bundle %s %s does not match the env: %s"
+                             % (key, str(spec[key]), str(env_spec[key])))
+
+
+def build_actor(obs_space, action_space, net_cfg, actor_net=None, log=None):
+    '''
+        Policy network of SAC for the given spaces, without the critics.
+        actor_net: class name, defaults to net_cfg.actor_net
+    '''
+    log = log or logging.getLogger(__name__)
+    if(actor_net is None and "actor_net" in net_cfg):
+        actor_net = net_cfg.actor_net
+    policy_net, _, obs_space, action_dim = \
+        get_nets(is_img_obs(obs_space), obs_space, action_space,
+                 log, actor_net)
+    return policy_net(obs_space, action_dim,
+                      action_space=action_space,
+                      **net_cfg)
+
+
+def load_policy_bundle(path, obs_space, action_space, net_cfg,
+                       device="cpu", log=None):
+    '''
+        Standalone deterministic policy of a bundle, for evaluation.
+        Only the actor is built, the weights stay memory mapped on cpu.
+        returns: DeterministicPolicy, acts like SAC._pi
+    '''
+    if(not os.path.isfile(path)):
+        raise TypeError(
+            "Bundle path does not exist: %s \n" % os.path.abspath(path))
+    state_dict, spec = load_bundle(path)
+    check_spec(spec, obs_space, action_space)
+    actor = build_actor(obs_space, action_space, net_cfg,
+                        actor_net=spec["policy"], log=log)
+    # assign: use the mapped tensors instead of copying them
+    actor.load_state_dict(state_dict, assign=True)
+    policy = DeterministicPolicy(actor, spec["obs_keys"])
+    return policy.eval().to(device)
@@ -0,0 +1,196 @@
+import copy
+import json
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+EXPORT_FORMATS = ["torchscript", "onnx"]
+_SPEC_FILE = "spec.json"
+
+
+class DeterministicPolicy(nn.Module):
+    '''
+        Deterministic action of a policy for a fixed observation spec.
+        Takes one tensor per observation key, in the order of obs_keys,
+        so the dict handling of get_concat_features is resolved at export.
+    '''
+    def __init__(self, policy, obs_keys):
+        super(DeterministicPolicy, self).__init__()
+        self.policy = policy
+        self.obs_keys = list(obs_keys)
+
+    def forward(self, *obs):
+        obs = dict(zip(self.obs_keys, obs))
+        action, _ = self.policy.act(obs, deterministic=True)
+        return action
+
+    def act(self, curr_obs, deterministic=True, reparametrize=False):
+        if(not deterministic):
+            raise ValueError("DeterministicPolicy only supports deterministic actions")
+        return self.policy.act(curr_obs, deterministic=True)
+
+
+def get_obs_spec(obs_space, action_space):
+    '''
+        Fixed observation spec of a single (unbatched) observation,
+        as used when acting in the environment.
+    '''
+    return {"obs_keys": list(obs_space.spaces.keys()),
+            "obs_shapes": [list(s.shape) for s in obs_space.spaces.values()],
+            "action_low": np.asarray(action_space.low).tolist(),
+            "action_high": np.asarray(action_space.high).tolist()}
+
+
+def example_inputs(spec, device="cpu"):
+    return tuple(torch.zeros(shape, device=device)
+                 for shape in spec["obs_shapes"])
+
+
+def export_policy(policy, obs_space, action_space, path,
+                  export_format="torchscript", device="cpu"):
+    '''
+        Writes the deterministic policy for the given observation
+        space to path.
+        - torchscript: traced and frozen module, spec stored as extra file.
+        - onnx: onnx graph, spec stored in path.json.
+    '''
+    if(export_format not in EXPORT_FORMATS):
+        raise ValueError("Unknown export format %s, options: %s"
+                         % (export_format, EXPORT_FORMATS))
+    spec = get_obs_spec(obs_space, action_space)
+    module = DeterministicPolicy(copy.deepcopy(policy), spec["obs_keys"])
+    module = module.to(device).eval()
+    inputs = example_inputs(spec, device)
+
+    if(export_format == "torchscript"):
+        with torch.no_grad():
+            traced = torch.jit.trace(module, inputs, check_trace=False)
+            traced = torch.jit.freeze(traced)
+        torch.jit.save(traced, path,
+                       _extra_files={_SPEC_FILE: json.dumps(spec)})
+    else:
+        torch.onnx.export(module, inputs, path,
+                          input_names=spec["obs_keys"],
+                          output_names=["action"],
+                          opset_version=17)
+        with open(path + ".json", "w") as f:
+            json.dump(spec, f)
+    return path
+
+
+def compile_policy(policy, obs_keys):
+    '''
+        In process torch.compile of the deterministic policy.
+        Returns None if the installed torch does not support it.
+    '''
+    if(not hasattr(torch, "compile")):
+        return None
+    module = DeterministicPolicy(policy, obs_keys).eval()
+    return torch.compile(module)
+
+
+class ExportedPolicy():
+    '''
+        Exported deterministic policy with the same act interface as the
+        policy networks, so it can be given to the RolloutEngine.
+    '''
+    def __init__(self, path, device="cpu"):
+        self.path = path
+        self.device = device
+        self._session = None
+        if(path.endswith(".onnx")):
+            import onnxruntime
+            with open(path + ".json") as f:
+                self.spec = json.load(f)
+            self._session = onnxruntime.InferenceSession(
+                path, providers=["CPUExecutionProvider"])
+            self.device = "cpu"
+        else:
+            extra_files = {_SPEC_FILE: ""}
+            self._module = torch.jit.load(path, map_location=device,
+                                          _extra_files=extra_files)
+            self.spec = json.loads(extra_files[_SPEC_FILE])
+        self.obs_keys = self.spec["obs_keys"]
+
+    def forward(self, *obs):
+        if(self._session is not None):
+            feed = {k: v.cpu().numpy() for k, v in zip(self.obs_keys, obs)}
+            action = self._session.run(None, feed)[0]
+            return torch.from_numpy(action)
+        return self._module(*obs)
+
+    def act(self, curr_obs, deterministic=True, reparametrize=False):
+        if(not deterministic):
+            raise ValueError("Exported policy only supports deterministic actions")
+        obs = [curr_obs[k] for k in self.obs_keys]
+        return self.forward(*obs), None
+
+    def __call__(self, *obs):
+        return self.forward(*obs)
+
+
+def load_policy(path, device="cpu"):
+    if(not os.path.isfile(path)):
+        raise FileNotFoundError("Exported policy not found: %s" % path)
+    return ExportedPolicy(path, device)
+
+
+def latency_stats(fn, inputs, n_iters=200, warmup=20):
+    '''
+        Per call latency of fn(*inputs) in milliseconds.
+    '''
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + n_iters):
+            start = time.perf_counter()
+            fn(*inputs)
+            if(i >= warmup):
+                times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    return {"p50": np.percentile(times, 50),
+            "p99": np.percentile(times, 99),
+            "mean": times.mean()}
+
+
+def benchmark_export(policy, obs_space, action_space, out_dir,
+                     n_iters=200, warmup=20, formats=None, log=None):
+    '''
+        Compares the per action latency on cpu of the eager policy with
+        the exported (and compiled) versions.
+        returns: {name: {"p50": ms, "p99": ms, "mean": ms}}
+    '''
+    formats = EXPORT_FORMATS if formats is None else formats
+    spec = get_obs_spec(obs_space, action_space)
+    inputs = example_inputs(spec)
+    eager = DeterministicPolicy(copy.deepcopy(policy).cpu(),
+                                spec["obs_keys"]).eval()
+    policies = {"eager": eager}
+    for export_format in formats:
+        ext = "onnx" if export_format == "onnx" else "pt"
+        path = os.path.join(out_dir, "policy.%s" % ext)
+        try:
+            export_policy(policy, obs_space, action_space, path,
+                          export_format=export_format)
+            policies[export_format] = load_policy(path)
+        except Exception as e:
+            # i.e. onnx exporter or onnxruntime not installed
+            if(log):
+                log.warning("Skipping %s: %s" % (export_format, e))
+    _compiled = compile_policy(copy.deepcopy(eager.policy), spec["obs_keys"])
+    if(_compiled is not None):
+        policies["compile"] = _compiled
+
+    results = {}
+    for name, fn in policies.items():
+        try:
+            results[name] = latency_stats(fn, inputs, n_iters, warmup)
+        except RuntimeError as e:
+            if(log):
+                log.warning("Skipping %s: %s" % (name, e))
+            continue
+        if(log):
+            log.info("%s: p50 %.3fms, p99 %.3fms"
+                     % (name, results[name]["p50"], results[name]["p99"]))
+    return results
@@ -0,0 +1,161 @@
+import copy
+import glob
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+try:
+    from torch.ao import quantization as tq
+except ImportError:  # torch < 1.10
+    from torch import quantization as tq
+from vapo.agent.networks.networks_common import CNNCommon
+
+QUANTIZATION_MODES = ["dynamic", "static"]
+# Activations of get_activation_fn as modules, tq.convert
+# replaces them by their int8 versions
+ACTIVATION_MODULES = {F.relu: nn.ReLU,
+                      F.elu: nn.ELU,
+                      F.leaky_relu: nn.LeakyReLU}
+
+
+class QuantizedCNNCommon(nn.Module):
+    '''
+        CNNCommon with the convolutions in int8 (static quantization).
+        Spatial softmax runs in float, fc1 is quantized dynamically
+        together with the dense head.
+    '''
+    def __init__(self, cnn):
+        super(QuantizedCNNCommon, self).__init__()
+        self.quant = tq.QuantStub()
+        self.conv1 = cnn.conv1
+        self.conv2 = cnn.conv2
+        self.conv3 = cnn.conv3
+        self.dequant = tq.DeQuantStub()
+        self.spatial_softmax = cnn.spatial_softmax
+        self.fc1 = cnn.fc1
+        if(cnn._activation not in ACTIVATION_MODULES):
+            raise ValueError("Static quantization does not support the "
+                             "activation %s" % cnn._activation)
+        # One module per layer, each one observes its own range
+        self.act1 = ACTIVATION_MODULES[cnn._activation]()
+        self.act2 = ACTIVATION_MODULES[cnn._activation]()
+        # Spatial softmax and fc1 stay in float
+        self.spatial_softmax.qconfig = None
+        self.fc1.qconfig = None
+
+    def forward(self, x):
+        if(len(x.shape) == 3):
+            x = x.unsqueeze(0)
+        x = self.quant(x)
+        x = self.act1(self.conv1(x))
+        x = self.act2(self.conv2(x))
+        x = self.dequant(self.conv3(x))
+        x = self.spatial_softmax(x)
+        x = self.fc1(x).squeeze()  # bs, out_feat
+        return x
+
+
+class _Linear2d(nn.Module):
+    '''
+        Quantized linear layers need batched inputs, the policy acts on
+        single unbatched observations.
+    '''
+    def __init__(self, linear):
+        super(_Linear2d, self).__init__()
+        self.linear = linear
+
+    def forward(self, x):
+        if(len(x.shape) == 1):
+            return self.linear(x.unsqueeze(0)).squeeze(0)
+        return self.linear(x)
+
+
+def _wrap_linear(module):
+    for name, child in module.named_children():
+        if(isinstance(child, nn.Linear)):
+            setattr(module, name, _Linear2d(child))
+        else:
+            _wrap_linear(child)
+
+
+def load_calibration_obs(replay_buffer_dir, n_samples=256, seed=0):
+    '''
+        Loads the states of n_samples random transitions stored by
+        ReplayBuffer.save
+        returns: list of observation dicts {key: np.array}
+    '''
+    files = glob.glob(os.path.join(replay_buffer_dir, "transition_*.npy"))
+    if(len(files) == 0):
+        return []
+    files.sort()
+    rng = np.random.RandomState(seed)
+    n_samples = min(n_samples, len(files))
+    files = rng.choice(files, n_samples, replace=False)
+    return [np.load(f, allow_pickle=True).item()["state"] for f in files]
+
+
+def _to_tensors(obs, transform_obs):
+    obs = {k: torch.from_numpy(np.asarray(v)).float() for k, v in obs.items()}
+    return transform_obs(obs, "validation")
+
+
+def quantize_policy(policy, calib_obs=None, transform_obs=None,
+                    mode="dynamic"):
+    '''
+        Post training int8 quantization of the policy for cpu inference.
+        - dynamic: int8 weights for all linear layers (dense head and
+          fc1 of the image networks), activations quantized on the fly.
+        - static: additionally runs the convolutions of the image
+          networks in int8, with activation ranges calibrated on calib_obs.
+        returns: quantized copy of the policy on cpu
+    '''
+    if(mode not in QUANTIZATION_MODES):
+        raise ValueError("Unknown quantization mode %s, options: %s"
+                         % (mode, QUANTIZATION_MODES))
+    q_policy = copy.deepcopy(policy).cpu().eval()
+    if(mode == "static"):
+        if(not calib_obs):
+            raise ValueError("Static quantization needs calibration observations")
+        engine = torch.backends.quantized.engine
+        for name, module in q_policy.named_children():
+            if(isinstance(module, CNNCommon)):
+                q_cnn = QuantizedCNNCommon(module)
+                q_cnn.qconfig = tq.get_default_qconfig(engine)
+                setattr(q_policy, name, q_cnn)
+        tq.prepare(q_policy, inplace=True)
+        # Calibration of activation ranges
+        with torch.no_grad():
+            for obs in calib_obs:
+                q_policy.act(_to_tensors(obs, transform_obs),
+                             deterministic=True)
+        tq.convert(q_policy, inplace=True)
+    _wrap_linear(q_policy)
+    q_policy = tq.quantize_dynamic(q_policy, {nn.Linear}, dtype=torch.qint8)
+    return q_policy
+
+
+def compare_actions(policy, q_policy, obs_lst, transform_obs):
+    '''
+        Accuracy of the quantized policy w.r.t. the float policy
+        on the deterministic actions of obs_lst.
+        The gripper action (last dimension) is also compared by sign,
+        as open/close agreement rate.
+    '''
+    policy = copy.deepcopy(policy).cpu().eval()
+    errors, gripper_match = [], []
+    with torch.no_grad():
+        for obs in obs_lst:
+            obs = _to_tensors(obs, transform_obs)
+            action, _ = policy.act(obs, deterministic=True)
+            q_action, _ = q_policy.act(obs, deterministic=True)
+            action = action.numpy().reshape(-1)
+            q_action = q_action.numpy().reshape(-1)
+            errors.append(np.abs(action - q_action))
+            gripper_match.append(np.sign(action[-1]) == np.sign(q_action[-1]))
+    if(len(errors) == 0):
+        return {}
+    errors = np.stack(errors)
+    return {"quantization/mean_abs_err": errors.mean(),
+            "quantization/max_abs_err": errors.max(),
+            "quantization/gripper_agreement": np.mean(gripper_match)}
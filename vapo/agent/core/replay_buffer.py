@@ -1,13 +1,28 @@
 import numpy as np
-from collections import deque, namedtuple
+from collections import defaultdict, deque, namedtuple
 from vapo.agent.core.utils import tt
 from pathlib import Path
 import glob
+import itertools
 import os
 
+
+def _obs_bytes(obs):
+    '''
+        returns: [(key, bytes)] of the arrays of an observation
+    '''
+    if(isinstance(obs, dict)):
+        return [(k, v.nbytes) for k, v in obs.items()
+                if isinstance(v, np.ndarray)]
+    if(isinstance(obs, np.ndarray)):
+        return [("obs", obs.nbytes)]
+    return []
+
+
 class ReplayBuffer:
     # Replay buffer for experience replay. Stores transitions.
-    def __init__(self, max_size, dict_state=False, logger=None):
+    def __init__(self, max_size, dict_state=False, logger=None,
+                 device="cuda"):
         self._transition = namedtuple("transition",
                                       ["state", "action", "reward",
                                        "next_state", "terminal_flag"])
@@ -16,13 +31,44 @@ class ReplayBuffer:
         self.dict_state = dict_state
         self.last_saved_idx = -1
         self.logger = logger
+        self.device = device
+        # Bytes of the stored observations per key
+        self._nbytes = defaultdict(int)
+        self._last_next_state = None
 
     def __len__(self):
         return len(self._data)
 
+    def _count(self, obs, sign):
+        for k, n in _obs_bytes(obs):
+            self._nbytes[k] += sign * n
+
+    def _append(self, transition):
+        '''
+            Consecutive transitions share the observation
+            (next_state of t is state of t + 1), it is counted once.
+        '''
+        if(len(self._data) == self._data.maxlen):
+            old = self._data[0]
+            self._count(old.state, -1)
+            following = self._data[1] if len(self._data) > 1 else transition
+            if(following.state is not old.next_state):
+                self._count(old.next_state, -1)
+        if(transition.state is not self._last_next_state):
+            self._count(transition.state, 1)
+        self._count(transition.next_state, 1)
+        self._last_next_state = transition.next_state
+        self._data.append(transition)
+
+    def nbytes(self):
+        '''
+            returns: {observation key: bytes} stored in the buffer
+        '''
+        return dict(self._nbytes)
+
     def add_transition(self, state, action, reward, next_state, done):
         transition = self._transition(state, action, reward, next_state, done)
-        self._data.append(transition)
+        self._append(transition)
 
     def sample(self, batch_size):
         batch_indices = np.random.choice(len(self._data), batch_size)
@@ -41,15 +87,29 @@ class ReplayBuffer:
                  for k in batch_next_states[0]}
             batch_next_states = v
 
-        return tt(batch_states), tt(batch_actions), tt(batch_rewards),\
-            tt(batch_next_states), tt(batch_terminal_flags)
+        return tt(batch_states, self.device), \
+            tt(batch_actions, self.device), \
+            tt(batch_rewards, self.device), \
+            tt(batch_next_states, self.device), \
+            tt(batch_terminal_flags, self.device)
 
-    def save(self, path="./replay_buffer"):
+    def take_unsaved(self):
+        '''
+            returns: [(index, transition)] added since the last save,
+            which are marked as saved. Called by the thread adding
+            transitions, the list can be written by another thread.
+        '''
+        start = self.last_saved_idx + 1
+        items = list(zip(itertools.count(start),
+                         itertools.islice(self._data, start, None)))
+        if(len(items) > 0):
+            self.last_saved_idx = items[-1][0]
+        return items
+
+    def write_transitions(self, path, items):
         p = Path(path)
         p.mkdir(parents=True, exist_ok=True)
-        num_entries = len(self._data)
-        for i in range(self.last_saved_idx + 1, num_entries):
-            transition = self._data[i]
+        for i, transition in items:
             if(not isinstance(transition.state, dict)
                or not isinstance(transition.next_state, dict)):
                 continue
@@ -61,10 +121,12 @@ class ReplayBuffer:
                      "reward": transition.reward,
                      "terminal_flag": transition.terminal_flag}
                     )
-        if(num_entries - 1 - self.last_saved_idx > 0):
+        if(len(items) > 0):
             self.logger.info("Saved transitions with indices : %d - %d"
-                             % (self.last_saved_idx, i))
-            self.last_saved_idx = i
+                             % (items[0][0], items[-1][0]))
+
+    def save(self, path="./replay_buffer"):
+        self.write_transitions(path, self.take_unsaved())
 
     def load(self, path="./replay_buffer"):
         p = Path(path)
@@ -80,7 +142,7 @@ class ReplayBuffer:
                                                   data['reward'],
                                                   data['next_state'],
                                                   data['terminal_flag'])
-                    self._data.append(transition)
+                    self._append(transition)
                 self.last_saved_idx = len(files)
                 self.logger.info("Replay buffer loaded successfully")
             else:
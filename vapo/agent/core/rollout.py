@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+from vapo.utils.profiling import phase_timers
+
+# torch < 1.9 does not have inference_mode
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+
+class RolloutEngine():
+    '''
+        Policy forward for acting in the environment (evaluation,
+        tidy up and action selection during training).
+        - Runs under inference mode, no autograd graph is built.
+        - Observations are copied into preallocated device tensors.
+        - Uses the validation transforms of the env wrapper.
+    '''
+    def __init__(self, policy, transform_obs, device="cuda"):
+        self.policy = policy
+        self.transform_obs = transform_obs
+        self.device = device
+        self._buffers = {}
+
+    def _get_buffer(self, key, shape):
+        buffer = self._buffers.get(key)
+        if(buffer is None
+           or buffer.shape[1:] != shape[1:]
+           or buffer.shape[0] < shape[0]):
+            buffer = torch.empty(shape, dtype=torch.float,
+                                 device=self.device)
+            self._buffers[key] = buffer
+        return buffer[:shape[0]]
+
+    def _to_tensors(self, obs_lst):
+        '''
+            obs_lst: list of observation dicts {key: np.array}
+            returns: {key: torch.tensor(B, ...)}
+        '''
+        tensors = {}
+        for k in obs_lst[0].keys():
+            values = np.stack([np.asarray(obs[k]) for obs in obs_lst])
+            buffer = self._get_buffer(k, values.shape)
+            buffer.copy_(torch.from_numpy(values))
+            tensors[k] = buffer
+        return tensors
+
+    def act_batch(self, obs_lst, deterministic=True):
+        '''
+            obs_lst: list of N observation dicts
+            returns: np.array(N, action_dim) actions scaled to env
+        '''
+        with _inference_mode():
+            obs = self._to_tensors(obs_lst)
+            if(len(obs_lst) == 1):
+                # Networks expect unbatched single observations
+                obs = {k: v[0] for k, v in obs.items()}
+            with phase_timers.span("transforms/rollout"):
+                obs = self.transform_obs(obs, "validation")
+            with phase_timers.span("nets/rollout_policy"):
+                action, _ = self.policy.act(obs, deterministic=deterministic)
+                action = action.cpu().numpy()
+        return action.reshape(len(obs_lst), -1)
+
+    def act(self, obs, deterministic=True):
+        return self.act_batch([obs], deterministic)[0]
@@ -5,12 +5,19 @@ import torch.nn as nn
 import torch.optim as optim
 import itertools
 import logging
-import gym
 import collections
-import wandb
 from vapo.agent.core.replay_buffer import ReplayBuffer
-from vapo.agent.core.utils import tt, soft_update, get_nets
+from vapo.agent.core.utils import tt, soft_update, get_nets, is_img_obs
+from vapo.agent.core.rollout import RolloutEngine
+from vapo.agent.core.metrics import MetricsAccumulator
+from vapo.agent.core.checkpoint import CheckpointWriter
+from vapo.utils.model_registry import aff_model_registry
+from vapo.utils.profiling import phase_timers, timer_metrics, \
+    UpdateProfiler
+from vapo.utils.resources import ResourceSampler
+from vapo.utils.run_logger import run_logger
 import datetime
+# The export/quantization tools are imported in the methods that use them
 
 
 class SAC():
@@ -21,7 +28,12 @@ class SAC():
                  batch_size=256, buffer_size=1e6,
                  model_name="sac", net_cfg=None, log=None,
                  save_replay_buffer=False, init_temp=0.01,
-                 train_mean_n_ep=5, wandb_login=None, resume=False):
+                 train_mean_n_ep=5, wandb_login=None, resume=False,
+                 metrics_reduction=None, checkpoint_interval=0,
+                 profile_phases=False, profile=None, resources=None,
+                 metrics_backend=None, device="cuda"):
+        # wandb, local (offline), both or disabled
+        run_logger.configure(**(metrics_backend or {}))
         if(wandb_login and not resume):
             log_dir = os.path.join(*os.getcwd().split(os.path.sep)[-3:])
             config = {"batch_size": batch_size,
@@ -36,18 +48,22 @@ class SAC():
                       "save_replay_buffer": save_replay_buffer,
                       "offset": env.offset,
                       "max_target_dist": env.termination_radius,
-                      "cwd": log_dir}
-            id = wandb.util.generate_id()
-            wandb.init(name=model_name,
-                       config=config,
-                       id=id,
-                       resume="allow",
-                       **wandb_login)
+                      "cwd": log_dir,
+                      **aff_model_registry.metrics()}
+            id = run_logger.generate_id()
+            run_logger.init(name=model_name,
+                            config=config,
+                            id=id,
+                            resume="allow",
+                            **wandb_login)
         else:
             id = 0
         self.wandb_login = wandb_login
         self.wandb_id = id
         self._save_replay_buffer = save_replay_buffer
+        # Checkpoints are written in the background,
+        # last.pth at most every checkpoint_interval seconds
+        self._checkpoints = CheckpointWriter(checkpoint_interval, log)
         self.log = log
         if(not log):
             self.log = logging.getLogger(__name__)
@@ -60,16 +76,13 @@ class SAC():
             self.eval_env = env
 
         # Replay buffer
-        _cnn_policy_cond = ["gripper_depth_obs", "gripper_img_obs",
-                            "static_depth_obs", "static_img_obs"]
-        _img_obs = False
         obs_space = env.observation_space
-        if(isinstance(obs_space, gym.spaces.Dict) and
-           any([x in _cnn_policy_cond for x in obs_space])):
-            _img_obs = True
+        _img_obs = is_img_obs(obs_space)
         print("SAC: images as observation: %s" % _img_obs)
         self._max_size = buffer_size
-        self._replay_buffer = ReplayBuffer(buffer_size, _img_obs, self.log)
+        self.device = device
+        self._replay_buffer = ReplayBuffer(buffer_size, _img_obs, self.log,
+                                           device)
         self.batch_size = batch_size
 
         # Reload
@@ -82,6 +95,17 @@ class SAC():
         self.train_mean_n_ep = train_mean_n_ep
         self.last_n_train_success = collections.deque(maxlen=self.train_mean_n_ep)
         self.last_n_train_mean_success = 0
+        # Training losses, kept on device until the end of the episode
+        self._train_metrics = MetricsAccumulator(metrics_reduction)
+        # Time per phase of the training loop, logged per episode
+        phase_timers.configure(enabled=profile_phases)
+        # torch.profiler trace of a window of training steps
+        self._profiler = UpdateProfiler(log=self.log, **(profile or {}))
+        self._n_updates = 0
+        # Memory, cpu and io usage sampled in the background
+        self._resources = ResourceSampler(log=self.log, **(resources or {}))
+        self._resources.add_source("replay_buffer", self._buffer_metrics)
+        self._resources.start()
 
         # Agent
         self._gamma = gamma
@@ -100,7 +124,7 @@ class SAC():
             self.target_entropy = -np.prod(env.action_space.shape).item()
             self.log_ent_coef = torch.tensor(np.log(init_temp),
                                              requires_grad=True,
-                                             device="cuda")  # init value
+                                             device=device)  # init value
             self.ent_coef_optimizer = optim.Adam([self.log_ent_coef],
                                                  lr=alpha_lr)
         else:
@@ -118,13 +142,17 @@ class SAC():
                      self.log, actor_net, critic_net)
         self._pi = policy_net(obs_space, action_dim,
                               action_space=env.action_space,
-                              **net_cfg).cuda()
-        self._q1 = critic_net(obs_space, action_dim, **net_cfg).cuda()
-        self._q1_target = critic_net(obs_space, action_dim, **net_cfg).cuda()
-        self._q2 = critic_net(obs_space, action_dim, **net_cfg).cuda()
-        self._q2_target = critic_net(obs_space, action_dim, **net_cfg).cuda()
+                              **net_cfg).to(device)
+        self._q1 = critic_net(obs_space, action_dim, **net_cfg).to(device)
+        self._q1_target = critic_net(obs_space, action_dim,
+                                     **net_cfg).to(device)
+        self._q2 = critic_net(obs_space, action_dim, **net_cfg).to(device)
+        self._q2_target = critic_net(obs_space, action_dim,
+                                     **net_cfg).to(device)
 
         self._pi_optim = optim.Adam(self._pi.parameters(), lr=actor_lr)
+        # Policy forward to act in the env
+        self._rollout = RolloutEngine(self._pi, env.transform_obs, device)
 
         self._q1_target.load_state_dict(self._q1.state_dict())
         self._q1_optimizer = optim.Adam(self._q1.parameters(), lr=critic_lr)
@@ -146,6 +174,34 @@ class SAC():
         self.model_name = model_name
         self.trained_path = "{}/".format(self.save_dir)
 
+    def _init_acting(self, env, policy, eval_env=None,
+                     save_dir="./trained_models", model_name="sac",
+                     log=None, device="cuda", **kwargs):
+        '''
+            Replaces __init__ for an agent that only acts, i.e. with
+            load_policy_bundle: no critics, optimizers, replay buffer,
+            logging run or background threads. Training args are ignored.
+        '''
+        self.log = log
+        if(not log):
+            self.log = logging.getLogger(__name__)
+        self.env = env
+        self.eval_env = eval_env if eval_env is not None else env
+        self.save_dir = save_dir
+        self.model_name = model_name
+        self.device = device
+        self.wandb_login = None
+        # Float policy, i.e. for load_quantized
+        self._pi = getattr(policy, "policy", policy)
+        self._rollout = RolloutEngine(policy, env.transform_obs, device)
+
+    def _buffer_metrics(self):
+        metrics = {"%s_mb" % k: v / 2**20
+                   for k, v in self._replay_buffer.nbytes().items()}
+        metrics["total_mb"] = sum(metrics.values())
+        metrics["transitions"] = len(self._replay_buffer)
+        return metrics
+
     # update alpha(entropy coeficient)
     def _update_entropy(self, log_probs):
         if(self._auto_entropy):
@@ -156,112 +212,136 @@ class SAC():
             ent_coef_loss.backward()
             self.ent_coef_optimizer.step()
             self.ent_coef = self.log_ent_coef.exp()
-            return ent_coef_loss.item()
-        else:
-            return 0
+            self._train_metrics.add("ent_coef_loss", ent_coef_loss)
 
     # Update all networks
     def _update(self, td_target, batch_states, batch_actions):
-        plot_data = {}
-        _batch_states = self.env.transform_obs(batch_states, "train")
-        # Critic 1
-        curr_prediction_c1 = self._q1(_batch_states, batch_actions)
-        loss_c1 = self._loss_function(curr_prediction_c1, td_target.detach())
-
-        # Critic 2
-        curr_prediction_c2 = self._q2(_batch_states, batch_actions)
-        loss_c2 = self._loss_function(curr_prediction_c2, td_target.detach())
+        with self._profiler.record("SAC._update"):
+            self._update_nets(td_target, batch_states, batch_actions)
+
+    def _update_nets(self, td_target, batch_states, batch_actions):
+        with phase_timers.span("nets/critic_forward"):
+            # Critic 1
+            curr_prediction_c1 = self._q1(batch_states, batch_actions)
+            loss_c1 = self._loss_function(curr_prediction_c1,
+                                          td_target.detach())
+
+            # Critic 2
+            curr_prediction_c2 = self._q2(batch_states, batch_actions)
+            loss_c2 = self._loss_function(curr_prediction_c2,
+                                          td_target.detach())
         # --- update two critics w/same optimizer ---#
-        self._q_optim.zero_grad()
-        loss_critics = loss_c1 + loss_c2
-        loss_critics.backward()
-        self._q_optim.step()
-
-        plot_data["critic_loss"] = [loss_c1.item(), loss_c2.item()]
+        with phase_timers.span("nets/critic_backward"):
+            self._q_optim.zero_grad()
+            loss_critics = loss_c1 + loss_c2
+            loss_critics.backward()
+            self._q_optim.step()
+
+        # Logged critic loss is the one of the second critic
+        self._train_metrics.add("critic_loss", loss_c2)
         # ---------------- Policy network update -------------#
-        predicted_actions, log_probs = self._pi.act(_batch_states,
-                                                    deterministic=False,
-                                                    reparametrize=True)
-        critic_value = torch.min(
-            self._q1(_batch_states, predicted_actions),
-            self._q2(_batch_states, predicted_actions))
+        with phase_timers.span("nets/actor_forward"):
+            predicted_actions, log_probs = \
+                self._pi.act(batch_states,
+                             deterministic=False,
+                             reparametrize=True)
+            critic_value = torch.min(
+                self._q1(batch_states, predicted_actions),
+                self._q2(batch_states, predicted_actions))
         # Actor update/ gradient ascent
-        self._pi_optim.zero_grad()
-        policy_loss = (self.ent_coef * log_probs - critic_value).mean()
-        policy_loss.backward()
-        self._pi_optim.step()
-        plot_data["actor_loss"] = policy_loss.item()
+        with phase_timers.span("nets/actor_backward"):
+            self._pi_optim.zero_grad()
+            policy_loss = (self.ent_coef * log_probs - critic_value).mean()
+            policy_loss.backward()
+            self._pi_optim.step()
+        self._train_metrics.add("actor_loss", policy_loss)
 
         # ---------------- Entropy network update -------------#
-        ent_coef_loss = self._update_entropy(log_probs)
-        plot_data["ent_coef"] = self.ent_coef.item()
-        plot_data["ent_coef_loss"] = ent_coef_loss
+        with phase_timers.span("nets/entropy_update"):
+            self._update_entropy(log_probs)
+        self._train_metrics.add("ent_coef", self.ent_coef)
 
         # ------------------ Target Networks update -------------------#
-        soft_update(self._q1_target, self._q1, self.tau)
-        soft_update(self._q2_target, self._q2, self.tau)
-
-        return plot_data
+        with phase_timers.span("nets/soft_update"):
+            soft_update(self._q1_target, self._q1, self.tau)
+            soft_update(self._q2_target, self._q2, self.tau)
+
+    # Sample a batch from the replay buffer and update the networks
+    def _train_update(self):
+        self._n_updates += 1
+        with phase_timers.span("buffer/sample"):
+            sample = self._replay_buffer.sample(self.batch_size)
+        batch_states, batch_actions, batch_rewards,\
+            batch_next_states, batch_terminal_flags = sample
+
+        # Augment states and next states at once
+        with phase_timers.span("transforms/augment"):
+            batch_states, batch_next_states = \
+                self.env.augment_batch(batch_states, batch_next_states)
+        with torch.no_grad(), phase_timers.span("nets/target_forward"):
+            next_actions, log_probs = self._pi.act(
+                                            batch_next_states,
+                                            deterministic=False,
+                                            reparametrize=False)
+
+            target_qvalue = torch.min(
+                self._q1_target(batch_next_states, next_actions),
+                self._q2_target(batch_next_states, next_actions))
+
+            td_target = \
+                batch_rewards \
+                + (1 - batch_terminal_flags) * self._gamma * \
+                (target_qvalue - self.ent_coef * log_probs)
+
+        # ----------------  Networks update -------------#
+        self._update(td_target,
+                     batch_states,
+                     batch_actions)
 
     # One single training timestep
     # Take one step in the environment and update the networks
     def training_step(self, s, ts, ep_return, ep_length):
+        n_updates = self._n_updates
+        with self._profiler.record("SAC.training_step"):
+            res = self._training_step(s, ts, ep_return, ep_length)
+        # Profiler window counts training steps with an update
+        if(self._n_updates > n_updates):
+            self._profiler.step()
+        return res
+
+    def _training_step(self, s, ts, ep_return, ep_length):
         # sample action and scale it to action space
-        _s = self.env.transform_obs(tt(s), "train")
         if self.env.viz:
-            self.env.viz_transformed(_s)
-        a, _ = self._pi.act(_s, deterministic=False)
-        a = a.cpu().detach().numpy()
+            self.env.viz_transformed(
+                self.env.transform_obs(tt(s, self.device), "validation"))
+        a = self._rollout.act(s, deterministic=False)
         ns, r, done, info = self.env.step(a)
 
         success = info["success"]
-        self._replay_buffer.add_transition(s, a, r, ns, done)
+        with phase_timers.span("buffer/add"):
+            self._replay_buffer.add_transition(s, a, r, ns, done)
         s = ns
         ep_return += r
         ep_length += 1
 
         # Replay buffer has enough data
-        new_data = {}
         if(self._replay_buffer.__len__() >= self.batch_size
            and not done and ts > self.learning_starts):
-
-            sample = self._replay_buffer.sample(self.batch_size)
-            batch_states, batch_actions, batch_rewards,\
-                batch_next_states, batch_terminal_flags = sample
-
-            with torch.no_grad():
-                batch_next_states = self.env.transform_obs(batch_next_states,
-                                                           "train")
-                next_actions, log_probs = self._pi.act(
-                                                batch_next_states,
-                                                deterministic=False,
-                                                reparametrize=False)
-
-                target_qvalue = torch.min(
-                    self._q1_target(batch_next_states, next_actions),
-                    self._q2_target(batch_next_states, next_actions))
-
-                td_target = \
-                    batch_rewards \
-                    + (1 - batch_terminal_flags) * self._gamma * \
-                    (target_qvalue - self.ent_coef * log_probs)
-
-            # ----------------  Networks update -------------#
-            new_data = self._update(td_target,
-                                    batch_states,
-                                    batch_actions)
-        return s, done, success, ep_return, ep_length, \
-            new_data.copy(), info
+            self._train_update()
+        return s, done, success, ep_return, ep_length, info
 
     def _on_train_ep_end(self, ts, episode, total_ts,
                          best_return, episode_length, episode_return,
-                         success, plot_data):
+                         success):
 
         print_str = "[%d] %s, " % (episode, self.env.target) \
             + "Return: %.3f, " % episode_return \
             + "Success: %s, " % str(success) \
             + "Steps: %d, " % episode_length \
             + "Total timesteps: %d/%d" % (ts, total_ts)
+        resources = self._resources.flush()
+        if("resources/rss_mb" in resources):
+            print_str += ", RSS: %.0f MB" % resources["resources/rss_mb"]
         self.log.info(print_str)
 
         # Summary Writer
@@ -274,16 +354,18 @@ class SAC():
         self.last_n_train_success.append(int(success))
         write_dict = {"timesteps": ts,
                       "episode": episode}
-        for key, value in plot_data.items():
-            if value:  # not empty
-                if(key == "critic_loss"):
-                    data = np.mean(value[-1])
-                else:
-                    data = value  # np.mean(value)
-                write_dict.update({"train/%s" % key: data})
+        # Single device sync for all the losses of the episode
+        write_dict.update(self._train_metrics.flush(prefix="train/"))
+        timer_samples = phase_timers.flush()
+        write_dict.update(timer_metrics(timer_samples))
+        write_dict.update(resources)
+        if(getattr(self.env, "aff_cache", None) is not None):
+            write_dict.update(self.env.aff_cache.metrics())
 
         self.last_n_train_mean_success = last_n_train_mean_success
-        wandb.log({
+        for name, ms in timer_samples.items():
+            write_dict["timers_hist/%s_ms" % name] = run_logger.Histogram(ms)
+        run_logger.log({
             "train/success": success,
             "train/episode_return": episode_return,
             "train/episode_length": episode_length,
@@ -303,7 +385,7 @@ class SAC():
             self.save(self.trained_path + "best_train_success_%d_ep.pth" % self.train_mean_n_ep)
 
         # Always save last model(last training episode)
-        self.save(self.trained_path + "last.pth")
+        self.save(self.trained_path + "last.pth", periodic=True)
         return best_return
 
     # Evaluate model and log plot_data to writter
@@ -353,7 +435,7 @@ class SAC():
             self.save(self.trained_path
                       + "most_tasks_from_%d.pth" % len(success_lst))
             most_tasks = n_success
-        wandb.log({
+        run_logger.log({
             **write_dict,
             "eval/success(%dep)" % len(success_lst): n_success,
             "eval/success_rate(%dep)" % len(success_lst): n_success/len(success_lst)
@@ -369,7 +451,12 @@ class SAC():
     def eval_all_objs(self):
         raise NotImplementedError
 
-    def save(self, path):
+    def save(self, path, periodic=False):
+        '''
+            Schedules the checkpoint in the background writer.
+            periodic: skip if path was saved less than
+            checkpoint_interval seconds ago
+        '''
         save_dict = {
             'actor_dict': self._pi.state_dict(),
             'actor_optimizer_dict': self._pi_optim.state_dict(),
@@ -395,15 +482,23 @@ class SAC():
         if self._auto_entropy:
             save_dict['ent_coef_optimizer'] = \
                  self.ent_coef_optimizer.state_dict()
-        if self._save_replay_buffer:
-            self._replay_buffer.save(os.path.join(self.save_dir,
-                                     "replay_buffer"))
-        torch.save(save_dict, path)
+        with phase_timers.span("checkpoint"):
+            scheduled = self._checkpoints.save(save_dict, path,
+                                               force=not periodic)
+        if scheduled and self._save_replay_buffer:
+            # The buffer keeps growing while the writer runs,
+            # new transitions are taken here
+            self._checkpoints.submit(self._replay_buffer.write_transitions,
+                                     os.path.join(self.save_dir,
+                                                  "replay_buffer"),
+                                     self._replay_buffer.take_unsaved())
 
     def load(self, path, resume_training=False):
+        # Checkpoints still being written
+        self._checkpoints.flush()
         if os.path.isfile(path):
             print("Loading checkpoint")
-            checkpoint = torch.load(path)
+            checkpoint = torch.load(path, map_location=self.device)
 
             self._pi.load_state_dict(checkpoint['actor_dict'])
             self._pi_optim.load_state_dict(checkpoint['actor_optimizer_dict'])
@@ -430,10 +525,10 @@ class SAC():
                 _date = datetime.datetime.now().strftime("%Y_%m_%d-%H_%M_%S")
                 log_dir = os.path.join(*os.getcwd().split(os.path.sep)[-3:])
                 config = {"resume_%s" % _date: log_dir}
-                wandb.init(id=self.wandb_id,
-                           resume="must",
-                           config=config,
-                           **self.wandb_login)
+                run_logger.init(id=self.wandb_id,
+                                resume="must",
+                                config=config,
+                                **self.wandb_login)
 
                 self.best_return = checkpoint['best_return']
                 self.best_eval_return = checkpoint['best_eval_return']
@@ -451,3 +546,38 @@ class SAC():
         else:
             raise TypeError(
                 "Model path does not exist: %s \n" % os.path.abspath(path))
+
+    def load_exported(self, path, device="cpu"):
+        '''
+            Acts in the environment with an exported deterministic policy
+            (see policy_export.py). Only for evaluation.
+        '''
+        from vapo.agent.core.policy_export import load_policy
+        policy = load_policy(path, device)
+        self._rollout = RolloutEngine(policy, self.env.transform_obs,
+                                      device=policy.device)
+        self.log.info("Acting with exported policy %s" % path)
+        return True
+
+    def load_quantized(self, mode="dynamic", calib_dir=None, n_calib=256):
+        '''
+            Acts in the environment with an int8 copy of the policy on cpu
+            (see quantization.py). Only for evaluation.
+            calib_dir: replay buffer directory with saved transitions, used
+            to calibrate static quantization and to check the accuracy
+            against the float policy.
+        '''
+        from vapo.agent.core.quantization import \
+            quantize_policy, load_calibration_obs, compare_actions
+        calib_obs = []
+        if(calib_dir is not None):
+            calib_obs = load_calibration_obs(calib_dir, n_calib)
+        q_policy = quantize_policy(self._pi, calib_obs,
+                                   self.env.transform_obs, mode=mode)
+        accuracy = compare_actions(self._pi, q_policy, calib_obs,
+                                   self.env.transform_obs)
+        for k, v in accuracy.items():
+            self.log.info("%s: %.4f" % (k, v))
+        self._rollout = RolloutEngine(q_policy, self.env.transform_obs,
+                                      device="cpu")
+        return accuracy
@@ -1,16 +1,20 @@
 import numpy as np
-import os
 import cv2
 import torch
-import pybullet as p
 from affordance.utils.img_utils import viz_aff_centers_preds, transform_and_predict, resize_center
-from vapo.utils.utils import init_aff_net
+from vapo.utils.utils import init_aff_net, deproject_pixels, \
+    get_min_depth_around_pixels, check_deproject_pixels
+from vapo.agent.core.utils import cluster_stats
+from vapo.utils.profiling import phase_timers
+from vapo.utils.video_recorder import rollout_recorder
 
 
 class TargetSearch():
     def __init__(self, env, mode,
                  aff_transforms=None, aff_cfg=None,
                  class_label=None, initial_pos=None,
+                 queue_radius=15, queue_diff_thresh=30,
+                 queue_max_changed=0.05, device="cuda",
                  *args, **kwargs) -> None:
         self.env = env
         self.mode = mode
@@ -23,11 +27,21 @@ class TargetSearch():
         self.class_label = class_label
         self.box_mask = None
         self.save_images = env.save_images
+        self.device = device
+
+        # Ranked queue of detected targets, reused until
+        # the static camera view changes around them
+        self.target_queue = []
+        self.queue_img = None
+        self.queue_radius = queue_radius
+        self.queue_diff_thresh = queue_diff_thresh
+        self.queue_max_changed = queue_max_changed
 
         if(mode == "real_world"):
             # hydra.utils.instantiate(main_cfg.cams.static_cam)
             self.static_cam = env.camera_manager.static_cam
             self.T_world_cam = self.static_cam.get_extrinsic_calibration("panda")
+            check_deproject_pixels(self.static_cam)
             self.orig_img, _ = self.static_cam.get_image()
         else:
             # self.cam_id = kwargs["cam_id"]
@@ -44,14 +58,15 @@ class TargetSearch():
                 noisy=False):
         if(env is None):
             env = self.env
-        if(self.mode == "real_world"):
-            res = self._compute_real_world(env,
-                                           return_all_centers,
-                                           rand_sample)
-        else:
-            res = self._compute_sim(env, noisy,
-                                    rand_sample,
-                                    return_all_centers)
+        with phase_timers.span("target_search"):
+            if(self.mode == "real_world"):
+                res = self._compute_real_world(env,
+                                               return_all_centers,
+                                               rand_sample)
+            else:
+                res = self._compute_sim(env, noisy,
+                                        rand_sample,
+                                        return_all_centers)
         return res
 
     def _compute_real_world(self, env, return_all_centers, rand_sample):
@@ -61,16 +76,18 @@ class TargetSearch():
                                        depth_img,
                                        orig_img,
                                        rand_sample=rand_sample)
-        target_pos, no_target, world_pts = res
+        target_pos, no_target, world_pts, target_idx = res
         max_height = -1
-        for pt in world_pts:
+        for i, pt in enumerate(world_pts):
             if(pt[-1] > max_height):
                 target_pos = pt
+                target_idx = i
                 max_height = pt[-1]
+        self._remove_from_queue(target_idx)
         if(not return_all_centers):
             res = (target_pos, no_target)
         else:
-            res = (target_pos, no_target, world_pts)
+            res = (target_pos, no_target, self._valid_pts(world_pts))
         return res
 
     def _compute_sim(self, env, noisy, rand_sample, return_all_centers):
@@ -82,16 +99,16 @@ class TargetSearch():
             # Get environment observation
             res = self._compute_target_aff(env, self.static_cam,
                                            depth_obs, orig_img, rand_sample)
-            target_pos, no_target, object_centers = res
+            target_pos, no_target, object_centers, target_idx = res
+            self._remove_from_queue(target_idx)
             if noisy:
                 target_pos += np.random.normal(loc=0, scale=[0.005, 0.005, 0.01],
                                                size=(len(target_pos)))
-            if env.task != "pickup":
-                target_pos += np.array([0.01, 0.035, -0.01])
+            target_pos = self._sim_target_offset(env, target_pos)
 
             if return_all_centers:
                 obj_centers = []
-                for center in object_centers:
+                for center in self._valid_pts(object_centers):
                     obj = {}
                     obj["target_pos"] = center
                     obj["target_str"] = \
@@ -108,25 +125,93 @@ class TargetSearch():
             res = self._env_compute_target(env, noisy)
         return res
 
-    def get_world_pt(self, pixel, cam, depth, env):
-        x = pixel
-        v, u = pixel
+    def _valid_pts(self, world_pts):
+        # Detected centers with a valid depth
+        return [pt for pt in world_pts if not np.any(np.isnan(pt))]
+
+    def _sim_target_offset(self, env, target_pos):
+        # Detected center to grasp point for the articulated objects
+        if env.task != "pickup":
+            target_pos = target_pos + np.array([0.01, 0.035, -0.01])
+        return target_pos
+
+    def clear_queue(self):
+        ''' Detected targets are not valid anymore, i.e. new scene '''
+        self.target_queue = []
+        self.queue_img = None
+
+    def pop_target(self, env=None):
+        '''
+            Next target of the ranked queue filled by the last detection.
+            Targets whose surroundings changed in the static camera since
+            the detection (i.e. grasped or moved objects) are discarded.
+            The current frame is used, the robot is not moved: targets
+            hidden by the arm count as changed and the caller detects again.
+            returns:
+                target_pos or None if no valid target is left and
+                a new detection is required
+        '''
+        if(env is None):
+            env = self.env
+        if(len(self.target_queue) == 0 or self.queue_img is None):
+            return None
+
+        # Cheap image diff w.r.t. the image used for detection
+        if(self.mode == "real_world"):
+            img, _ = self.static_cam.get_image()
+        else:
+            img = env.get_obs()["rgb_obs"]["rgb_%s" % self.cam_id]
+        diff = np.abs(img.astype(np.int16) - self.queue_img.astype(np.int16))
+        if(len(diff.shape) == 3):
+            diff = diff.max(axis=-1)
+        changed = diff > self.queue_diff_thresh
+
+        r = self.queue_radius
+        while(len(self.target_queue) > 0):
+            target = self.target_queue.pop(0)
+            v, u = target["pixel"]
+            region = changed[max(v - r, 0): v + r, max(u - r, 0): u + r]
+            if(region.size > 0 and region.mean() <= self.queue_max_changed):
+                target_pos = np.array(target["target_pos"])
+                if(self.mode != "real_world"):
+                    target_pos = self._sim_target_offset(env, target_pos)
+                    if(env.task == "pickup"):
+                        env.target = self.find_env_target(env, target_pos)
+                return target_pos
+        return None
+
+    def _fill_queue(self, world_pts, pixels, robustness, orig_img):
+        # Most robust first
+        order = np.argsort(-robustness[:len(world_pts)], kind="stable")
+        self.target_queue = [{"idx": i,
+                              "target_pos": np.array(world_pts[i]),
+                              "pixel": pixels[i]}
+                             for i in order
+                             if not np.any(np.isnan(world_pts[i]))]
+        self.queue_img = np.array(orig_img)
+
+    def _remove_from_queue(self, target_idx):
+        # Selected target is not a candidate anymore
+        if(target_idx is not None):
+            self.target_queue = [t for t in self.target_queue
+                                 if t["idx"] != target_idx]
+
+    def get_world_pts(self, pixels, cam, depth, env):
+        '''
+            pixels: np.array (N, 2) -> (v, u)
+            returns: list of N world points, nan if the depth is invalid
+        '''
+        uv = pixels[:, ::-1]
         if self.mode == "real_world":
-            pt_cam = cam.deproject([u, v], depth, homogeneous=True)
-            if(pt_cam is not None and len(pt_cam) > 0):
-                world_pt = self.T_world_cam @ pt_cam
-                world_pt = world_pt[:3]
+            world_pts, _ = deproject_pixels(cam, uv, depth,
+                                            self.T_world_cam)
         else:
             if env.task == "drawer" or env.task == "slide":
                 # As center might  not be exactly in handle
                 # look for max depth around neighborhood
-                n = 10
-                depth_window = depth[x[0] - n:x[0] + n, x[1] - n:x[1] + n]
-                proposal = np.argwhere(depth_window == np.min(depth_window))[0]
-                v = x[0] - n + proposal[0]
-                u = x[1] - n + proposal[1]
-            world_pt = np.array(cam.deproject([u, v], depth))
-        return world_pt
+                uv = get_min_depth_around_pixels(uv, depth, n=10)
+            world_pts, _ = deproject_pixels(cam, uv, depth)
+        return list(world_pts)
 
     # Env real target pos
     def _env_compute_target(self, env=None, noisy=False):
@@ -149,6 +234,8 @@ class TargetSearch():
                             rand_sample=True):
         '''
             orig_img (numpy.ndarray, int64): rgb, 0-255 [3 x H x W]
+            returns: target_pos, no_target, world_pts (nan if invalid depth),
+            target_idx (index in world_pts, None if no target)
         '''
         # Apply validation transforms
         res = transform_and_predict(self.aff_net_static_cam,
@@ -165,41 +252,41 @@ class TargetSearch():
                                              viz=env.viz)
             if(self.save_images):
                 for img_path, img in img_dict.items():
-                    folder = os.path.dirname(img_path)
-                    os.makedirs(folder, exist_ok=True)
-                    cv2.imwrite(img_path, img)
+                    rollout_recorder.add(img_path, img)
         self.global_obs_it += 1
 
+        # World coords
+        pred_shape = aff_mask.shape[:2]
+        new_shape = depth_obs.shape[:2]
+        world_pts, candidates = [], []
+        if len(centers) > 0:
+            pixels = np.array([resize_center(o, pred_shape, new_shape)
+                               for o in centers])
+            world_pts = self.get_world_pts(pixels, cam, depth_obs, env)
+            # Centers without valid depth cannot be targets
+            candidates = [i for i, pt in enumerate(world_pts)
+                          if not np.any(np.isnan(pt))]
+
         # No center detected
-        no_target = len(centers) <= 0
+        no_target = len(candidates) <= 0
         if no_target:
+            # Previous detections are not visible anymore
+            self.clear_queue()
             default = self.initial_pos
-            return np.array(default), no_target, []
-
-        max_robustness = 0
-        obj_class = np.unique(object_masks)[1:]
-        obj_class = obj_class[obj_class != 0]  # remove background class
+            return np.array(default), no_target, [], None
 
+        # Mean prob of being class 1 (foreground) for all clusters.
+        # transform_and_predict (affordance package) already returns
+        # numpy arrays, so the single pass runs on cpu here
+        _, robustness, _, _ = cluster_stats(object_masks,
+                                            aff_probs[..., 1])
         if rand_sample:
-            target_idx = np.random.randint(len(centers))
+            target_idx = candidates[np.random.randint(len(candidates))]
             # target_idx = object_centers[rand_target]
         else:
             # Look for most likely center
-            for i, o in enumerate(centers):
-                # Mean prob of being class 1 (foreground)
-                robustness = np.mean(aff_probs[object_masks == obj_class[i], 1])
-                if(robustness > max_robustness):
-                    max_robustness = robustness
-                    target_idx = i
-
-        # World coords
-        world_pts = []
-        pred_shape = aff_mask.shape[:2]
-        new_shape = depth_obs.shape[:2]
-        for o in centers:
-            o = resize_center(o, pred_shape, new_shape)
-            world_pt = self.get_world_pt(o, cam, depth_obs, env)
-            world_pts.append(world_pt)
+            target_idx = max(candidates, key=lambda i: robustness[i])
+        self._fill_queue(world_pts, pixels, robustness, orig_img)
 
         # Recover target
         if self.env.viz or self.save_images:
@@ -214,15 +301,17 @@ class TargetSearch():
             cv2.imshow("TargetSearch: img", out_img[:, :, ::-1])
             cv2.waitKey(1)
             if(self.save_images):
-                os.makedirs("./static_centers/", exist_ok=True)
-                cv2.imwrite("./static_centers/img_%04d.jpg" % self.global_obs_it,
-                            out_img[:, :, ::-1])
+                rollout_recorder.add(
+                    "./images/ep_%04d/static_centers/img_%04d.jpg"
+                    % (getattr(env, "episode", 0), self.global_obs_it),
+                    out_img[:, :, ::-1])
 
         target_pos = world_pts[target_idx]
-        return target_pos, no_target, world_pts
+        return target_pos, no_target, world_pts, target_idx
 
     def find_env_target(self, env, target_pos):
         min_dist = np.inf
+        import pybullet as p
         env_target = env.target
         for name in env.scene.table_objs:
             target_obj = env.scene.get_info()['movable_objects'][name]
@@ -258,5 +347,5 @@ class TargetSearch():
         # cv2.waitKey()
 
         # 1, H, W
-        mask = torch.tensor(mask).unsqueeze(0).cuda()
+        mask = torch.tensor(mask).unsqueeze(0).to(self.device)
         return mask, (box_top_left, box_bott_right)
\ No newline at end of file
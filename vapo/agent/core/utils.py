@@ -1,9 +1,11 @@
 import torch
+import numpy as np
 import torch.nn.functional as F
 from torch.autograd import Variable
 import os
 import pickle
 import importlib
+import gym
 
 
 def set_init_pos(task, init_pos):
@@ -18,6 +20,14 @@ def set_init_pos(task, init_pos):
     return init_pos
 
 
+def is_img_obs(obs_space):
+    ''' True if the policy takes camera images, i.e. CNNPolicy '''
+    _cnn_policy_cond = ["gripper_depth_obs", "gripper_img_obs",
+                        "static_depth_obs", "static_img_obs"]
+    return isinstance(obs_space, gym.spaces.Dict) and \
+        any([x in _cnn_policy_cond for x in obs_space])
+
+
 def get_nets(img_obs, obs_space, action_space, log,
              actor_net_str=None, critic_net_str=None):
     action_dim = action_space.shape[0]
@@ -42,18 +52,61 @@ def get_nets(img_obs, obs_space, action_space, log,
     return actor_net, critic_net, obs_space, action_dim
 
 
-def tt(x):
+def tt(x, device="cuda"):
     if isinstance(x, dict):
         dict_of_list = {}
         for key, val in x.items():
-            dict_of_list[key] = Variable(torch.from_numpy(val).float().cuda(),
-                                         requires_grad=False)
+            dict_of_list[key] = Variable(
+                torch.from_numpy(val).float().to(device),
+                requires_grad=False)
         return dict_of_list
     else:
-        return Variable(torch.from_numpy(x).float().cuda(),
+        return Variable(torch.from_numpy(x).float().to(device),
                         requires_grad=False)
 
 
+def cluster_stats(object_masks, fg_probs):
+    '''
+        Statistics of all clusters in a single pass over the mask.
+        Computed on the device of object_masks, only the per-cluster
+        results are transferred back.
+        inputs:
+            object_masks (torch.tensor or np.array): (H, W) cluster labels,
+                                                     0 is background
+            fg_probs (torch.tensor or np.array): (H, W) foreground prob.
+        returns (np.array), one element per cluster label sorted
+        as in np.unique:
+            labels, mean foreground prob, pixel count, centroid (v, u)
+    '''
+    object_masks = torch.as_tensor(object_masks)
+    device = object_masks.device
+    fg_probs = torch.as_tensor(fg_probs, device=device).float()
+    labels = torch.unique(object_masks)[1:]
+    labels = labels[labels != 0]  # remove background class
+    if(len(labels) == 0):
+        return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros((0, 2))
+
+    h, w = object_masks.shape[-2:]
+    flat_labels = object_masks.reshape(-1).long()
+    n_bins = int(labels.max()) + 1
+    v = torch.arange(h, device=device, dtype=torch.float).repeat_interleave(w)
+    u = torch.arange(w, device=device, dtype=torch.float).repeat(h)
+    counts = torch.bincount(flat_labels, minlength=n_bins)
+    prob_sum = torch.bincount(flat_labels, weights=fg_probs.reshape(-1),
+                              minlength=n_bins)
+    v_sum = torch.bincount(flat_labels, weights=v, minlength=n_bins)
+    u_sum = torch.bincount(flat_labels, weights=u, minlength=n_bins)
+
+    idx = labels.long()
+    counts = counts[idx].float()
+    stats = torch.stack([prob_sum[idx].float() / counts,
+                         counts,
+                         v_sum[idx].float() / counts,
+                         u_sum[idx].float() / counts], -1)
+    stats = stats.cpu().numpy()
+    return labels.cpu().numpy(), stats[:, 0], stats[:, 1], stats[:, 2:]
+
+
 def soft_update(target, source, tau):
     for target_param, param in zip(target.parameters(), source.parameters()):
         target_param.data.copy_(
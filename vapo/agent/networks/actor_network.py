@@ -62,8 +62,13 @@ class CNNPolicy(nn.Module):
     def __init__(self, obs_space, action_dim, action_space, affordance=None,
                  activation="relu", hidden_dim=256, latent_dim=16, **kwargs):
         super(CNNPolicy, self).__init__()
-        self.action_high = torch.tensor(action_space.high).cuda()
-        self.action_low = torch.tensor(action_space.low).cuda()
+        # Buffers follow the module device, not stored in the state dict
+        self.register_buffer("action_high",
+                             torch.tensor(action_space.high),
+                             persistent=False)
+        self.register_buffer("action_low",
+                             torch.tensor(action_space.low),
+                             persistent=False)
         _robot_obs_shape = get_pos_shape(obs_space, "robot_obs")
         _target_pos_shape = get_pos_shape(obs_space, "detected_target_pos")
         _distance_shape = get_pos_shape(obs_space, "target_distance")
@@ -122,12 +127,9 @@ class CNNPolicy(nn.Module):
         log_probs, log_prob_a = None, None
         if(deterministic):
             action = torch.tanh(mu)
-            if(len(gripper_action_logits.shape) == 1):
-                logits = gripper_action_logits.unsqueeze(0)
-            else:
-                logits = gripper_action_logits
-            gripper_probs = F.softmax(logits, dim=-1)
-            gripper_action = torch.argmax(gripper_probs)
+            gripper_probs = F.softmax(gripper_action_logits, dim=-1)
+            # One gripper action per row
+            gripper_action = torch.argmax(gripper_probs, dim=-1)
         else:
             dist = Normal(mu, sigma)
             gripper_dist = GumbelSoftmax(0.5, logits=gripper_action_logits)
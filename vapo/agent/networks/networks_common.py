@@ -165,12 +165,15 @@ class SpatialSoftmax(nn.Module):
                 x_map[i, j] = (i - num_rows / 2.0) / num_rows
                 y_map[i, j] = (j - num_cols / 2.0) / num_cols
 
-        self.x_map = torch.from_numpy(
-                        np.array(x_map.reshape((-1)),
-                                 np.float32)).cuda()  # W*H
-        self.y_map = torch.from_numpy(
-                        np.array(x_map.reshape((-1)),
-                                 np.float32)).cuda()  # W*H
+        # Buffers follow the module device, not stored in the state dict
+        self.register_buffer("x_map", torch.from_numpy(
+                                np.array(x_map.reshape((-1)),
+                                         np.float32)),  # W*H
+                             persistent=False)
+        self.register_buffer("y_map", torch.from_numpy(
+                                np.array(x_map.reshape((-1)),
+                                         np.float32)),  # W*H
+                             persistent=False)
 
     def forward(self, x):
         # batch, C, W*H
@@ -3,14 +3,20 @@ import math
 import sys
 
 from vapo.agent.core.sac import SAC
-from vapo.agent.core.utils import tt
 from affordance.utils.utils import get_transforms
 from vapo.agent.core.target_search import TargetSearch
 
 
 class VAPOAgent(SAC):
-    def __init__(self, cfg, sac_cfg=None, wandb_login=None, resume=False):
-        super(VAPOAgent, self).__init__(**sac_cfg, wandb_login=wandb_login, resume=resume)
+    def __init__(self, cfg, sac_cfg=None, wandb_login=None, resume=False,
+                 policy=None):
+        # policy: only act with it, i.e. load_policy_bundle
+        if(policy is not None):
+            self._init_acting(policy=policy, **sac_cfg)
+        else:
+            super(VAPOAgent, self).__init__(
+                **sac_cfg, wandb_login=wandb_login, resume=resume,
+                metrics_backend=cfg.get("metrics_backend"))
         _cam_id = self._find_cam_id()
         _aff_transforms = get_transforms(
             cfg.affordance.transforms.validation,
@@ -26,6 +32,7 @@ class VAPOAgent(SAC):
         args = {"cam_id": _cam_id,
                 "initial_pos": self.origin,
                 "aff_transforms": _aff_transforms,
+                "device": self.device,
                 **cfg.target_search}
         _class_label = self.get_task_label()
         self.target_search = TargetSearch(self.env,
@@ -59,16 +66,23 @@ class VAPOAgent(SAC):
 
     # Model based methods
     def detect_and_correct(self, env, obs, noisy=False,
-                           rand_sample=True):
+                           rand_sample=True, use_queue=False):
         if(obs is None):
             obs = env.reset()
-        # Compute target in case it moved
-        # Area center is the target position + 5cm in z direction
-        env.move_to_target(self.origin)
-        target_pos, no_target = \
-            self.target_search.compute(env,
-                                       noisy=noisy,
-                                       rand_sample=rand_sample)
+        # Reuse a previously detected target if the static camera
+        # view around it did not change
+        target_pos = None
+        if(use_queue):
+            target_pos = self.target_search.pop_target(env)
+            no_target = False
+        if(target_pos is None):
+            # Compute target in case it moved
+            # Area center is the target position + 5cm in z direction
+            env.move_to_target(self.origin)
+            target_pos, no_target = \
+                self.target_search.compute(env,
+                                           noisy=noisy,
+                                           rand_sample=rand_sample)
         if(no_target):
             self.no_detected_target += 1
         res = self.correct_position(env, obs, target_pos, no_target)
@@ -91,10 +105,6 @@ class VAPOAgent(SAC):
         if(max_episode_length is None):
             max_episode_length = sys.maxsize  # "infinite"
 
-        plot_data = {"actor_loss": [],
-                     "critic_loss": [],
-                     "ent_coef_loss": [], "ent_coef": []}
-
         _log_n_ep = log_interval // max_episode_length
         _full_eval_interval = full_eval_interval // max_episode_length
         if(_log_n_ep < 1):
@@ -105,7 +115,7 @@ class VAPOAgent(SAC):
         self.env, s, _ = self.detect_and_correct(self.env, None,
                                                  noisy=True)
         for ts in range(1, total_timesteps+1):
-            s, done, success, episode_return, episode_length, plot_data, info = \
+            s, done, success, episode_return, episode_length, info = \
                 self.training_step(s, self.curr_ts, episode_return, episode_length)
 
             # End episode
@@ -141,8 +151,7 @@ class VAPOAgent(SAC):
                                           total_timesteps,
                                           self.best_return,
                                           episode_length, episode_return,
-                                          success,
-                                          plot_data)
+                                          success)
                 # Reset everything
                 self.episode += 1
                 self.env.obs_it = 0
@@ -150,6 +159,9 @@ class VAPOAgent(SAC):
                 self.env, s, _ = self.detect_and_correct(self.env, None,
                                                          noisy=True)
             self.curr_ts += 1
+        # Saves the trace if training ended inside the profiled window
+        self._profiler.close()
+        self._resources.close()
         # Evaluate at end of training
         for eval_all_objs in [False, True]:
             if(eval_all_objs and self.env.rand_positions
@@ -243,13 +255,13 @@ class VAPOAgent(SAC):
             env, s, _ = self.correct_position(env, s, target_pos, no_target)
             while(episode_length < max_episode_length and not done):
                 # sample action and scale it to action space
-                s = env.transform_obs(tt(s), "validation")
-                a, _ = self._pi.act(s, deterministic=True)
-                a = a.cpu().detach().numpy()
+                a = self._rollout.act(s, deterministic=True)
                 ns, r, done, info = env.step(a)
                 s = ns
                 episode_return += r
                 episode_length += 1
+            # Videos of the episode written with its outcome
+            env.end_episode()
             success_objs[env.target] = info["success"]
             ep_success.append(info["success"])
             ep_returns.append(episode_return)
@@ -292,7 +304,8 @@ class VAPOAgent(SAC):
             # Search affordances and correct position:
             env, s, no_target = self.detect_and_correct(env,
                                                         self.env.get_obs(),
-                                                        rand_sample=True)
+                                                        rand_sample=True,
+                                                        use_queue=True)
             if(no_target):
                 # If no target model will move to initial position.
                 # Search affordance from this position again
@@ -305,9 +318,7 @@ class VAPOAgent(SAC):
                   and self.no_detected_target < 3
                   and not done):
                 # sample action and scale it to action space
-                s = env.transform_obs(tt(s), "validation")
-                a, _ = self._pi.act(s, deterministic=True)
-                a = a.cpu().detach().numpy()
+                a = self._rollout.act(s, deterministic=True)
                 ns, r, done, info = env.step(a)
                 s = ns
                 episode_return += r
@@ -315,8 +326,9 @@ class VAPOAgent(SAC):
                 total_ts += 1
                 success = info["success"]
             ep_success.append(success)
-            env.episode += 1
-            env.obs_it = 0
+            # Next object is a new episode, same scene
+            env.end_episode()
+            env.start_episode()
         self.log.info(
             "Success: %d/%d " % (np.sum(ep_success), len(ep_success)))
         return ep_success
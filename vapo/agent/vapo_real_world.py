@@ -2,11 +2,10 @@ import time
 import numpy as np
 import sys
 from vapo.agent.core.sac import SAC
-from vapo.agent.core.utils import tt
+from vapo.utils.run_logger import run_logger
 
 from affordance.utils.utils import get_transforms
 from vapo.agent.core.target_search import TargetSearch
-import wandb
 
 
 class FpsController:
@@ -24,8 +23,14 @@ class FpsController:
 
 class VAPOAgent(SAC):
     def __init__(self, cfg, sac_cfg=None, wandb_login=None,
-                 rand_target=False, *args, **kwargs):
-        super(VAPOAgent, self).__init__(**sac_cfg, wandb_login=wandb_login)
+                 rand_target=False, policy=None, *args, **kwargs):
+        # policy: only act with it, i.e. load_policy_bundle
+        if(policy is not None):
+            self._init_acting(policy=policy, **sac_cfg)
+        else:
+            super(VAPOAgent, self).__init__(
+                **sac_cfg, wandb_login=wandb_login,
+                metrics_backend=cfg.get("metrics_backend"))
         _aff_transforms = get_transforms(
             cfg.affordance.transforms.validation,
             cfg.target_search.aff_cfg.img_size)
@@ -43,6 +48,7 @@ class VAPOAgent(SAC):
         args = {"initial_pos": self.origin,
                 "aff_transforms": _aff_transforms,
                 "rand_target": rand_target,
+                "device": self.device,
                 **cfg.target_search}
         self.target_search = TargetSearch(self.env,
                                           **args)
@@ -65,15 +71,24 @@ class VAPOAgent(SAC):
         target_orn = env.get_target_orn(task)
         return target_orn
 
-    def detect_and_correct(self, env):
-        env.reset()
-        # Compute target in case it moved
-        # Area center is the target position + 5cm in z direction
-        target_pos, no_target = self.target_search.compute(env)
-        if(no_target):
-            self.no_detected_target += 1
-            input("No object detected. Please rearrange table.")
-            return self.detect_and_correct(env)
+    def detect_and_correct(self, env, use_queue=False):
+        # Reuse a previously detected target if the static camera
+        # view around it did not change. Only a new detection
+        # resets the env, env.reset(target_pos) moves to the target.
+        target_pos = None
+        if(use_queue):
+            target_pos = self.target_search.pop_target(env)
+        if(target_pos is None):
+            env.reset()
+            # Compute target in case it moved
+            # Area center is the target position + 5cm in z direction
+            target_pos, no_target = self.target_search.compute(env)
+            if(no_target):
+                self.no_detected_target += 1
+                input("No object detected. Please rearrange table.")
+                self.target_search.clear_queue()
+                return self.detect_and_correct(env)
+        no_target = False
 
         robot_target_pos = target_pos.copy()
         target_orn = env.target_orn
@@ -92,10 +107,6 @@ class VAPOAgent(SAC):
         if(max_episode_length is None):
             max_episode_length = sys.maxsize  # "infinite"
 
-        plot_data = {"actor_loss": [],
-                     "critic_loss": [],
-                     "ent_coef_loss": [], "ent_coef": []}
-
         _log_n_ep = log_interval//max_episode_length
         if(_log_n_ep < 1):
             _log_n_ep = 1
@@ -108,7 +119,7 @@ class VAPOAgent(SAC):
 
         for ts in range(1, total_timesteps+1):
             # t = time.time()
-            s, done, success, episode_return, episode_length, plot_data, info = \
+            s, done, success, episode_return, episode_length, info = \
                 self.training_step(s, self.curr_ts, episode_return, episode_length)
 
             # End episode
@@ -133,8 +144,7 @@ class VAPOAgent(SAC):
                                           total_timesteps,
                                           self.best_return,
                                           episode_length, episode_return,
-                                          success,
-                                          plot_data)
+                                          success)
                 # Reset everything
                 self.episode += 1
                 self.env.obs_it = 0
@@ -145,6 +155,9 @@ class VAPOAgent(SAC):
             # fps.step()
             # print(1 / (time.time() - t))
             self.curr_ts += 1
+        # Saves the trace if training ended inside the profiled window
+        self._profiler.close()
+        self._resources.close()
 
     def _eval_and_log(self, t, episode, most_tasks,
                       best_eval_return, n_eval_ep, max_ep_length):
@@ -172,7 +185,7 @@ class VAPOAgent(SAC):
             self.save(self.trained_path
                       + "most_tasks_from_%d.pth" % len(success_lst))
             most_tasks = n_success
-        wandb.log({
+        run_logger.log({
             **write_dict,
             "eval/success(%dep)" % len(success_lst): n_success,
         })
@@ -205,14 +218,14 @@ class VAPOAgent(SAC):
                           target_orn)
             while(episode_length < max_episode_length and not done):
                 # sample action and scale it to action space
-                s = env.transform_obs(tt(s), "validation")
-                a, _ = self._pi.act(s, deterministic=deterministic)
-                a = a.cpu().detach().numpy()
+                a = self._rollout.act(s, deterministic=deterministic)
                 ns, r, done, info = env.step(a)
                 s = ns
                 episode_return += r
                 episode_length += 1
                 time.sleep(0.05)
+            # Videos of the episode written with its outcome
+            env.end_episode()
             success = info['success']
             ep_success.append(success)
             ep_returns.append(episode_return)
@@ -241,22 +254,20 @@ class VAPOAgent(SAC):
         while(total_ts <= max_episode_length * n_objects):
             episode_length, episode_return = 0, 0
             done = False
-            s, _ = self.detect_and_correct(env)
+            s, _ = self.detect_and_correct(env, use_queue=True)
 
             # If it did not find a target again, terminate everything
             while(episode_length < max_episode_length
                   and not done):
                 # sample action and scale it to action space
-                s = env.transform_obs(tt(s), "validation")
-                a, _ = self._pi.act(s,
-                                    deterministic=deterministic)
-                a = a.cpu().detach().numpy()
+                a = self._rollout.act(s, deterministic=deterministic)
                 ns, r, done, info = env.step(a, move_to_box=True)
                 s = ns
                 episode_return += r
                 episode_length += 1
                 total_ts += 1
                 success = info['success']
+            env.end_episode()
             self.log.info(
                 "Success: %s " % str(success) +
                 "Return: %.3f" % episode_return)
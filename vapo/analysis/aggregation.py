@@ -0,0 +1,163 @@
+'''
+    Multi-seed aggregation of the evaluation csvs (results_csv).
+    The csvs of all experiments are loaded in parallel and aligned in a
+    single array (experiments x seeds x steps), experiments with less
+    seeds are padded with nan. Aligned arrays are cached on disk, keyed
+    by the csv files (path, size, mtime) and the alignment parameters.
+'''
+import hashlib
+import glob
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from vapo.analysis.run_history import interp_runs
+
+# File name patterns of the exported metrics
+METRIC_FILES = {"return": "eval*return",
+                "success": "eval*success",
+                "length": "eval*length"}
+
+
+def n_eval_episodes(file_name, default=10):
+    ''' Evaluation episodes in the metric name, i.e. success(15ep) '''
+    search_res = re.search(r"\((.*?)\)", file_name)
+    if search_res:
+        return int(search_res.group(1)[:-2])  # Remove "ep"
+    return default
+
+
+def read_csv(file_name, top_row=None):
+    ''' Csv without the wall time column as np.array '''
+    import pandas as pd
+    return pd.read_csv(file_name).to_numpy()[:top_row, 1:]
+
+
+def load_csvs(files, top_row=None, n_workers=8):
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(lambda f: read_csv(f, top_row), files))
+
+
+def rolling_mean(x, window, axis=-1):
+    '''
+        Same as pd.Series(x).rolling(window, min_periods=window).mean()
+        along axis, with cumulative sums. Windows with a nan are nan.
+    '''
+    x = np.moveaxis(np.asarray(x, dtype=float), axis, -1)
+    valid = ~np.isnan(x)
+    pad = [(0, 0)] * (x.ndim - 1) + [(1, 0)]
+    csum = np.pad(np.cumsum(np.where(valid, x, 0), axis=-1), pad)
+    ccount = np.pad(np.cumsum(valid, axis=-1), pad)
+    out = np.full(x.shape, np.nan)
+    if(x.shape[-1] >= window):
+        sums = csum[..., window:] - csum[..., :-window]
+        counts = ccount[..., window:] - ccount[..., :-window]
+        out[..., window - 1:] = np.where(counts == window,
+                                         sums / window, np.nan)
+    return np.moveaxis(out, -1, axis)
+
+
+def seed_stats(values, axis=0, smooth_window=5):
+    '''
+        Smoothed mean, min and max over the seeds (nan seeds ignored)
+    '''
+    import warnings
+    with warnings.catch_warnings():
+        # Steps where all seeds are nan stay nan
+        warnings.simplefilter("ignore", RuntimeWarning)
+        stats = [np.nanmean(values, axis=axis),
+                 np.nanmin(values, axis=axis),
+                 np.nanmax(values, axis=axis)]
+    return [rolling_mean(s, smooth_window) for s in stats]
+
+
+def align_runs(runs, by="timesteps", length=None,
+               grid_step=1000, eval_rate=20):
+    '''
+        runs: list of np.array (n_evaluations, 2) timestep, value
+        by timesteps: linear interpolation on a grid of grid_step
+        timesteps up to length (default: last timestep of the
+        shortest run), by episodes: truncated to length evaluations
+        (default: shortest run), every eval_rate episodes.
+        returns: steps (n_steps,), values (n_runs, n_steps)
+    '''
+    if(by == "timesteps"):
+        if(length is None):
+            length = min(r[-1, 0] for r in runs)
+        steps = np.arange(0, length, grid_step)
+        values = interp_runs([r[:, 0] for r in runs],
+                             [r[:, -1] for r in runs],
+                             steps, extrapolate=True)
+    else:
+        if(length is None):
+            length = min(len(r) for r in runs)
+        steps = np.arange(0, length * eval_rate, eval_rate)
+        values = np.stack([r[:length, -1] for r in runs])
+    return steps, values
+
+
+def find_files(csv_dir, exp_name, metric):
+    return sorted(glob.glob(os.path.join(
+        csv_dir, "*%s*%s*.csv" % (exp_name, METRIC_FILES[metric]))))
+
+
+def _cache_key(files, params):
+    stats = [[(f, os.path.getsize(f), os.path.getmtime(f)) for f in exp]
+             for exp in files]
+    s = json.dumps({"files": stats, "params": params}, sort_keys=True)
+    return hashlib.sha1(s.encode()).hexdigest()[:16]
+
+
+def aggregate(experiments, csv_dir, metric="success", by="timesteps",
+              top_row=None, cache_dir="./analysis/cache", n_workers=8,
+              **align_args):
+    '''
+        experiments: list of experiment names, matched in the csv names
+        top_row: rows of every csv kept (slice end), i.e. -1 drops the
+        last evaluation
+        returns: {names, steps (n_steps,),
+                  values (n_experiments, max seeds, n_steps),
+                  n_eval_ep}
+        All experiments share the steps: the shortest run of all the
+        experiments defines the length.
+    '''
+    csv_dir = os.path.abspath(csv_dir)
+    files = [find_files(csv_dir, exp, metric) for exp in experiments]
+    for exp, exp_files in zip(experiments, files):
+        if(len(exp_files) == 0):
+            raise FileNotFoundError("no files Match %s in %s"
+                                    % (exp, csv_dir))
+    params = {"metric": metric, "by": by, "top_row": top_row,
+              **align_args}
+    cache_path = None
+    if(cache_dir is not None):
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, "%s_%s_by_%s_%s.npz"
+                                  % (os.path.basename(csv_dir), metric, by,
+                                     _cache_key(files, params)))
+        if(os.path.exists(cache_path)):
+            cached = np.load(cache_path)
+            return {"names": list(cached["names"]),
+                    "steps": cached["steps"],
+                    "values": cached["values"],
+                    "n_eval_ep": int(cached["n_eval_ep"])}
+
+    # All csvs at once
+    flat = [f for exp_files in files for f in exp_files]
+    runs = load_csvs(flat, top_row=top_row, n_workers=n_workers)
+    steps, values = align_runs(runs, by=by, **align_args)
+
+    n_seeds = max(len(exp_files) for exp_files in files)
+    aligned = np.full((len(experiments), n_seeds, len(steps)), np.nan)
+    i = 0
+    for e, exp_files in enumerate(files):
+        aligned[e, :len(exp_files)] = values[i:i + len(exp_files)]
+        i += len(exp_files)
+    res = {"names": list(experiments),
+           "steps": steps,
+           "values": aligned,
+           "n_eval_ep": n_eval_episodes(flat[0])}
+    if(cache_path is not None):
+        np.savez(cache_path, **res)
+    return res
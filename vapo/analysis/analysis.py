@@ -4,8 +4,9 @@ import matplotlib.pyplot as plt
 import os
 import re
 import glob
-from scipy.interpolate import interp1d
 import seaborn as sns
+from vapo.analysis.aggregation import aggregate, load_csvs, \
+    rolling_mean, seed_stats
 
 plt.rc('text', usetex=True)
 
@@ -15,21 +16,10 @@ plt.rcParams['font.size'] = 24
 
 
 def plot_data(data, ax, label, n_ep=6, color="gray", stats_axis=0):
-    mean = np.mean(data, axis=stats_axis)[:, -1]
-    # std = np.std(data, axis=stats_axis)[:, -1]
-    min_values = np.min(data, axis=stats_axis)[:, -1]
-    max_values = np.max(data, axis=stats_axis)[:, -1]
-
     smooth_window = 5
-    mean = np.array(pd.Series(mean).rolling(smooth_window,
-                                            min_periods=smooth_window).mean())
-    # std = np.array(pd.Series(std).rolling(smooth_window,
-    #                                       min_periods=smooth_window).mean())
-    min_values = np.array(pd.Series(min_values).rolling(smooth_window,
-                                                        min_periods=smooth_window).mean())
-    max_values = np.array(pd.Series(max_values).rolling(smooth_window,
-                                                        min_periods=smooth_window).mean())
-
+    mean, min_values, max_values = seed_stats(data[..., -1],
+                                              axis=stats_axis,
+                                              smooth_window=smooth_window)
     steps = data[0, :, 0]
     # for learning_curve in data:
     #     smooth_data = np.array(pd.Series(learning_curve[:, 1]).rolling(smooth_window,
@@ -55,38 +45,6 @@ def interpolate(pt1, pt2, x):
     return y
 
 
-def merge_by_episodes(data, min_data_axs):
-    # Evaluation was done every 20 episodes
-    eval_rate = 20
-    x_label = np.arange(0, min_data_axs * eval_rate, eval_rate)
-
-    # Truncate to the seed with least episodes
-    data = [np.transpose(
-               np.vstack((x_label, d[:min_data_axs, -1]))) for d in data]
-    data = np.stack(data, axis=0)
-    return data
-
-
-def merge_by_timesteps(data, min_data_axs):
-    '''
-        data:
-            list, each element is a different seed
-            data[i].shape = [n_evaluations, 2] (timestep, value)
-    '''
-    idxs = np.arange(0, min_data_axs, 1000)
-    n_pts = len(idxs)
-    data_copy = []
-    for d in data:
-        run_values = np.zeros(shape=(n_pts, d.shape[-1]))
-        interp = interp1d(d[:, 0], d[:, 1], kind='linear', fill_value="extrapolate")
-        run_values[:, 1] = interp(idxs)
-        run_values[:, 0] = idxs
-        data_copy.append(run_values)
-    # data = [d[:min_data_axs] for d in data]
-    data = np.stack(data_copy, axis=0)
-    return data
-
-
 # Data is a list
 def plot_experiments(data, show=True, save=True, n_ep=6,
                      save_name="return", metric="return",
@@ -119,19 +77,14 @@ def plot_experiments(data, show=True, save=True, n_ep=6,
 
 
 def plot_by_time(plot_dict, csv_dir="./results_csv/"):
-    data, labels = [], []
+    labels, files = [], []
     for exp_name, label in plot_dict.items():
-        # Skip wall time
         csv_dir = os.path.abspath(csv_dir)
-        files = glob.glob("%s/*%s*success*.csv" % (csv_dir, exp_name))
-        data.append(pd.read_csv(files[0]).to_numpy())
+        files.append(glob.glob("%s/*%s*success*.csv"
+                               % (csv_dir, exp_name))[0])
         labels.append(label)
-    search_res = re.search(r"\((.*?)\)", files[0])
-    if search_res:
-        search_res = search_res.group(1)
-        n_eval_ep = int(search_res[:-2])  # Remove "ep"
-    else:
-        n_eval_ep = 10
+    # Skip wall time
+    data = load_csvs(files)
 
     fig, ax = plt.subplots(1, 1, figsize=(10, 5.5), sharey=True)
     cm = plt.get_cmap('cool')
@@ -140,9 +93,7 @@ def plot_by_time(plot_dict, csv_dir="./results_csv/"):
               [1, 0, 0, 1]]
     smooth_window = 5
     for exp_data, c, label in zip(data, colors, labels):
-        d = exp_data[:, 2]
-        d = np.array(pd.Series(d).rolling(smooth_window,
-                                          min_periods=smooth_window).mean())
+        d = rolling_mean(exp_data[:, 1], smooth_window)
         d[np.isnan(d)] = 0
         time = np.linspace(0, 2, num=len(d))
         ax.plot(time, d, color=c, label=label)
@@ -163,30 +114,6 @@ def plot_by_time(plot_dict, csv_dir="./results_csv/"):
                 pad_inches=0)
 
 
-# Plot validation data for a single experiment, multiple seeds
-def seeds_mean(files, top_row=-1, data_merge_fnc=merge_by_timesteps):
-    data = []
-    for file_n in files:
-        # Skip wall time
-        data.append(pd.read_csv(file_n).to_numpy()[:top_row, 1:])
-    search_res = re.search(r"\((.*?)\)", files[0])
-    if search_res:
-        search_res = search_res.group(1)
-        n_eval_ep = int(search_res[:-2])  # Remove "ep"
-    else:
-        n_eval_ep = 10
-
-    # Last ts logged for each run
-    if(data_merge_fnc == merge_by_timesteps):
-        min_data_axs = min([d[-1][0] for d in data])
-    else:
-        min_data_axs = min([d.shape[0] for d in data])
-    # Change timesteps by episodes -> x axis will show every n episodes result
-    data = data_merge_fnc(data, min_data_axs)
-
-    return data, n_eval_ep
-
-
 def plot_eval_and_train(eval_files, train_files, task, top_row=-1,
                         show=True, save=True, save_name="return",
                         metric="return"):
@@ -230,45 +157,32 @@ def plot_eval_and_train(eval_files, train_files, task, top_row=-1,
         plt.show()
 
 
-def get_mean_and_std(exp_name="slide", metric="return",
-                     csv_folder="./results/results_csv/",
-                     data_merge_fnc=merge_by_timesteps):
-    if(metric == "return"):
-        eval_files = glob.glob("%s*%s*eval*return*.csv" % (csv_folder, exp_name))
-        # train_files = \
-        #   glob.glob("%s*%s*train*return*.csv" % (csv_folder, exp_name))
-    elif(metric == "success"):
-        eval_files = glob.glob("%s*%s*eval*success*.csv" % (csv_folder, exp_name))
-    else:  # episode length
-        eval_files = glob.glob("%s*%s*eval*length*.csv" % (csv_folder, exp_name))
-        # train_files = \
-        #   glob.glob("%s*%s*train*length*.csv" % (csv_folder, exp_name))
-        metric = "episode length"
-    # assert len(eval_files) == len(train_files)
-    if(len(eval_files) == 0):
-        print("no files Match %s in %s" % (exp_name, csv_folder))
-        return
-    experiment_data, n_eval_ep = seeds_mean(eval_files,
-                                            data_merge_fnc=data_merge_fnc)
-    return experiment_data, n_eval_ep
+def get_aligned(plot_dict, csv_dir, metric, by, top_row=-1):
+    '''
+        top_row: rows of every csv kept, default drops the last evaluation
+        returns: list of [title, np.array (n_seeds, n_steps, 2)]
+        from the cached aggregation of all the experiments, n_eval_ep
+    '''
+    agg = aggregate(list(plot_dict.keys()), csv_dir, metric=metric, by=by,
+                    top_row=top_row)
+    experiments_data = []
+    for title, values in zip(plot_dict.values(), agg["values"]):
+        # Experiments with less seeds are nan padded
+        values = values[~np.isnan(values).all(axis=-1)]
+        steps = np.broadcast_to(agg["steps"], values.shape)
+        experiments_data.append([title, np.stack([steps, values], axis=-1)])
+    return experiments_data, agg["n_eval_ep"]
 
 
 def plot_by_timesteps(plot_dict, csv_dir="./results_csv/"):
     # metrics = ["return", "episode length"]
     metrics = ["success"]
-    experiments_data = []
     for metric in metrics:
-        for exp_name, title in plot_dict.items():
-            mean_data, n_eval_ep = get_mean_and_std(exp_name,
-                                                    csv_folder=csv_dir,
-                                                    metric=metric,
-                                                    data_merge_fnc=merge_by_timesteps)
-            experiments_data.append([title, mean_data])
+        # Cropped to the shortest run of all experiments
+        experiments_data, n_eval_ep = get_aligned(plot_dict, csv_dir,
+                                                  metric, "timesteps")
         save_name = os.path.basename(os.path.normpath(csv_dir)) + \
             "_%s_by_timesteps" % metric
-        min_axs = min([d[-1][0].shape[0] - 1 for d in experiments_data])
-        for i in range(len(experiments_data)):
-            experiments_data[i][-1] = experiments_data[i][-1][:, :min_axs]
         plot_experiments(experiments_data,
                          n_ep=n_eval_ep,
                          show=True,
@@ -283,21 +197,10 @@ def plot_by_timesteps(plot_dict, csv_dir="./results_csv/"):
 def plot_by_episodes(plot_dict, csv_dir="./results_csv/"):
     # metrics = ["return", "episode length"]
     metrics = ["success"]
-    experiments_data = []
     for metric in metrics:
-        min_ep = np.inf
-        for exp_name, title in plot_dict.items():
-            # n_seeds, n_ep, 2
-            mean_data, n_eval_ep = get_mean_and_std(exp_name,
-                                                    csv_folder=csv_dir,
-                                                    metric=metric,
-                                                    data_merge_fnc=merge_by_episodes)
-            experiments_data.append([title, mean_data])
-            if(mean_data.shape[1] < min_ep):
-                min_ep = mean_data.shape[1]
         # Crop to experiment with least episodes
-        experiments_data = [[title, data[:, :min_ep]]
-                            for title, data in experiments_data]
+        experiments_data, n_eval_ep = get_aligned(plot_dict, csv_dir,
+                                                  metric, "episodes")
         save_name = os.path.basename(os.path.normpath(csv_dir)) + \
             "_%s_by_episodes" % metric
         plot_experiments(experiments_data,
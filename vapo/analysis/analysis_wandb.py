@@ -4,12 +4,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 import re
-from scipy.interpolate import interp1d
 import seaborn as sns
 import matplotlib.ticker as ticker
 
-import wandb
 import json
+from vapo.analysis.run_history import RunHistoryCache, WandbSource, \
+    interp_runs
 
 plt.rc('text', usetex=True)
 
@@ -63,24 +63,17 @@ def merge_data(data, min_data_axs, n_datapoints, axis=0):
         data:
             list, each element is a different seed
             data[i].shape = [n_evaluations, 2] (timestep, value)
+        All seeds are interpolated on the same grid at once
     '''
     step = min_data_axs // 1000
     idxs = np.arange(0, min_data_axs + step, step)
-    n_pts = len(idxs)
-    data_copy = []
-    for d in data:
-        d = np.array(d)
-        run_values = np.zeros(shape=(n_pts, 2))
-        interp = interp1d(d[:, axis], d[:, -1],
-                          kind='linear',
-                          fill_value=(0, d[:, -1][-1]),
-                          bounds_error=False)
-        run_values[:, 1] = interp(idxs)
-        run_values[:, 0] = idxs
-        data_copy.append(run_values)
-
-    data = np.stack(data_copy, axis=0)
-    return data
+    data = [np.asarray(d) for d in data]
+    values = interp_runs([d[:, axis] for d in data],
+                         [d[:, -1] for d in data], idxs)
+    merged = np.empty((len(data), len(idxs), 2))
+    merged[:, :, 0] = idxs
+    merged[:, :, 1] = values
+    return merged
 
 
 # Data is a list
@@ -127,49 +120,49 @@ class WandbPlots:
                  track_metrics,
                  load_from_file=True,
                  show=True,
-                 save_dir="./analysis/figures") -> None:
-
+                 save_dir="./analysis/figures",
+                 source=None,
+                 cache_dir="./analysis/run_cache") -> None:
+        '''
+            source: run histories, WandbSource (default) or
+                    run_history.LocalSource for runs of the
+                    local metrics backend
+            cache_dir: histories already fetched, shared between plots
+        '''
         os.makedirs(save_dir, exist_ok=True)
         self.save_dir = os.path.abspath(save_dir)
         json_filepath = os.path.join(self.save_dir, "exp_data.json")
         self.metrics = [m.split('/')[-1] for m in track_metrics]
+        self.cache = RunHistoryCache(cache_dir,
+                                     source if source else WandbSource(),
+                                     row_filter="eval_timestep")
         print("searching data in %s" % json_filepath)
         if(os.path.isfile(json_filepath) and load_from_file):
             print("File found, loading data from previous wandb fetch" )
             with open(json_filepath, "r") as outfile:
                 data = json.load(outfile)
         else:
-            print("No file found, loading data wandb..")
-            data = self.read_from_wandb(experiments, track_metrics)
+            print("No file found, loading run histories..")
+            data = self.read_runs(experiments, track_metrics)
         self.data = data
         self.plot_stats(show)
 
-    def read_from_wandb(self, experiments, wandb_metrics):
-        # Get the runs
-        _api = wandb.Api()
-        runs = {}
-        for exp_name, exp_id in experiments.items():
-            runs[exp_name] = []
-            for credentials in exp_id.keys():
-                project_runs = ["%s/%s" % (credentials, run_id) for run_id in exp_id[credentials]]
-                project_runs = [_api.run(name) for name in project_runs]
-                runs[exp_name].extend(project_runs)
-        # Get the data from the runs
+    def read_runs(self, experiments, wandb_metrics):
+        columns = ["eval_timestep", "eval_episode", *wandb_metrics]
         data = {}
-        for exp_name, run_lst in runs.items():
+        for exp_name, exp_id in experiments.items():
             exp_data = defaultdict(list)
-            for run in run_lst:
-                run_data = defaultdict(list)  # metric: (timestep, episode, value)
-                for row in run.scan_history():
-                    if 'eval_timestep' in row:
-                        for metric in wandb_metrics:
-                            if metric in row:
-                                _row_data = [row['eval_timestep'], row['eval_episode'], row[metric]]
-                                _metric = metric.split('/')[-1]
-                                run_data[_metric].append(_row_data)
-                # List of run data for each metric
-                for metric in self.metrics:
-                    exp_data[metric].append(run_data[metric])
+            for credentials, run_ids in exp_id.items():
+                for run_id in run_ids:
+                    history = self.cache.get("%s/%s" % (credentials, run_id),
+                                             columns)
+                    # List of run data for each metric
+                    # (timestep, episode, value)
+                    for metric in wandb_metrics:
+                        rows = history[history[metric].notna()]
+                        _metric = metric.split('/')[-1]
+                        exp_data[_metric].append(
+                            rows[columns[:2] + [metric]].values.tolist())
             data[exp_name] = exp_data
 
         output_path = os.path.join(self.save_dir, "exp_data.json")
@@ -0,0 +1,225 @@
+'''
+    Local cache of run histories for the analysis plots.
+    Histories are fetched from a source (wandb API or the local metrics
+    backend) and stored per run in a columnar file. Later reads only
+    fetch the rows logged after the cached last step, finished runs are
+    not fetched again.
+'''
+import json
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+STEP = "_step"
+FORMATS = {"parquet": ("parquet", pd.read_parquet, "to_parquet"),
+           "feather": ("feather", pd.read_feather, "to_feather"),
+           "pickle": ("pkl", pd.read_pickle, "to_pickle")}
+
+
+class WandbSource():
+    '''
+        Run histories from the wandb API,
+        runs are identified by "entity/project/run_id"
+    '''
+    def __init__(self, api=None):
+        self._api = api
+
+    @property
+    def api(self):
+        if(self._api is None):
+            import wandb
+            self._api = wandb.Api()
+        return self._api
+
+    def run_info(self, run_path):
+        '''
+            returns: {last_step, finished}
+        '''
+        run = self.api.run(run_path)
+        last_step = getattr(run, "lastHistoryStep", None)
+        if(last_step is None):
+            last_step = run.summary.get(STEP, -1)
+        return {"last_step": last_step, "finished": run.state == "finished"}
+
+    def fetch(self, run_path, min_step=0):
+        '''
+            returns: list of rows (dict) with step >= min_step
+        '''
+        run = self.api.run(run_path)
+        return list(run.scan_history(min_step=min_step))
+
+
+class LocalSource():
+    '''
+        Run histories of the local metrics backend
+        (metrics_backend.backend: local). Runs are identified by id,
+        "entity/project/run_id" is also accepted. Run dirs are searched
+        in root and below, i.e. the hydra outputs folder.
+    '''
+    def __init__(self, root):
+        self.root = root
+        self._dirs = None
+
+    def _run_dir(self, run_path):
+        if(self._dirs is None):
+            found = glob.glob(os.path.join(self.root, "**", "run.json"),
+                              recursive=True)
+            self._dirs = {}
+            for f in sorted(found):
+                run_dir = os.path.dirname(f)
+                # A resumed run has one dir per training job
+                self._dirs.setdefault(os.path.basename(run_dir), []) \
+                    .append(run_dir)
+        run_id = run_path.split("/")[-1]
+        if(run_id not in self._dirs):
+            raise KeyError("Local run %s not found in %s"
+                           % (run_id, self.root))
+        return self._dirs[run_id]
+
+    def run_info(self, run_path):
+        # Reading the local files is as cheap as asking for the last step
+        return {"last_step": None, "finished": False}
+
+    def fetch(self, run_path, min_step=0):
+        from vapo.utils.run_logger import read_records
+        rows, offset = [], 0
+        for run_dir in self._run_dir(run_path):
+            records = read_records(run_dir)
+            # Steps of a resumed run continue after the previous job
+            for r in records:
+                r[STEP] = r[STEP] + offset
+            if(len(records) > 0):
+                offset = records[-1][STEP] + 1
+            rows.extend(r for r in records if r[STEP] >= min_step)
+        return rows
+
+
+class RunHistoryCache():
+    '''
+        cache_dir/<entity>_<project>_<run_id>.<format> with the rows of a
+        run that contain row_filter, restricted to the cached columns.
+        cache_dir/index.json: {run_path: {last_step, finished, columns}}
+        format: parquet, feather (both need pyarrow) or pickle
+    '''
+    def __init__(self, cache_dir, source=None, format="parquet",
+                 row_filter=None):
+        self.cache_dir = cache_dir
+        self.source = source if source is not None else WandbSource()
+        self.row_filter = row_filter
+        self.ext, self._read, self._write = FORMATS[format]
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self.index = {}
+        if(os.path.exists(self._index_path)):
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+
+    def _path(self, run_path):
+        return os.path.join(self.cache_dir, "%s.%s"
+                            % (run_path.replace("/", "_"), self.ext))
+
+    def _save_index(self):
+        with open(self._index_path + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(self._index_path + ".tmp", self._index_path)
+
+    def _to_frame(self, rows, columns):
+        if(self.row_filter is not None):
+            rows = [r for r in rows if self.row_filter in r]
+        df = pd.DataFrame.from_records(rows)
+        for c in columns:
+            if(c not in df.columns):
+                df[c] = np.nan
+        return df[columns]
+
+    def get(self, run_path, columns):
+        '''
+            returns: pd.DataFrame of the run with columns (and _step),
+            sorted by step
+        '''
+        columns = [STEP] + [c for c in columns if c != STEP]
+        entry = self.index.get(run_path)
+        path = self._path(run_path)
+        cached = None
+        if(entry is not None and os.path.exists(path)
+           and set(columns) <= set(entry["columns"])):
+            cached = self._read(path)
+            if(entry["finished"]):
+                return cached[columns]
+            stored = entry["columns"]
+        else:
+            # New run or new columns: full fetch
+            entry = {"last_step": -1, "finished": False}
+            stored = columns
+
+        info = self.source.run_info(run_path)
+        last_step = entry["last_step"]
+        if(cached is not None and info["last_step"] is not None
+           and info["last_step"] <= last_step):
+            rows = []
+        else:
+            rows = self.source.fetch(run_path, min_step=last_step + 1)
+            rows = [r for r in rows if r[STEP] > last_step]
+            if(len(rows) > 0):
+                last_step = max(last_step, max(r[STEP] for r in rows))
+        if(info["last_step"] is not None):
+            last_step = max(last_step, info["last_step"])
+
+        df = cached
+        if(cached is None or len(rows) > 0):
+            new = self._to_frame(rows, stored)
+            if(cached is not None):
+                new = pd.concat([cached, new], ignore_index=True)
+            df = new.sort_values(STEP, kind="stable") \
+                .reset_index(drop=True)
+            getattr(df, self._write)(path)
+        self.index[run_path] = {"last_step": int(last_step),
+                                "finished": bool(info["finished"]),
+                                "columns": stored}
+        self._save_index()
+        return df[columns]
+
+
+def interp_runs(xs, ys, grid, left=0.0, extrapolate=False):
+    '''
+        Linear interpolation of several runs on a shared grid in a
+        single vectorized pass (one searchsorted for all runs).
+        xs, ys: list of 1d arrays, one per run, xs increasing
+        Grid points before the first x of a run are left, after
+        the last x the last value of the run. With extrapolate the
+        first/last two points of the run are extended instead
+        (runs need at least two points).
+        returns: np.array (n_runs, len(grid))
+    '''
+    grid = np.asarray(grid, dtype=float)
+    lengths = np.array([len(x) for x in xs])
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    x = np.concatenate([np.asarray(x, dtype=float) for x in xs])
+    y = np.concatenate([np.asarray(y, dtype=float) for y in ys])
+    # Shift every run to its own disjoint range so the concatenation
+    # stays sorted
+    lo_x = min(x.min(), grid.min())
+    span = max(x.max(), grid.max()) - lo_x + 1
+    run_ids = np.repeat(np.arange(len(xs)), lengths)
+    x_shift = x - lo_x + run_ids * span
+    q = (grid[None, :] - lo_x + np.arange(len(xs))[:, None] * span)
+
+    hi = np.searchsorted(x_shift, q, side="right")
+    lo = hi - 1
+    before = lo < starts[:, None]
+    after = hi >= ends[:, None]
+    if(extrapolate):
+        # Segment of the first/last two points outside of the run
+        lo = np.clip(lo, starts[:, None], ends[:, None] - 2)
+        hi = lo + 1
+    lo_c = np.clip(lo, 0, len(x) - 1)
+    hi_c = np.clip(hi, 0, len(x) - 1)
+    dx = x_shift[hi_c] - x_shift[lo_c]
+    t = np.where(dx > 0, (q - x_shift[lo_c]) / np.where(dx > 0, dx, 1), 0)
+    values = y[lo_c] + t * (y[hi_c] - y[lo_c])
+    if(not extrapolate):
+        values = np.where(after, y[ends - 1][:, None], values)
+        values = np.where(before, left, values)
+    return values
@@ -0,0 +1,195 @@
+'''
+    Startup time of the training/test entry points, per stage:
+    imports, config, env creation, affordance model load,
+    wandb init, network build and agent construction.
+
+    usage:
+        python -m vapo.startup_profile [--config-name cfg_tabletop]
+            [--stages imports,config,env,wandb,networks,agent]
+            [--wandb] [--json out.json] [hydra overrides ...]
+'''
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+STAGES = ["imports", "config", "env", "wandb", "networks", "agent"]
+
+# Import order of the entry points, times are incremental
+IMPORTS = ["numpy", "torch", "gym", "cv2", "omegaconf", "hydra",
+           "scipy.spatial", "wandb", "pybullet",
+           "vr_env.envs.play_table_env",
+           "affordance.affordance_model",
+           "vapo.agent.core.sac",
+           "vapo.wrappers.play_table_rl",
+           "vapo.wrappers.affordance.aff_wrapper_sim",
+           "vapo.agent.vapo_agent"]
+
+
+class StageTimer():
+    def __init__(self):
+        self.results = []
+
+    def run(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            res = fn(*args, **kwargs)
+            status = "ok"
+        except Exception as e:
+            res = None
+            status = "%s: %s" % (type(e).__name__, str(e).split("\n")[0])
+        self.results.append({"stage": name,
+                             "time": time.perf_counter() - start,
+                             "status": status})
+        return res
+
+    def add(self, name, t, status="ok"):
+        self.results.append({"stage": name, "time": t, "status": status})
+
+    def print(self):
+        total = sum(r["time"] for r in self.results)
+        print("%-45s %10s %7s  %s" % ("stage", "time [s]", "%", "status"))
+        for r in self.results:
+            perc = 100 * r["time"] / total if total > 0 else 0
+            print("%-45s %10.3f %6.1f%%  %s"
+                  % (r["stage"], r["time"], perc, r["status"]))
+        print("%-45s %10.3f" % ("total", total))
+
+
+def profile_imports(timer):
+    for module in IMPORTS:
+        if(module in sys.modules):
+            timer.add("import %s" % module, 0.0, "already imported")
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+            status = "ok"
+        except ImportError as e:
+            status = "not installed (%s)" % e.name
+        timer.add("import %s" % module, time.perf_counter() - start, status)
+
+
+def load_config(config_name, overrides):
+    from hydra import initialize_config_dir, compose
+    from hydra.core.hydra_config import HydraConfig
+    from omegaconf import open_dict
+    config_dir = os.path.join(os.path.dirname(os.path.dirname(
+                              os.path.abspath(__file__))), "config")
+    with initialize_config_dir(config_dir=config_dir):
+        cfg = compose(config_name=config_name, overrides=overrides,
+                      return_hydra_config=True)
+    # get_abs_path relies on the hydra runtime cwd
+    with open_dict(cfg):
+        cfg.hydra.runtime.cwd = os.getcwd()
+    HydraConfig.instance().set_config(cfg)
+    return cfg
+
+
+def build_env(cfg):
+    from vapo.wrappers.play_table_rl import PlayTableRL
+    return PlayTableRL(**cfg.env)
+
+
+def build_env_wrapper(cfg, env):
+    from vapo.wrappers.affordance.aff_wrapper_sim import AffordanceWrapperSim
+    max_ts = cfg.agent.learn_config.max_episode_length
+    return AffordanceWrapperSim(env, max_ts,
+                                train=True,
+                                affordance_cfg=cfg.affordance,
+                                viz=False,
+                                save_images=False,
+                                **cfg.env_wrapper)
+
+
+def init_wandb(cfg, online):
+    import wandb
+    if(online):
+        run = wandb.init(**cfg.wandb_login)
+    else:
+        run = wandb.init(mode="disabled")
+    run.finish()
+
+
+def build_networks(cfg, env):
+    import logging
+    import torch
+    from vapo.agent.core.utils import get_nets
+    net_cfg = cfg.agent.net_cfg
+    policy_net, critic_net, obs_space, action_dim = \
+        get_nets(True, env.observation_space, env.action_space,
+                 logging.getLogger(__name__),
+                 net_cfg.get("actor_net"), net_cfg.get("critic_net"))
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    nets = [policy_net(obs_space, action_dim,
+                       action_space=env.action_space, **net_cfg)]
+    nets += [critic_net(obs_space, action_dim, **net_cfg) for _ in range(4)]
+    return [net.to(device) for net in nets]
+
+
+def build_agent(cfg, env):
+    from vapo.agent.vapo_agent import VAPOAgent
+    sac_cfg = {"env": env,
+               "eval_env": None,
+               "model_name": cfg.model_name,
+               "save_dir": cfg.agent.save_dir,
+               "net_cfg": cfg.agent.net_cfg,
+               "train_mean_n_ep": cfg.agent.train_mean_n_ep,
+               "save_replay_buffer": False,
+               **cfg.agent.hyperparameters}
+    return VAPOAgent(cfg, sac_cfg=sac_cfg, wandb_login=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-name", default="cfg_tabletop")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--wandb", action="store_true",
+                        help="Online wandb init with cfg.wandb_login")
+    parser.add_argument("--json", default=None,
+                        help="Also write the results to this file")
+    args, overrides = parser.parse_known_args(argv)
+    stages = args.stages.split(",")
+    timer = StageTimer()
+
+    if("imports" in stages):
+        profile_imports(timer)
+    cfg = timer.run("config (%s)" % args.config_name,
+                    load_config, args.config_name, overrides)
+
+    env = None
+    if(cfg is not None and "env" in stages):
+        if("robot_env" in cfg):
+            timer.add("env", 0.0, "skipped, real robot config")
+        else:
+            env = timer.run("env creation", build_env, cfg)
+        if(env is not None):
+            from vapo.utils.model_registry import aff_model_registry
+            env = timer.run("env wrapper (incl. aff-net load)",
+                            build_env_wrapper, cfg, env)
+            metrics = aff_model_registry.metrics()
+            timer.add("  of which aff-net load (%d models)"
+                      % metrics["aff_models/n_loaded"],
+                      0.0, "%.3fs, %.1f MB" % (metrics["aff_models/load_time"],
+                                               metrics["aff_models/memory_mb"]))
+    if(cfg is not None and "wandb" in stages):
+        timer.run("wandb init (%s)" % ("online" if args.wandb else "disabled"),
+                  init_wandb, cfg, args.wandb)
+    if(env is not None and "networks" in stages):
+        timer.run("network build (actor + 4 critics)",
+                  build_networks, cfg, env)
+    if(env is not None and "agent" in stages):
+        timer.run("agent construction", build_agent, cfg, env)
+
+    timer.print()
+    if(args.json):
+        with open(args.json, "w") as f:
+            json.dump(timer.results, f, indent=2)
+    return timer.results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+'''
+    Uploads runs logged with the local metrics backend
+    (metrics_backend.backend: local) to wandb.
+    Runs are resumed by id, so a second sync of the same run only
+    uploads the records logged since the previous one, and runs of
+    resumed trainings (same id) end up in the same wandb run.
+
+    usage:
+        python -m vapo.sync_metrics <run dir or metrics dir> [...]
+            [--entity E] [--project P] [--dry-run]
+'''
+import argparse
+import glob
+import json
+import os
+from vapo.utils.run_logger import read_records
+
+SYNC_FILE = "synced.json"
+
+
+def find_runs(paths):
+    '''
+        returns: run dirs (containing run.json) in or below paths
+    '''
+    runs = []
+    for path in paths:
+        if(os.path.exists(os.path.join(path, "run.json"))):
+            runs.append(path)
+        else:
+            found = glob.glob(os.path.join(path, "**", "run.json"),
+                              recursive=True)
+            runs.extend(sorted(os.path.dirname(f) for f in found))
+    return runs
+
+
+def _from_json(value):
+    if(isinstance(value, dict) and value.get("_type") == "histogram"):
+        import wandb
+        return wandb.Histogram(np_histogram=(value["values"],
+                                             value["bins"]))
+    return value
+
+
+def sync_run(run_dir, entity=None, project=None, dry_run=False):
+    '''
+        returns: number of uploaded records
+    '''
+    with open(os.path.join(run_dir, "run.json")) as f:
+        info = json.load(f)
+    sync_path = os.path.join(run_dir, SYNC_FILE)
+    n_synced = 0
+    if(os.path.exists(sync_path)):
+        with open(sync_path) as f:
+            n_synced = json.load(f)["records"]
+    records = read_records(run_dir)[n_synced:]
+    print("%s: %d new records (%d synced before)"
+          % (run_dir, len(records), n_synced))
+    if(dry_run or len(records) == 0):
+        return 0
+
+    import wandb
+    init_kwargs = dict(info["init"])
+    if(entity):
+        init_kwargs["entity"] = entity
+    if(project):
+        init_kwargs["project"] = project
+    run = wandb.init(id=info["id"], name=info["name"],
+                     config=info["config"], resume="allow", **init_kwargs)
+    try:
+        for r in records:
+            data = {k: _from_json(v) for k, v in r.items()
+                    if not k.startswith("_")}
+            # Steps are numbered by wandb as for an online run, a resumed
+            # run continues after the steps of the previous syncs
+            run.log(data)
+    finally:
+        run.finish()
+    with open(sync_path, "w") as f:
+        json.dump({"records": n_synced + len(records)}, f)
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--entity", default=None,
+                        help="Overrides the entity of the run")
+    parser.add_argument("--project", default=None,
+                        help="Overrides the project of the run")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only print the records to upload")
+    args = parser.parse_args(argv)
+    runs = find_runs(args.paths)
+    if(len(runs) == 0):
+        print("No local runs found in %s" % ", ".join(args.paths))
+    n = 0
+    for run_dir in runs:
+        n += sync_run(run_dir, args.entity, args.project, args.dry_run)
+    print("Uploaded %d records of %d runs" % (n, len(runs)))
+    return n
+
+
+if __name__ == "__main__":
+    main()
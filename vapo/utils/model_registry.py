@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+
+def _model_bytes(model):
+    n_bytes = 0
+    for t in list(model.parameters()) + list(model.buffers()):
+        n_bytes += t.numel() * t.element_size()
+    return n_bytes
+
+
+class AffordanceModelRegistry():
+    '''
+        Process wide cache of affordance models in eval mode.
+        Models are keyed by (checkpoint path, hyperparameters, device),
+        requesting the same key again returns the shared instance.
+    '''
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def _key(self, path, hp, device):
+        from omegaconf import OmegaConf
+        if(OmegaConf.is_config(hp)):
+            hp = OmegaConf.to_container(hp, resolve=True)
+        return (path, json.dumps(hp, sort_keys=True, default=str), str(device))
+
+    def get(self, path, hp, device="cuda"):
+        key = self._key(path, hp, device)
+        with self._lock:
+            model = self._models.get(key)
+            if(model is not None):
+                self.hits += 1
+                return model
+            start = time.time()
+            from affordance.affordance_model import AffordanceModel
+            model = AffordanceModel.load_from_checkpoint(path, **hp)
+            model.to(device)
+            model.eval()
+            self._models[key] = model
+            self._stats[key] = {"load_time": time.time() - start,
+                                "n_bytes": _model_bytes(model)}
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._models = {}
+            self._stats = {}
+            self.hits = 0
+
+    def metrics(self):
+        load_time = sum(s["load_time"] for s in self._stats.values())
+        n_bytes = sum(s["n_bytes"] for s in self._stats.values())
+        return {"aff_models/n_loaded": len(self._models),
+                "aff_models/n_shared": self.hits,
+                "aff_models/load_time": load_time,
+                "aff_models/memory_mb": n_bytes / 2**20}
+
+
+aff_model_registry = AffordanceModelRegistry()
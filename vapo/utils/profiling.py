@@ -0,0 +1,221 @@
+import contextlib
+import os
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+
+
+class _Span():
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        self._range = None
+        if(self.timers.record_functions):
+            self._range = self.timers.record_range(self.name)
+            self._range.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if(self.timers.cuda_sync):
+            self.timers.synchronize()
+        self.timers.add(self.name, time.perf_counter() - self.start)
+        if(self._range is not None):
+            self._range.__exit__(*args)
+        return False
+
+
+class PhaseTimers():
+    '''
+        Wall clock time of the phases of the training loop, i.e.
+            with phase_timers.span("env/physics"):
+                ...
+        When disabled span() returns a shared null context and nothing
+        is recorded.
+        cuda_sync: synchronize the gpu when closing a span, otherwise
+        asynchronous gpu work is attributed to the phase waiting for it.
+        Spans can be recorded from other threads (delayed affordance
+        inference).
+        While an UpdateProfiler records, spans are also named ranges
+        (record_function) of the torch.profiler trace.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.cuda_sync = False
+        self.record_functions = False
+        self._null = contextlib.nullcontext()
+        self._lock = threading.Lock()
+        self._times = defaultdict(list)
+
+    def configure(self, enabled=False, cuda_sync=True):
+        self.enabled = enabled
+        self.cuda_sync = False
+        if(enabled and cuda_sync):
+            import torch
+            self.cuda_sync = torch.cuda.is_available()
+            self.synchronize = torch.cuda.synchronize
+        self._times = defaultdict(list)
+
+    def set_record_functions(self, record):
+        self.record_functions = record
+        if(record):
+            from torch.profiler import record_function
+            self.record_range = record_function
+
+    def span(self, name):
+        if(not self.enabled):
+            if(self.record_functions):
+                return self.record_range(name)
+            return self._null
+        return _Span(self, name)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._times[name].append(seconds)
+
+    def flush(self):
+        '''
+            returns: {phase: np.array of span durations in ms}
+            and resets the recorded times
+        '''
+        with self._lock:
+            times, self._times = self._times, defaultdict(list)
+        return {k: np.array(v) * 1000 for k, v in times.items()}
+
+
+def timer_metrics(samples, prefix="timers/"):
+    '''
+        Summary per phase of the flushed span durations (ms)
+    '''
+    metrics = {}
+    for name, ms in samples.items():
+        if(len(ms) == 0):
+            continue
+        metrics.update({
+            "%s%s/mean_ms" % (prefix, name): ms.mean(),
+            "%s%s/p50_ms" % (prefix, name): np.percentile(ms, 50),
+            "%s%s/p95_ms" % (prefix, name): np.percentile(ms, 95),
+            "%s%s/max_ms" % (prefix, name): ms.max(),
+            "%s%s/total_s" % (prefix, name): ms.sum() / 1000,
+            "%s%s/count" % (prefix, name): len(ms)})
+    return metrics
+
+
+# Shared by the agent, wrappers and target search
+phase_timers = PhaseTimers()
+
+
+class UpdateProfiler():
+    '''
+        torch.profiler over a window of training steps with network
+        updates. After the first update, wait steps are skipped and
+        warmup steps traced but discarded, then updates steps are
+        recorded. The trace is written to out_dir (relative to the
+        hydra run dir) as <host>.<time>.pt.trace.json, which opens in
+        chrome://tracing, perfetto and the TensorBoard profiler plugin.
+        A table of the top operators is logged.
+    '''
+    def __init__(self, updates=0, wait=0, warmup=2, record_shapes=True,
+                 profile_memory=True, with_stack=True, sort_by=None,
+                 row_limit=25, out_dir="./profiler", log=None):
+        self.enabled = updates > 0
+        self.updates = updates
+        self.wait = wait
+        self.warmup = warmup
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self.with_stack = with_stack
+        self.sort_by = sort_by
+        self.row_limit = row_limit
+        self.out_dir = out_dir
+        self.log = log
+        self._null = contextlib.nullcontext()
+        self._prof = None
+        self._done = not self.enabled
+
+    @property
+    def active(self):
+        return self._prof is not None
+
+    def record(self, name):
+        '''
+            Named range of the trace while profiling, null context otherwise
+        '''
+        if(self._prof is None):
+            return self._null
+        return self.record_range(name)
+
+    def _start(self):
+        import torch
+        from torch.profiler import profile, schedule, record_function, \
+            ProfilerActivity
+        self.record_range = record_function
+        activities = [ProfilerActivity.CPU]
+        self._cuda = torch.cuda.is_available()
+        if(self._cuda):
+            activities.append(ProfilerActivity.CUDA)
+        self._prof = profile(
+            activities=activities,
+            schedule=schedule(wait=self.wait, warmup=self.warmup,
+                              active=self.updates, repeat=1),
+            on_trace_ready=self._on_trace_ready,
+            record_shapes=self.record_shapes,
+            profile_memory=self.profile_memory,
+            with_stack=self.with_stack)
+        self._prof.start()
+        phase_timers.set_record_functions(True)
+        self._info("torch.profiler: recording %d training steps "
+                   "after %d wait and %d warmup steps"
+                   % (self.updates, self.wait, self.warmup))
+
+    def step(self):
+        '''
+            Called after every training step with a network update.
+            The first call starts the profiler.
+        '''
+        if(self._done):
+            return
+        if(self._prof is None):
+            self._start()
+            return
+        self._prof.step()
+        if(self._prof.step_num >= self.wait + self.warmup + self.updates):
+            self.close()
+
+    def close(self):
+        '''
+            Stops the profiler, an unfinished window is saved
+            with the steps recorded so far
+        '''
+        self._done = True
+        if(self._prof is not None):
+            self._prof.stop()
+            self._prof = None
+            phase_timers.set_record_functions(False)
+
+    def _on_trace_ready(self, prof):
+        from torch.profiler import tensorboard_trace_handler
+        out_dir = os.path.abspath(self.out_dir)
+        tensorboard_trace_handler(out_dir)(prof)
+        self._info("torch.profiler: trace written to %s" % out_dir)
+        device = "cuda" if self._cuda else "cpu"
+        sort_by = self.sort_by or "self_%s_time_total" % device
+        table = prof.key_averages().table(sort_by=sort_by,
+                                          row_limit=self.row_limit)
+        self._info("torch.profiler: top operators by %s\n%s"
+                   % (sort_by, table))
+        if(self.profile_memory):
+            sort_by = "self_%s_memory_usage" % device
+            table = prof.key_averages().table(sort_by=sort_by,
+                                              row_limit=self.row_limit)
+            self._info("torch.profiler: top operators by %s\n%s"
+                       % (sort_by, table))
+
+    def _info(self, msg):
+        if(self.log is not None):
+            self.log.info(msg)
+        else:
+            print(msg)
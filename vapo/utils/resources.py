@@ -0,0 +1,207 @@
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# Averaged over the samples of a flush, other values are the last sample
+_RATES = ("_percent", "_mb_s")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def process_rss():
+    ''' Resident memory in bytes, None if not available '''
+    statm = _read("/proc/self/statm")
+    if(statm is not None):
+        return int(statm.split()[1]) * _PAGE_SIZE
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak instead of current, kB on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def thread_cpu_times():
+    '''
+        returns: {thread id: cpu seconds} of all the threads
+        of the process (linux only, empty otherwise)
+    '''
+    times = {}
+    try:
+        tids = os.listdir("/proc/self/task")
+    except OSError:
+        return times
+    tick = os.sysconf("SC_CLK_TCK")
+    for tid in tids:
+        stat = _read("/proc/self/task/%s/stat" % tid)
+        if(stat is None):
+            continue
+        # Fields after the executable name, which may contain spaces
+        fields = stat[stat.rfind(")") + 2:].split()
+        times[int(tid)] = (int(fields[11]) + int(fields[12])) / tick
+    return times
+
+
+def open_files():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def written_bytes():
+    ''' Bytes written to storage by the process so far '''
+    io = _read("/proc/self/io")
+    if(io is None):
+        return None
+    for line in io.splitlines():
+        if(line.startswith("write_bytes:")):
+            return int(line.split()[1])
+    return None
+
+
+class ResourceSampler():
+    '''
+        Samples the resource usage of the process on a background thread
+        every interval seconds:
+            - rss, cpu utilization of the process and per python thread
+              (native threads, i.e. torch workers, are summed as "other")
+            - open file descriptors and disk write rate
+            - cuda memory, only if torch already initialized cuda
+            - metrics of the registered sources, i.e. replay buffer bytes
+        flush() returns the metrics since the last flush, rates are
+        averaged and the other values are the last sample.
+        Uses /proc, on other platforms only rss and process cpu are sampled.
+        rss_warn_mb: log a warning every time rss grows past
+        another multiple of it.
+    '''
+    def __init__(self, interval=0, rss_warn_mb=None, count_objects=False,
+                 log=None):
+        self.interval = interval
+        self.enabled = interval > 0
+        self.rss_warn_mb = rss_warn_mb
+        self.count_objects = count_objects
+        self.log = log if log else logging.getLogger(__name__)
+        self._sources = {}
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._rss_warned = 0
+
+    def add_source(self, name, fn):
+        '''
+            fn() -> {metric: value}, called from the sampler thread,
+            logged as resources/<name>/<metric>
+        '''
+        self._sources[name] = fn
+
+    def start(self):
+        if(not self.enabled or self._thread is not None):
+            return
+        self._last = self._counters()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="ResourceSampler")
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if(self._thread is not None):
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while(not self._stop.wait(self.interval)):
+            try:
+                sample = self.sample()
+            except Exception as e:
+                # Sampling must never take down training
+                self.log.warning("ResourceSampler: %s" % e)
+                continue
+            with self._lock:
+                for k, v in sample.items():
+                    self._samples[k].append(v)
+
+    def _counters(self):
+        return {"time": time.perf_counter(),
+                "cpu": sum(os.times()[:2]),
+                "threads": thread_cpu_times(),
+                "written": written_bytes()}
+
+    def sample(self):
+        '''
+            returns: {resources/<metric>: value} since the previous sample
+        '''
+        last, curr = self._last, self._counters()
+        self._last = curr
+        dt = max(curr["time"] - last["time"], 1e-6)
+        res = {"cpu_percent": (curr["cpu"] - last["cpu"]) / dt * 100}
+
+        rss = process_rss()
+        if(rss is not None):
+            res["rss_mb"] = rss / 2**20
+            self._check_rss(res["rss_mb"])
+
+        names = {t.native_id: t.name for t in threading.enumerate()}
+        threads = defaultdict(float)
+        for tid, cpu in curr["threads"].items():
+            name = names.get(tid, "other")
+            threads[name] += cpu - last["threads"].get(tid, 0)
+        for name, cpu in threads.items():
+            res["cpu_thread/%s_percent" % name] = cpu / dt * 100
+
+        n_files = open_files()
+        if(n_files is not None):
+            res["open_files"] = n_files
+        if(curr["written"] is not None and last["written"] is not None):
+            res["disk_write_mb_s"] = \
+                (curr["written"] - last["written"]) / 2**20 / dt
+
+        torch = sys.modules.get("torch")
+        if(torch is not None and torch.cuda.is_initialized()):
+            res["cuda_allocated_mb"] = torch.cuda.memory_allocated() / 2**20
+            res["cuda_reserved_mb"] = torch.cuda.memory_reserved() / 2**20
+            res["cuda_max_allocated_mb"] = \
+                torch.cuda.max_memory_allocated() / 2**20
+
+        if(self.count_objects):
+            res["gc_objects"] = len(gc.get_objects())
+
+        for name, fn in list(self._sources.items()):
+            for k, v in fn().items():
+                res["%s/%s" % (name, k)] = v
+        return {"resources/%s" % k: v for k, v in res.items()}
+
+    def _check_rss(self, rss_mb):
+        if(not self.rss_warn_mb):
+            return
+        level = int(rss_mb // self.rss_warn_mb)
+        if(level > self._rss_warned):
+            self._rss_warned = level
+            self.log.warning("ResourceSampler: rss %.0f MB" % rss_mb)
+
+    def flush(self):
+        '''
+            returns: {metric: value} and resets the samples
+        '''
+        with self._lock:
+            samples, self._samples = self._samples, defaultdict(list)
+        metrics = {}
+        for k, values in samples.items():
+            if(k.endswith(_RATES)):
+                metrics[k] = sum(values) / len(values)
+            else:
+                metrics[k] = values[-1]
+        return metrics
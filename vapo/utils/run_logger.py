@@ -0,0 +1,314 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import string
+import threading
+import time
+import numpy as np
+
+BACKENDS = ["wandb", "local", "both", "disabled"]
+logger = logging.getLogger(__name__)
+
+
+def generate_id(length=8):
+    ''' Run id in the format of wandb.util.generate_id '''
+    chars = string.ascii_lowercase + string.digits
+    return "".join(random.choice(chars) for _ in range(length))
+
+
+class Histogram():
+    '''
+        Stand-in of wandb.Histogram, stored as bin counts in the
+        local logs and converted to wandb.Histogram for wandb
+    '''
+    def __init__(self, sequence=None, np_histogram=None, num_bins=64):
+        if(np_histogram is None):
+            np_histogram = np.histogram(np.asarray(sequence), bins=num_bins)
+        self.counts, self.bins = np_histogram
+
+    def to_json(self):
+        return {"_type": "histogram",
+                "values": np.asarray(self.counts).tolist(),
+                "bins": np.asarray(self.bins).tolist()}
+
+    def to_wandb(self):
+        import wandb
+        return wandb.Histogram(np_histogram=(self.counts, self.bins))
+
+
+def to_json_value(value):
+    '''
+        Python value of a logged metric, None if it cannot be stored
+    '''
+    if(isinstance(value, (bool, int, float, str)) or value is None):
+        return value
+    if(isinstance(value, Histogram)):
+        return value.to_json()
+    if(isinstance(value, np.generic)):
+        return value.item()
+    if(hasattr(value, "item") and getattr(value, "ndim", None) == 0):
+        # 0-d np.array or torch.tensor
+        return value.item()
+    return None
+
+
+class JSONLSink():
+    ''' One json record per line, append only '''
+    def __init__(self, run_dir):
+        self.path = os.path.join(run_dir, "metrics.jsonl")
+        self._f = None
+
+    def write(self, records):
+        if(self._f is None):
+            self._f = open(self.path, "a")
+        self._f.write("".join(json.dumps(r) + "\n" for r in records))
+        self._f.flush()
+
+    def close(self):
+        if(self._f is not None):
+            self._f.close()
+            self._f = None
+
+
+class SQLiteSink():
+    ''' records(step, timestamp, data json), append only '''
+    def __init__(self, run_dir):
+        self.path = os.path.join(run_dir, "metrics.sqlite")
+        self._db = None
+
+    def write(self, records):
+        if(self._db is None):
+            # Connection belongs to the writer thread
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS records "
+                             "(step INTEGER, timestamp REAL, data TEXT)")
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO records VALUES (?, ?, ?)",
+                [(r["_step"], r["_timestamp"], json.dumps(r))
+                 for r in records])
+
+    def close(self):
+        if(self._db is not None):
+            self._db.close()
+            self._db = None
+
+
+SINKS = {"jsonl": JSONLSink, "sqlite": SQLiteSink}
+
+
+def read_records(run_dir):
+    '''
+        returns: list of logged records of a local run, in order
+    '''
+    path = os.path.join(run_dir, "metrics.jsonl")
+    if(os.path.exists(path)):
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    path = os.path.join(run_dir, "metrics.sqlite")
+    if(os.path.exists(path)):
+        db = sqlite3.connect(path)
+        try:
+            rows = db.execute("SELECT data FROM records ORDER BY rowid")
+            return [json.loads(data) for data, in rows]
+        finally:
+            db.close()
+    return []
+
+
+class LocalRun():
+    '''
+        Run logged to <dir>/<id>: run.json with the init arguments and
+        config, metrics in an append-only jsonl or sqlite file.
+        log() only enqueues, a background thread writes the records in
+        batches every flush_interval seconds or batch_size records.
+    '''
+    def __init__(self, dir, id, name=None, config=None, resume=None,
+                 format="jsonl", flush_interval=5.0, batch_size=256,
+                 init_kwargs=None):
+        self.id = id
+        self.name = name
+        self.dir = os.path.abspath(os.path.join(dir, id))
+        os.makedirs(self.dir, exist_ok=True)
+        info = self._read_info()
+        if(info is not None and not resume):
+            raise ValueError("Local run %s already exists, use resume"
+                             % self.dir)
+        if(info is None):
+            info = {"id": id, "name": name, "config": {},
+                    "init": init_kwargs or {}, "created": time.time(),
+                    "step": 0, "format": format}
+        if(config):
+            info["config"].update(config)
+        self.info = info
+        self.config = info["config"]
+        self._write_info()
+
+        self.step = info["step"]
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._sink = SINKS[info["format"]](self.dir)
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._skipped = set()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="LocalRunWriter")
+        self._thread.start()
+
+    def _read_info(self):
+        path = os.path.join(self.dir, "run.json")
+        if(not os.path.exists(path)):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_info(self):
+        path = os.path.join(self.dir, "run.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.info, f, indent=2, default=str)
+        os.replace(path + ".tmp", path)
+
+    def log(self, data, step=None, commit=True):
+        '''
+            Same semantics as wandb.log: values are accumulated until
+            commit, step defaults to an internal counter
+        '''
+        if(step is not None and step != self.step):
+            self._commit()
+            self.step = step
+        for k, v in data.items():
+            value = to_json_value(v)
+            if(value is None and v is not None):
+                if(k not in self._skipped):
+                    self._skipped.add(k)
+                    logger.warning("LocalRun: %s of type %s is not logged"
+                                   % (k, type(v).__name__))
+                continue
+            self._pending[k] = value
+        if(commit):
+            self._commit()
+
+    def _commit(self):
+        if(len(self._pending) == 0):
+            return
+        record = {"_step": self.step, "_timestamp": time.time()}
+        record.update(self._pending)
+        self._pending = {}
+        self._queue.put(record)
+        self.step += 1
+
+    def _run(self):
+        records, closing = [], False
+        last_write = time.time()
+        while(not closing):
+            timeout = max(self.flush_interval - (time.time() - last_write),
+                          0.01)
+            try:
+                record = self._queue.get(timeout=timeout)
+                if(record is None):
+                    closing = True
+                else:
+                    records.append(record)
+            except queue.Empty:
+                pass
+            if(len(records) > 0
+               and (closing or len(records) >= self.batch_size
+                    or time.time() - last_write >= self.flush_interval)):
+                try:
+                    self._sink.write(records)
+                except Exception as e:
+                    logger.error("LocalRun: writing %d records failed: %s"
+                                 % (len(records), e))
+                records = []
+                last_write = time.time()
+        self._sink.close()
+
+    def finish(self):
+        if(self._thread is None):
+            return
+        self._commit()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.info["step"] = self.step
+        self._write_info()
+
+
+class RunLogger():
+    '''
+        Metrics backend with the module API of wandb (init, log, finish,
+        Histogram, generate_id). Configured once per process with
+            run_logger.configure(backend="local", dir="./metrics")
+        backend:
+            wandb: calls are forwarded to wandb
+            local: LocalRun, offline, see vapo/sync_metrics.py to upload
+            both: wandb and local
+            disabled: nothing is logged
+        log() without an active run is ignored, except for the wandb
+        backend where it is forwarded as before.
+    '''
+    Histogram = Histogram
+
+    def __init__(self):
+        self.configure()
+        atexit.register(self.finish)
+
+    def configure(self, backend="wandb", dir="./metrics", format="jsonl",
+                  flush_interval=5.0, batch_size=256):
+        if(backend not in BACKENDS):
+            raise ValueError("Unknown metrics backend %s, options: %s"
+                             % (backend, BACKENDS))
+        if(format not in SINKS):
+            raise ValueError("Unknown metrics format %s, options: %s"
+                             % (format, list(SINKS.keys())))
+        self.backend = backend
+        self.local_cfg = {"dir": dir, "format": format,
+                          "flush_interval": flush_interval,
+                          "batch_size": batch_size}
+        self.run = None
+        self.use_wandb = backend in ["wandb", "both"]
+        self.use_local = backend in ["local", "both"]
+
+    def generate_id(self):
+        return generate_id()
+
+    def init(self, id=None, name=None, config=None, resume=None, **kwargs):
+        if(id is None):
+            id = generate_id()
+        if(self.use_wandb):
+            import wandb
+            wandb.init(id=id, name=name, config=config, resume=resume,
+                       **kwargs)
+        if(self.use_local):
+            # wandb.init arguments (entity, project...) are kept for the sync
+            self.run = LocalRun(id=id, name=name, config=config,
+                                resume=resume, init_kwargs=kwargs,
+                                **self.local_cfg)
+        return self.run
+
+    def log(self, data, step=None, commit=True):
+        if(self.use_wandb):
+            import wandb
+            wandb.log({k: v.to_wandb() if isinstance(v, Histogram) else v
+                       for k, v in data.items()},
+                      step=step, commit=commit)
+        if(self.run is not None):
+            self.run.log(data, step=step, commit=commit)
+
+    def finish(self):
+        if(self.run is not None):
+            self.run.finish()
+            self.run = None
+        if(self.use_wandb):
+            import sys
+            wandb = sys.modules.get("wandb")
+            if(wandb is not None and wandb.run is not None):
+                wandb.finish()
+
+
+# Shared by the agents and the tools
+run_logger = RunLogger()
@@ -1,14 +1,11 @@
 import os
-import gym
 import numpy as np
-from scipy.spatial.transform.rotation import Rotation as R
-import hydra
-
-from omegaconf import OmegaConf
 from vapo.agent.core.utils import set_init_pos
-from affordance.affordance_model import AffordanceModel
 import glob
 
+# hydra, omegaconf, scipy, gym and the affordance model are imported
+# in the functions that use them, see vapo/startup_profile.py
+
 
 def get_files_regex(path, search_str, recursive):
     files = glob.glob(os.path.join(path, search_str), recursive=recursive)
@@ -29,6 +26,7 @@ def get_files(path, extension, recursive=False):
 
 def get_abs_path(path_str):
     if not os.path.isabs(path_str):
+        import hydra
         path_str = os.path.join(hydra.utils.get_original_cwd(), path_str)
         path_str = os.path.abspath(path_str)
     return path_str
@@ -52,12 +50,12 @@ def init_aff_net(affordance_cfg, cam_str=None, in_channels=1):
             hp = {"cfg": aff_cfg.hyperparameters.cfg,
                   "n_classes": aff_cfg.hyperparameters.n_classes,
                   "input_channels": in_channels}
+            from omegaconf import OmegaConf
+            from vapo.utils.model_registry import aff_model_registry
             hp = OmegaConf.create(hp)
-            # Create model
+            # Shared with other users of the same checkpoint
             if(os.path.exists(path)):
-                aff_net = AffordanceModel.load_from_checkpoint(path, **hp)
-                aff_net.cuda()
-                aff_net.eval()
+                aff_net = aff_model_registry.get(path, hp, "cuda")
                 print("obs_wrapper: %s cam affordance model loaded" % cam_str)
             else:
                 affordance_cfg = None
@@ -98,6 +96,7 @@ def change_project_path(cfg, run_cfg):
 
 def load_cfg(cfg_path, cfg, optim_res):
     if(os.path.exists(cfg_path) and not optim_res):
+        from omegaconf import OmegaConf
         run_cfg = OmegaConf.load(cfg_path)
         net_cfg = run_cfg.agent.net_cfg
         env_wrapper = run_cfg.env_wrapper
@@ -131,6 +130,7 @@ def get_3D_end_points(x, y, z, w, h, d):
 
 
 def register_env():
+    import gym
     gym.envs.register(
         id='VREnv-v0',
         entry_point='VREnv.vr_env.envs.play_table_env:PlayTableSimEnv',
@@ -151,6 +151,7 @@ def pos_orn_to_matrix(pos, orn):
                 np.array of shape (3,) -> euler angles xyz
     :return: 4x4 homogeneous transformation
     """
+    from scipy.spatial.transform import Rotation as R
     mat = np.eye(4)
     if isinstance(orn, np.quaternion):
         orn = np_quat_to_scipy_quat(orn)
@@ -163,14 +164,125 @@ def pos_orn_to_matrix(pos, orn):
     return mat
 
 
-def get_depth_around_point(point, depth):
-    for width in range(5):
-        area = depth[point[1] - width: point[1] + width + 1, point[0] - width: point[0] + width + 1]
-        area[np.where(area == 0)] = np.inf
-        if np.all(np.isinf(area)):
-            continue
-        new_point = np.array([point[1], point[0]]) + np.array(np.unravel_index(area.argmin(), area.shape)) - width
+def _get_windows(depth, pixels, low, high, pad_value):
+    '''
+        Depth windows depth[v + low: v + high, u + low: u + high]
+        for all pixels (u, v) at once. Outside of the image is pad_value.
+        returns: np.array (N, high - low, high - low)
+    '''
+    pad = max(-low, high)
+    padded = np.pad(depth, pad, mode="constant",
+                    constant_values=pad_value)
+    offsets = np.arange(low, high)
+    rows = pixels[:, 1, None] + offsets + pad
+    cols = pixels[:, 0, None] + offsets + pad
+    return padded[rows[:, :, None], cols[:, None, :]]
+
+
+def _clip_pixels(pixels, shape):
+    pixels = np.array(pixels, dtype="int64").reshape(-1, 2)
+    pixels[:, 0] = np.clip(pixels[:, 0], 0, shape[1] - 1)
+    pixels[:, 1] = np.clip(pixels[:, 1], 0, shape[0] - 1)
+    return pixels
+
+
+def get_min_depth_around_pixels(pixels, depth, n=10):
+    '''
+        As a center might not be exactly on the handle, look for the
+        closest point (min. depth) in a (2n x 2n) neighborhood.
+        pixels: (N, 2) pixel coordinates (u, v)
+        returns: np.array (N, 2) pixel coordinates (u, v)
+    '''
+    pixels = _clip_pixels(pixels, depth.shape)
+    windows = _get_windows(depth, pixels, -n, n, np.inf)
+    idx = np.argmin(windows.reshape(len(pixels), -1), axis=-1)
+    dv, du = np.unravel_index(idx, windows.shape[1:])
+    return np.stack([pixels[:, 0] - n + du, pixels[:, 1] - n + dv], -1)
+
 
-        assert depth[new_point[0], new_point[1]] != 0
-        return (new_point[1], new_point[0]), True
-    return None, False
+def get_nonzero_depth_around_pixels(pixels, depth, max_width=4):
+    '''
+        Look for the closest point with valid (non zero) depth in the
+        smallest square of width 0 to max_width around each pixel.
+        pixels: (N, 2) pixel coordinates (u, v)
+        returns:
+            np.array (N, 2) pixel coordinates (u, v)
+            np.array (N,) bool, True if a valid depth was found
+    '''
+    pixels = _clip_pixels(pixels, depth.shape)
+    windows = _get_windows(depth.astype(np.float64), pixels,
+                           -max_width, max_width + 1, 0)
+    windows = windows.reshape(len(pixels), -1)
+    windows[windows == 0] = np.inf
+
+    # Square "ring" each window element belongs to
+    offsets = np.abs(np.arange(-max_width, max_width + 1))
+    ring = np.maximum(offsets[:, None], offsets[None, :]).reshape(-1)
+    min_ring = np.where(np.isfinite(windows), ring, np.inf).min(axis=-1)
+    candidates = np.where(ring <= min_ring[:, None], windows, np.inf)
+    idx = np.argmin(candidates, axis=-1)
+    dv, du = np.unravel_index(idx, (len(offsets), len(offsets)))
+    new_pixels = np.stack([pixels[:, 0] - max_width + du,
+                           pixels[:, 1] - max_width + dv], -1)
+    return new_pixels, np.isfinite(min_ring)
+
+
+def check_deproject_pixels(cam):
+    '''
+        Real camera: raises ValueError if deproject_pixels does not
+        match cam.deproject, call once when the camera is set up
+    '''
+    intr = cam.get_intrinsics()
+    h, w = int(intr["cy"]) * 2 + 2, int(intr["cx"]) * 2 + 2
+    depth = np.linspace(0.5, 1.5, h * w).reshape((h, w))
+    pixels = np.array([[0, 0], [w - 1, 0], [0, h - 1], [w - 1, h - 1]])
+    cam_pts, _ = deproject_pixels(cam, pixels, depth, np.eye(4))
+    for (u, v), pt in zip(pixels, cam_pts):
+        ref = np.array(cam.deproject([u, v], depth), dtype=np.float64)
+        if(not np.allclose(pt, ref[:3], rtol=1e-4, atol=1e-6)):
+            raise ValueError("deproject_pixels: %s differs from "
+                             "cam.deproject %s at pixel %s"
+                             % (pt, ref[:3], (int(u), int(v))))
+
+
+def deproject_pixels(cam, pixels, depth, T_world_cam=None):
+    '''
+        Deprojects all pixels with a single matrix multiplication
+        cam: simulation camera (viewMatrix, fov) or real camera (intrinsics)
+        pixels: (N, 2) pixel coordinates (u, v)
+        depth: depth image
+        T_world_cam: (4, 4) camera to world transform. Simulation
+                     cameras use their view matrix when not given.
+        returns:
+            np.array (N, 3) world coordinates, nan if depth is invalid
+            np.array (N,) bool, True if depth is valid
+    '''
+    pixels = _clip_pixels(pixels, depth.shape)
+    u, v = pixels[:, 0], pixels[:, 1]
+    z = depth[v, u].astype(np.float64)
+    sim_cam = hasattr(cam, "viewMatrix")
+    if sim_cam:
+        # Simulation camera, opengl convention
+        foc = cam.height / (2 * np.tan(np.deg2rad(cam.fov) / 2))
+        K_inv = np.array([[1 / foc, 0, -(cam.width // 2) / foc],
+                          [0, -1 / foc, (cam.height // 2) / foc],
+                          [0, 0, -1]])
+        if(T_world_cam is None):
+            T_world_cam = np.linalg.inv(
+                np.array(cam.viewMatrix).reshape((4, 4)).T)
+        valid = np.isfinite(z)
+    else:
+        # Pinhole model of cam.deproject([u, v], depth)
+        intr = cam.get_intrinsics()
+        fx, fy, cx, cy = intr["fx"], intr["fy"], intr["cx"], intr["cy"]
+        K_inv = np.array([[1 / fx, 0, -cx / fx],
+                          [0, 1 / fy, -cy / fy],
+                          [0, 0, 1]])
+        if(T_world_cam is None):
+            T_world_cam = np.eye(4)
+        valid = np.isfinite(z) & (z != 0)
+    uv_z = np.stack([u * z, v * z, z], -1)  # N, 3
+    cam_pts = uv_z @ K_inv.T
+    world_pts = cam_pts @ T_world_cam[:3, :3].T + T_world_cam[:3, 3]
+    world_pts[~valid] = np.nan
+    return world_pts, valid
@@ -0,0 +1,229 @@
+import atexit
+import collections
+import logging
+import os
+import queue
+import threading
+import zlib
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+MODES = ["stream", "failures"]
+
+
+def to_uint8(img):
+    ''' Contiguous uint8 image as expected by cv2 '''
+    img = np.asarray(img)
+    if(img.dtype != np.uint8):
+        img = np.clip(img, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(img)
+
+
+class _Stream():
+    ''' Video file of one stream, opened with the size of the first frame '''
+    def __init__(self, path, fps, codec, png):
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.png = png
+        self.writer = None
+        self.size = None
+        self.n_frames = 0
+
+    def write(self, img, frame_path):
+        img = to_uint8(img)
+        if(self.png):
+            cv2.imwrite(frame_path, img)
+        if(self.codec is None):
+            return
+        h, w = img.shape[:2]
+        if(self.writer is None):
+            self.size = (w, h)
+            fourcc = cv2.VideoWriter_fourcc(*self.codec)
+            self.writer = cv2.VideoWriter(self.path, fourcc, self.fps,
+                                          self.size, img.ndim == 3)
+        elif((w, h) != self.size):
+            img = cv2.resize(img, self.size)
+        self.writer.write(img)
+        self.n_frames += 1
+
+    def close(self):
+        if(self.writer is not None):
+            self.writer.release()
+            self.writer = None
+
+
+class RolloutRecorder():
+    '''
+        Rollout images (save_images) encoded on background threads
+        instead of written as individual files on the step loop.
+            rollout_recorder.add("./images/ep_0003/gripper_depth/img_0012.png", img)
+        Frames are grouped in streams by folder, every stream is
+        encoded to <folder>.mp4 (same layout as vapo/utils/make_video.py).
+        Streams are assigned to a fixed worker, so frames keep their order.
+        add() never blocks: each worker has a bounded queue and frames
+        that do not fit are dropped (and counted).
+        Frames must not be modified by the caller after add().
+        video: encode the streams, png: also write the individual frames
+        max_open: streams open at the same time, the least recently used
+        one is closed when exceeded (i.e. when end_episode is not called)
+        mode:
+            stream: every frame is written
+            failures: the last ring_size frames of every stream are kept
+            in memory (compressed with ring_format) and only written when
+            the episode ends with an outcome in capture_on
+    '''
+    def __init__(self):
+        self._workers = []
+        self.configure()
+        atexit.register(self.close)
+
+    def configure(self, video=True, png=False, fps=15, codec="mp4v",
+                  queue_size=256, n_workers=2, max_open=32, mode="stream",
+                  ring_size=90, ring_format=".jpg", ring_quality=90,
+                  capture_on=("failed_grasp", "outside_radius", "failure",
+                              "timeout")):
+        if(mode not in MODES):
+            raise ValueError("Unknown recorder mode %s, options: %s"
+                             % (mode, MODES))
+        self.close()
+        self.video = video
+        self.png = png
+        self.fps = fps
+        self.codec = codec if video else None
+        self.queue_size = queue_size
+        self.n_workers = max(n_workers, 1)
+        self.max_open = max_open
+        self.ring_size = ring_size if mode == "failures" else 0
+        self.ring_format = ring_format
+        self._ring_params = []
+        if(ring_format == ".jpg"):
+            self._ring_params = [cv2.IMWRITE_JPEG_QUALITY, ring_quality]
+        self.capture_on = set(capture_on)
+        self.dropped = 0
+        self.written = 0
+        self._done = set()  # video files finished by this process
+
+    def _start(self):
+        for i in range(self.n_workers):
+            q = queue.Queue(maxsize=self.queue_size)
+            t = threading.Thread(target=self._run, args=(q,), daemon=True,
+                                 name="RolloutRecorder-%d" % i)
+            t.start()
+            self._workers.append((q, t))
+
+    def _queue(self, stream):
+        if(len(self._workers) == 0):
+            self._start()
+        idx = zlib.crc32(stream.encode()) % self.n_workers
+        return self._workers[idx][0]
+
+    def add(self, frame_path, img):
+        '''
+            frame_path: file of the frame if it was saved as image,
+            its folder is the stream
+            returns: False if the frame was dropped
+        '''
+        stream = os.path.dirname(frame_path)
+        try:
+            self._queue(stream).put_nowait(("frame", stream, frame_path, img))
+        except queue.Full:
+            if(self.dropped == 0):
+                logger.warning("RolloutRecorder: queue full, dropping frames")
+            self.dropped += 1
+            return False
+        return True
+
+    def end_episode(self, prefix, outcome=None):
+        '''
+            Closes the streams in folder prefix, i.e. ./images/ep_0003
+            outcome: how the episode ended, in failures mode the
+            kept frames are written if it is in capture_on
+        '''
+        prefix = os.path.join(prefix, "")
+        for q, _ in self._workers:
+            # Block: control messages must not be dropped
+            q.put(("end", prefix, outcome))
+
+    def _video_path(self, stream):
+        path = stream + ".mp4"
+        part = 1
+        while(path in self._done):
+            # Stream written again after it was closed
+            path = "%s_%d.mp4" % (stream, part)
+            part += 1
+        self._done.add(path)
+        return path
+
+    def _write(self, streams, stream, frame_path, img):
+        if(stream not in streams):
+            os.makedirs(stream, exist_ok=True)
+            streams[stream] = _Stream(self._video_path(stream),
+                                      self.fps, self.codec, self.png)
+            if(len(streams) > self.max_open):
+                streams.popitem(last=False)[1].close()
+        streams.move_to_end(stream)
+        streams[stream].write(img, frame_path)
+        self.written += 1
+
+    def _keep(self, rings, stream, frame_path, img):
+        if(stream not in rings):
+            rings[stream] = collections.deque(maxlen=self.ring_size)
+            if(len(rings) > self.max_open):
+                rings.popitem(last=False)
+        rings.move_to_end(stream)
+        _, buf = cv2.imencode(self.ring_format, to_uint8(img),
+                              self._ring_params)
+        rings[stream].append((frame_path, buf))
+
+    def _end(self, streams, rings, prefix, outcome):
+        ended = [s for s in rings if os.path.join(s, "").startswith(prefix)]
+        capture = outcome in self.capture_on
+        for stream in ended:
+            frames = rings.pop(stream)
+            if(capture):
+                for frame_path, buf in frames:
+                    img = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+                    self._write(streams, stream, frame_path, img)
+        if(capture and len(ended) > 0):
+            logger.info("RolloutRecorder: %s ended with %s, %d streams saved"
+                        % (prefix, outcome, len(ended)))
+        for stream in [s for s in streams
+                       if os.path.join(s, "").startswith(prefix)]:
+            streams.pop(stream).close()
+
+    def _run(self, q):
+        streams = collections.OrderedDict()
+        rings = collections.OrderedDict()
+        while(True):
+            msg = q.get()
+            if(msg is None):
+                break
+            try:
+                if(msg[0] == "end"):
+                    self._end(streams, rings, *msg[1:])
+                elif(self.ring_size > 0):
+                    self._keep(rings, *msg[1:])
+                else:
+                    self._write(streams, *msg[1:])
+            except Exception as e:
+                # Recording must never take down a rollout
+                logger.error("RolloutRecorder: %s" % e)
+        for s in streams.values():
+            s.close()
+
+    def close(self):
+        ''' Waits for the queued frames and closes all the streams '''
+        for q, _ in self._workers:
+            q.put(None)
+        for _, t in self._workers:
+            t.join()
+        if(len(self._workers) > 0 and self.dropped > 0):
+            logger.warning("RolloutRecorder: %d of %d frames dropped"
+                           % (self.dropped, self.dropped + self.written))
+        self._workers = []
+
+
+# Shared by the envs, the wrappers and the target search
+rollout_recorder = RolloutRecorder()
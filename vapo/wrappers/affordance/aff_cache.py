@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+import cv2
+
+
+class AffordanceCache():
+    '''
+        Reuses the affordance predictions of the previous frame
+        when the camera view did not change meaningfully.
+        A view is considered unchanged when the mean absolute difference
+        of the downsampled grayscale frames is below img_diff_thresh
+        (0-255 range) and the tcp moved less than pos_thresh (meters).
+        Predictions are reused at most max_reuse consecutive times.
+        Thread safe, used from the delayed inference worker.
+    '''
+    def __init__(self, img_diff_thresh=2.0, pos_thresh=0.002,
+                 max_reuse=5, downsample_size=32, **kwargs):
+        self.img_diff_thresh = img_diff_thresh
+        self.pos_thresh = pos_thresh
+        self.max_reuse = max_reuse
+        self.downsample_size = downsample_size
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def _downsample(self, rgb_img):
+        img = cv2.resize(rgb_img,
+                         (self.downsample_size, self.downsample_size),
+                         interpolation=cv2.INTER_AREA)
+        img = img.astype(np.float32)
+        if(len(img.shape) == 3):
+            img = img.mean(axis=-1)
+        return img
+
+    def get(self, cam_type, rgb_img, tcp_pos, valid=None):
+        '''
+            Returns the cached predictions for cam_type if the
+            view did not change, otherwise None.
+            valid: optional check of the cached predictions,
+            i.e. computed for the same inputs
+        '''
+        small_img = self._downsample(rgb_img)
+        with self._lock:
+            entry = self._entries.get(cam_type)
+            if(entry is not None
+               and entry["n_reused"] < self.max_reuse
+               and np.linalg.norm(tcp_pos - entry["tcp_pos"]) < self.pos_thresh
+               and np.mean(np.abs(small_img - entry["img"])) < self.img_diff_thresh
+               and (valid is None or valid(entry["preds"]))):
+                entry["n_reused"] += 1
+                self.hits += 1
+                return entry["preds"]
+            self.misses += 1
+        return None
+
+    def update(self, cam_type, rgb_img, tcp_pos, preds):
+        entry = {"img": self._downsample(rgb_img),
+                 "tcp_pos": np.array(tcp_pos),
+                 "preds": preds,
+                 "n_reused": 0}
+        with self._lock:
+            self._entries[cam_type] = entry
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def metrics(self, reset=True):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            if(reset):
+                self.hits, self.misses = 0, 0
+        total = hits + misses
+        hit_rate = hits / total if total > 0 else 0
+        return {"aff_cache/hits": hits,
+                "aff_cache/misses": misses,
+                "aff_cache/hit_rate": hit_rate}
@@ -1,18 +1,28 @@
-import os
 import logging
 import torch
 import numpy as np
 import cv2
 import gym
+from concurrent.futures import ThreadPoolExecutor
 from affordance.utils.img_utils import torch_to_numpy, viz_aff_centers_preds, overlay_mask
 from vapo.wrappers.utils import get_obs_space, get_transforms_and_shape, \
                                     depth_preprocessing
 from vapo.utils.utils import init_aff_net
-from vapo.agent.core.utils import tt
+from vapo.wrappers.affordance.aff_cache import AffordanceCache
+from vapo.wrappers.augmentation import BatchAugmentation
+from vapo.agent.core.utils import tt, cluster_stats
+from vapo.utils.profiling import phase_timers
+from vapo.utils.video_recorder import rollout_recorder
 
 logger = logging.getLogger(__name__)
 
 
+def _same_target(a, b):
+    if(a is None or b is None):
+        return a is None and b is None
+    return np.allclose(a, b)
+
+
 class AffordanceWrapperBase(gym.Wrapper):
     def __init__(self, env, max_ts, img_size,
                  gripper_cam, static_cam, transforms=None,
@@ -20,6 +30,9 @@ class AffordanceWrapperBase(gym.Wrapper):
                  affordance_cfg=None,
                  use_env_state=False,
                  real_world=False,
+                 aff_inference="exact",
+                 aff_cache=None,
+                 recorder=None,
                  **args):
         super(AffordanceWrapperBase, self).__init__(env)
         self.env = env
@@ -57,6 +70,9 @@ class AffordanceWrapperBase(gym.Wrapper):
             "train": _train_transforms,
             "validation": _val_transforms
         }
+        # Per sample train augmentation of replay buffer batches
+        self.batch_augmentation = BatchAugmentation.from_cfg(
+            transforms["train"], self.img_size)
         self.channels = shape[0]
 
         # Cameras defaults
@@ -64,6 +80,10 @@ class AffordanceWrapperBase(gym.Wrapper):
         self.episode = 0
         self.save_images = env.save_images
         self.viz = env.viz
+        if(self.save_images and recorder is not None):
+            rollout_recorder.configure(**recorder)
+        self._outcome = "timeout"
+        self._episode_ended = False
 
         # Parameters to define observation
         self.gripper_cam_cfg = gripper_cam
@@ -88,6 +108,27 @@ class AffordanceWrapperBase(gym.Wrapper):
         self._curr_detected_obj = None
         self._target = None
 
+        # Gripper affordance inference
+        # "exact": prediction of the current frame (blocking)
+        # "delayed": prediction of frame t runs on a worker thread while
+        # the next physics step executes, observation gets frame t-1 preds
+        if(aff_inference == "delayed" and self.viz):
+            logger.warning("Delayed affordance inference does not support "
+                           "visualization, using exact inference")
+            aff_inference = "exact"
+        self.aff_inference = aff_inference
+        self._in_step = False
+        self._aff_future = None
+        self._last_aff_preds = None
+        self._aff_executor = None
+        if(self.aff_inference == "delayed"):
+            self._aff_executor = ThreadPoolExecutor(max_workers=1)
+
+        # Reuse affordance preds between similar frames
+        self.aff_cache = None
+        if(aff_cache is not None and aff_cache.use):
+            self.aff_cache = AffordanceCache(**aff_cache)
+
     @property
     def target(self):
         return self.env.target
@@ -96,27 +137,128 @@ class AffordanceWrapperBase(gym.Wrapper):
     def target(self, value):
         self.env.target = value
 
+    @property
+    def episode(self):
+        '''
+            Episode of the image folders, stored in the unwrapped env
+            so env and wrapper streams (ep_%04d/...) always match
+        '''
+        return self.unwrapped.episode
+
+    @episode.setter
+    def episode(self, value):
+        self.unwrapped.episode = value
+
     @property
     def curr_detected_obj(self):
         return self._curr_detected_obj
 
     @curr_detected_obj.setter
     def curr_detected_obj(self, world_pos):
+        # Pending inference must not overwrite the new target
+        self.collect_aff_preds()
         self._curr_detected_obj = world_pos
 
     def reset(self, *args, **kwargs):
+        self.end_episode()
         observation = self.env.reset(*args, **kwargs)
+        self.start_episode()
+        if(self.aff_cache is not None):
+            self.aff_cache.clear()
+        return self.observation(observation)
+
+    def end_episode(self):
+        '''
+            Finishes the videos of the current episode with its outcome.
+            Called by reset, or by the agent when episodes follow each
+            other without reset (tidy_up). Only the first call counts.
+        '''
+        # Pending prediction belongs to this episode
+        self.collect_aff_preds()
+        if(self.save_images and not self._episode_ended):
+            rollout_recorder.end_episode("./images/ep_%04d" % self.episode,
+                                         self._outcome)
+        self._episode_ended = True
+
+    def start_episode(self):
+        ''' Next episode, without moving the robot or the scene '''
         self.episode += 1
+        self._outcome = "timeout"
+        self._episode_ended = False
         self.obs_it = 0
-        return self.observation(observation)
 
     def step(self, action, move_to_box=False):
         obs, reward, done, info = self.env.step(action, move_to_box)
+        # Delayed inference: collect preds of previous frame before
+        # computing the reward with the detected target
+        self.collect_aff_preds()
         reward = self.reward(reward, obs, done, info["success"])
         done = self.termination(done, obs)
+        self.track_outcome(done, info)
         # if self.curr_detected_obj is not None:
         #     self.p.addUserDebugText("ct", textPosition=self.curr_detected_obj, textColorRGB=[0, 1, 0])
-        return self.observation(obs), reward, done, info
+        return self.step_observation(obs), reward, done, info
+
+    def step_observation(self, obs):
+        '''
+            Observation after an env step. Only here the gripper
+            affordance inference is allowed to be one frame delayed.
+        '''
+        self._in_step = True
+        try:
+            with phase_timers.span("env/observation"):
+                new_obs = self.observation(obs)
+        finally:
+            self._in_step = False
+        return new_obs
+
+    def track_outcome(self, done, info):
+        '''
+            How the episode ends, selects the episodes recorded in
+            failures mode: failure_case of the env (real world),
+            success, failure or timeout (not done at reset)
+        '''
+        if("failure_case" in info):
+            self._outcome = info["failure_case"]
+        elif(info["success"]):
+            self._outcome = "success"
+        elif(done):
+            self._outcome = "failure"
+
+    def collect_aff_preds(self):
+        '''
+            Wait for the pending affordance inference (if any)
+            and apply its result
+        '''
+        if(self._aff_future is not None):
+            future, self._aff_future = self._aff_future, None
+            self._last_aff_preds = self.apply_aff_preds(future.result())
+        return self._last_aff_preds
+
+    def apply_aff_preds(self, preds):
+        '''
+            Wrapper state updated by a prediction of predict_aff,
+            always on the main thread. Its images are saved here, once.
+        '''
+        if(self.save_images):
+            for filename, img in preds["viz_dict"].items():
+                rollout_recorder.add(filename, img)
+        if(preds["target"] is not None):
+            self.curr_detected_obj = preds["target"]
+            self.env.target_pos = preds["target"]
+        if(self.viz and preds["detected"]
+           and self.curr_detected_obj is not None):
+            self.viz_curr_target()
+        return preds
+
+    def close(self):
+        self.collect_aff_preds()
+        if(self._aff_executor is not None):
+            self._aff_executor.shutdown(wait=True)
+        self.end_episode()
+        if(self.save_images):
+            rollout_recorder.close()
+        return super(AffordanceWrapperBase, self).close()
 
     def reward(self, rew, obs, done, success):
         if self.affordance_cfg.gripper_cam.densify_reward:
@@ -157,9 +299,7 @@ class AffordanceWrapperBase(gym.Wrapper):
         # Rollout images stored by episodes(each folder is an episode)
         if(self.save_images):
             for filename, img in viz_dict.items():
-                folder_name = os.path.dirname(filename)
-                os.makedirs(folder_name, exist_ok=True)
-                cv2.imwrite(filename, img)
+                rollout_recorder.add(filename, img)
         return new_obs
 
     def termination(self, done, obs):
@@ -171,7 +311,19 @@ class AffordanceWrapperBase(gym.Wrapper):
     def get_images(self, obs_cfg, obs_dict, cam_type):
         raise NotImplementedError
 
-    def get_world_pt(self, cam, pixel, depth, orig_shape):
+    def get_cam_pose(self, cam):
+        '''
+            Camera to world transform when the observation is taken
+            returns: np.array (4, 4)
+        '''
+        raise NotImplementedError
+
+    def get_world_pts(self, cam, pixels, depth, orig_shape, T_world_cam):
+        '''
+            pixels: np.array (N, 2)
+            T_world_cam: camera pose of the frame of depth
+            returns: world points (N, 3), valid points (N,)
+        '''
         raise NotImplementedError
 
     def get_cam_obs(self, obs_dict, cam_type, aff_net,
@@ -194,27 +346,29 @@ class AffordanceWrapperBase(gym.Wrapper):
                     or self.affordance_cfg.gripper_cam.use_distance)
 
         if(aff_net is not None and (aff_cfg.use or get_gripper_target)):
-            with torch.no_grad():
-                # Np array 1, H, W
-                processed_obs = self.aff_transforms[cam_type](tt(img_obs))
-                # 1, 1, H, W in range [-1, 1]
-                obs_t = processed_obs.unsqueeze(0)
-                obs_t = obs_t.float().cuda()
-
-                # 1, H, W
-                _, aff_probs, aff_mask, directions = aff_net(obs_t)
-                # foreground/affordance Mask
-                mask = torch_to_numpy(aff_mask)
-                if(get_gripper_target):
-                    preds = {"%s_aff" % cam_type: aff_mask,
-                             "%s_center_dir" % cam_type: directions,
-                             "%s_aff_probs" % cam_type: aff_probs}
-
-                    # Computes newest target
-                    viz_dict = self.find_target_center(self.gripper_cam,
-                                                       rgb_img,
-                                                       depth_img,
-                                                       preds)
+            delayed = cam_type == "gripper" and self.aff_inference == "delayed"
+            if(delayed):
+                # Target of the previous frame is the one searched around
+                self.collect_aff_preds()
+            # Saved images of this observation
+            frame = self.obs_it
+            if(get_gripper_target and self.save_images):
+                self.obs_it += 1
+            # Pose of this frame, the camera moves before a delayed
+            # prediction is computed
+            T_world_cam = None
+            if(get_gripper_target):
+                T_world_cam = self.get_cam_pose(self.gripper_cam)
+            _args = (cam_type, aff_net, img_obs,
+                     rgb_img, depth_img, get_gripper_target,
+                     obs_dict["robot_obs"][:3],
+                     frame, self.episode, self.curr_detected_obj,
+                     T_world_cam)
+            if(delayed):
+                preds = self.delayed_aff_preds(*_args)
+            else:
+                preds = self.apply_aff_preds(self.predict_aff(*_args))
+            mask = preds["mask"]
             if(self.affordance_cfg.gripper_cam.target_in_obs):
                 obs["detected_target_pos"] = self.curr_detected_obj
             if(self.affordance_cfg.gripper_cam.use_distance):
@@ -225,6 +379,89 @@ class AffordanceWrapperBase(gym.Wrapper):
                 obs["%s_aff" % cam_type] = mask
         return obs, viz_dict
 
+    def predict_aff(self, cam_type, aff_net, img_obs,
+                    rgb_img, depth_img, get_gripper_target, tcp_pos=None,
+                    frame=0, episode=0, curr_target=None, T_world_cam=None):
+        '''
+            Runs on the inference thread with delayed inference, so the
+            wrapper state is only read through the arguments and the
+            result is applied by apply_aff_preds.
+            frame, episode: obs_it and episode of the observation
+            curr_target: detected target to search around
+            T_world_cam: gripper camera pose of the observation
+            returns: dict
+                mask: affordance mask
+                viz_dict: {image path: image} to save
+                target: new detected target, None if unchanged
+                detected: True if the gripper target was searched
+                frame: obs_it of the observation
+                searched: curr_target
+        '''
+        if(self.aff_cache is not None):
+            # Mask and detected target of previous frame still valid
+            # if searched around the same target
+            cached = self.aff_cache.get(
+                cam_type, rgb_img, tcp_pos,
+                valid=lambda p: not p["detected"]
+                or _same_target(curr_target, p["searched"])
+                or _same_target(curr_target, p["target"]))
+            if(cached is not None):
+                viz_dict = {}
+                if(cached["detected"] and self.save_images):
+                    # Frame is still saved, with the current depth
+                    viz_dict = self.depth_image(depth_img, rgb_img,
+                                                frame, episode)
+                return dict(cached, viz_dict=viz_dict, frame=frame)
+
+        viz_dict, target = {}, None
+        with torch.no_grad(), phase_timers.span("aff/inference_%s" % cam_type):
+            # Np array 1, H, W
+            processed_obs = self.aff_transforms[cam_type](tt(img_obs))
+            # 1, 1, H, W in range [-1, 1]
+            obs_t = processed_obs.unsqueeze(0)
+            obs_t = obs_t.float().cuda()
+
+            # 1, H, W
+            _, aff_probs, aff_mask, directions = aff_net(obs_t)
+            # foreground/affordance Mask
+            mask = torch_to_numpy(aff_mask)
+            if(get_gripper_target):
+                preds = {"%s_aff" % cam_type: aff_mask,
+                         "%s_center_dir" % cam_type: directions,
+                         "%s_aff_probs" % cam_type: aff_probs}
+
+                # Computes newest target
+                viz_dict, target = self.find_target_center(self.gripper_cam,
+                                                           rgb_img,
+                                                           depth_img,
+                                                           preds,
+                                                           frame,
+                                                           episode,
+                                                           curr_target,
+                                                           T_world_cam)
+        preds = {"mask": mask, "viz_dict": viz_dict, "target": target,
+                 "detected": get_gripper_target, "frame": frame,
+                 "searched": curr_target}
+        if(self.aff_cache is not None):
+            self.aff_cache.update(cam_type, rgb_img, tcp_pos, preds)
+        return preds
+
+    def delayed_aff_preds(self, *args):
+        '''
+            Outside of env.step (reset, correcting position...) the
+            prediction is computed for the current frame. Inside env.step
+            the prediction of the previous frame is returned and the
+            current frame is sent to the worker thread.
+        '''
+        preds = self.collect_aff_preds()
+        if(not self._in_step or preds is None):
+            preds = self.apply_aff_preds(self.predict_aff(*args))
+        else:
+            self._aff_future = self._aff_executor.submit(self.predict_aff,
+                                                         *args)
+        self._last_aff_preds = preds
+        return preds
+
     def transform_obs(self, obs_dct, split="validation"):
         '''
             inputs:
@@ -238,6 +475,27 @@ class AffordanceWrapperBase(gym.Wrapper):
                 new_dct[k] = v
         return new_dct
 
+    def augment_batch(self, *obs_dcts):
+        '''
+            Train transforms for several batches of observations
+            (i.e. states and next states) in a single call per image key.
+            inputs:
+                obs_dcts (dict): {key: torch.tensor(B, ...)}
+            returns:
+                list of transformed dicts, same order as the inputs
+        '''
+        if(self.batch_augmentation is None):
+            return [self.transform_obs(o, "train") for o in obs_dcts]
+        new_dcts = [dict(o) for o in obs_dcts]
+        for k in obs_dcts[0].keys():
+            if("img_obs" in k):
+                imgs = [o[k] for o in obs_dcts]
+                batch = self.batch_augmentation(torch.cat(imgs, 0))
+                split = torch.split(batch, [len(img) for img in imgs])
+                for new_dct, img in zip(new_dcts, split):
+                    new_dct[k] = img
+        return new_dcts
+
     def viz_transformed(self, obs_dct):
         ''' input:
                 img: torch.tensor(shape=(C, H, W)) -1 to 1
@@ -257,8 +515,20 @@ class AffordanceWrapperBase(gym.Wrapper):
         img = cv2.resize(img, (200, 200))
         cv2.imshow("transformed img", img)
 
+    def depth_image(self, depth, orig_img, frame, episode):
+        ''' Gripper depth to save, {image path: uint8 image} '''
+        depth_img = cv2.resize(depth, orig_img.shape[:2])
+        # Now between 0 and 8674
+        write_depth = depth_img - depth_img.min()
+        write_depth = write_depth / write_depth.max() * 255
+        write_depth = np.uint8(write_depth)
+        return {"./images/ep_%04d/gripper_depth/img_%04d.png"
+                % (episode, frame): write_depth}
+
     # Aff-center
-    def find_target_center(self, cam, orig_img, depth, obs):
+    def find_target_center(self, cam, orig_img, depth, obs,
+                           frame=0, episode=0, curr_target=None,
+                           T_world_cam=None):
         """
         Args:
             orig_img: np array, RGB original resolution from camera
@@ -279,8 +549,13 @@ class AffordanceWrapperBase(gym.Wrapper):
                 np array, int64
                     shape = (1, img_size, img_size)
                     range = 0 to 1
+            frame, episode: labels of the saved images
+            curr_target: detected target, replaced by a close center
+            T_world_cam: camera pose of the frame, current pose if None
         return:
-            centers: list of 3d points (x, y, z)
+            im_dict: {image path: image}
+            target: most robust center close to curr_target,
+                    None if there is none
         """
         aff_mask = obs["gripper_aff"]
         aff_probs = obs["gripper_aff_probs"]
@@ -294,68 +569,56 @@ class AffordanceWrapperBase(gym.Wrapper):
         im_dict = viz_aff_centers_preds(orig_img, aff_mask,
                                         center_dir, object_centers,
                                         "gripper",
-                                        self.obs_it,
-                                        self.episode,
+                                        frame,
+                                        episode,
                                         viz=self.viz)
         if self.viz:
             depth_img = cv2.resize(depth, orig_img.shape[:2])
             cv2.imshow("gripper-depth", depth_img)
 
         if self.save_images:
-            # Now between 0 and 8674
-            write_depth = depth_img - depth_img.min()
-            write_depth = write_depth / write_depth.max() * 255
-            write_depth = np.uint8(write_depth)
-            im_dict.update(
-                {"./images/ep_%04d/gripper_depth/img_%04d.png"
-                    % (self.episode, self.obs_it): write_depth})
-            self.obs_it += 1
+            im_dict.update(self.depth_image(depth, orig_img,
+                                            frame, episode))
 
         # Plot different objects
         cluster_outputs = []
         object_centers = [torch_to_numpy(o) for o in object_centers]
         if(len(object_centers) <= 0):
-            return im_dict
-
-        # To numpy
-        aff_probs = torch_to_numpy(aff_probs)
-        aff_probs = np.transpose(aff_probs[0], (1, 2, 0))  # H, W, 2
-        object_masks = torch_to_numpy(object_masks[0])  # H, W
+            return im_dict, None
 
-        obj_class = np.unique(object_masks)[1:]
-        obj_class = obj_class[obj_class != 0]  # remove background class
+        # Statistics of all clusters in one pass, on device
+        # Mean prob of being class 1 (foreground)
+        _, cluster_robustness, cluster_pixels, _ = \
+            cluster_stats(object_masks[0], aff_probs[0, 1])
 
         # Look for most likely center
         n_pixels = aff_mask.shape[1] * aff_mask.shape[2]
-        pred_shape = aff_probs.shape[:2]
+        pred_shape = tuple(aff_probs.shape[-2:])
         orig_shape = depth.shape[:2]
-        for i, o in enumerate(object_centers):
-            # Mean prob of being class 1 (foreground)
-            cluster = aff_probs[object_masks == obj_class[i], 1]
-            robustness = np.mean(cluster)
-            pixel_count = cluster.shape[0] / n_pixels
-
-            # Convert back to observation size
-            o = (o * orig_shape / pred_shape).astype("int64")
-            world_pt = self.get_world_pt(cam, o, depth, orig_shape)
-            if(world_pt is not None):
-                c_out = {"center": world_pt,
-                         "pixel_count": pixel_count,
-                         "robustness": robustness}
+        # Convert back to observation size
+        pixels = np.stack(object_centers) * orig_shape / pred_shape
+        pixels = pixels.astype("int64")
+        if(T_world_cam is None):
+            T_world_cam = self.get_cam_pose(cam)
+        world_pts, valid = self.get_world_pts(cam, pixels, depth, orig_shape,
+                                              T_world_cam)
+        for i in range(len(object_centers)):
+            if(valid[i]):
+                c_out = {"center": world_pts[i],
+                         "pixel_count": cluster_pixels[i] / n_pixels,
+                         "robustness": cluster_robustness[i]}
                 cluster_outputs.append(c_out)
 
         most_robust = 0
-        if(self.curr_detected_obj is not None):
+        target = None
+        if(curr_target is not None):
             for out_dict in cluster_outputs:
                 c = out_dict["center"]
                 # If aff detects closer target which is large enough
                 # and Detected affordance close to target
-                dist = np.linalg.norm(self.curr_detected_obj - c)
+                dist = np.linalg.norm(curr_target - c)
                 if(dist < self.env.termination_radius/2):
                     if(out_dict["robustness"] > most_robust):
-                        self.curr_detected_obj = c
-                        self.env.target_pos = self.curr_detected_obj
+                        target = c
                         most_robust = out_dict["robustness"]
-            if self.viz:
-                self.viz_curr_target()
-        return im_dict
+        return im_dict, target
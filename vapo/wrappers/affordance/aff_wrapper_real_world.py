@@ -3,7 +3,8 @@ import numpy as np
 import cv2
 from gym import spaces
 from vapo.wrappers.affordance.aff_wrapper_base import AffordanceWrapperBase
-from vapo.utils.utils import pos_orn_to_matrix, get_depth_around_point
+from vapo.utils.utils import pos_orn_to_matrix, \
+    get_nonzero_depth_around_pixels, deproject_pixels, check_deproject_pixels
 from affordance.utils.img_utils import get_px_after_crop_resize
 logger = logging.getLogger(__name__)
 
@@ -16,6 +17,7 @@ class AffordanceWrapperRealWorld(AffordanceWrapperBase):
         self.action_space = spaces.Box(_action_space * -1, _action_space)
         self.gripper_cam = self.env.camera_manager.gripper_cam
         self.T_tcp_cam = self.env.env.camera_manager.gripper_cam.get_extrinsic_calibration('panda')
+        check_deproject_pixels(self.gripper_cam)
 
     @property
     def task(self):
@@ -29,8 +31,10 @@ class AffordanceWrapperRealWorld(AffordanceWrapperBase):
         if(self.task == "pickup"):
             action = np.append(action, 1)
         obs, reward, done, info = self.env.step(action, move_to_box)
+        self.collect_aff_preds()
         reward = self.reward(reward, obs, done, info["success"])
-        return self.observation(obs), reward, done, info
+        self.track_outcome(done, info)
+        return self.step_observation(obs), reward, done, info
 
     def get_images(self, obs_cfg, obs_dict, cam_type):
         depth_img, rgb_img = None, None
@@ -49,17 +53,16 @@ class AffordanceWrapperRealWorld(AffordanceWrapperBase):
         new_obs.update({"robot_obs": obs["robot_obs"]})
         return new_obs
 
-    def get_world_pt(self, cam, pixel, depth, orig_shape):
-        o, depth_non_zero = get_depth_around_point(pixel, depth)
-        if depth_non_zero:
-            cam_frame_pt = cam.deproject(o, depth)
-            tcp_pos, tcp_orn = self.env.robot.get_tcp_pos_orn()
-            tcp_mat = pos_orn_to_matrix(tcp_pos, tcp_orn)
-            world_pt = tcp_mat @ self.T_tcp_cam @ np.array([*cam_frame_pt, 1])
-            world_pt = world_pt[:3]
-        else:
-            world_pt = None
-        return world_pt
+    def get_cam_pose(self, cam):
+        # Read while the arm is at the pose of the observation
+        tcp_pos, tcp_orn = self.env.robot.get_tcp_pos_orn()
+        tcp_mat = pos_orn_to_matrix(tcp_pos, tcp_orn)
+        return tcp_mat @ self.T_tcp_cam
+
+    def get_world_pts(self, cam, pixels, depth, orig_shape, T_world_cam):
+        pixels, depth_non_zero = get_nonzero_depth_around_pixels(pixels, depth)
+        world_pts, valid = deproject_pixels(cam, pixels, depth, T_world_cam)
+        return world_pts, valid & depth_non_zero
 
     def viz_curr_target(self):
         u, v = self.target_search.static_cam.project(self.curr_detected_obj)
@@ -2,6 +2,7 @@ import numpy as np
 import cv2
 import logging
 import gym.spaces as spaces
+from vapo.utils.utils import get_min_depth_around_pixels, deproject_pixels
 from vapo.wrappers.affordance.aff_wrapper_base import AffordanceWrapperBase
 logger = logging.getLogger(__name__)
 
@@ -30,6 +31,17 @@ class AffordanceWrapperSim(AffordanceWrapperBase):
         # Debug
         self.target_search = None
 
+    def reset(self, *args, **kwargs):
+        # Queued targets were detected in the previous scene
+        if(self.target_search is not None):
+            self.target_search.clear_queue()
+        return super(AffordanceWrapperSim, self).reset(*args, **kwargs)
+
+    def get_scene_with_objects(self, *args, **kwargs):
+        if(self.target_search is not None):
+            self.target_search.clear_queue()
+        return self.env.get_scene_with_objects(*args, **kwargs)
+
     def viz_curr_target(self):
         ''' See current target on static camera'''
         u, v = self.target_search.static_cam.project(self.curr_detected_obj)
@@ -50,22 +62,18 @@ class AffordanceWrapperSim(AffordanceWrapperBase):
             rgb_img = obs_dict['rgb_obs']["rgb_%s" % cam_type]
         return depth_img, rgb_img
 
-    def get_world_pt(self, cam, pixel, depth, orig_shape):
+    def get_cam_pose(self, cam):
+        # View matrix is overwritten by the next render
+        return np.linalg.inv(np.array(cam.viewMatrix).reshape((4, 4)).T)
+
+    def get_world_pts(self, cam, pixels, depth, orig_shape, T_world_cam):
+        # pixels: (N, 2) -> (v, u)
+        uv = pixels[:, ::-1]
         if(self.env.task == "drawer" or self.env.task == "slide"):
             # As center might  not be exactly in handle
             # look for max depth around neighborhood
-            n = 10
-            uv_max = np.clip(pixel + [n, n], 0, orig_shape)
-            uv_min = np.clip(pixel - [n, n], 0, orig_shape)
-            depth_window = depth[uv_min[0]:uv_max[0],
-                                 uv_min[1]:uv_max[1]]
-            proposal = np.argwhere(depth_window == np.min(depth_window))[0]
-            v = pixel[0] - n + proposal[0]
-            u = pixel[1] - n + proposal[1]
-        else:
-            v, u = pixel
-        world_pt = cam.deproject([u, v], depth)
-        return world_pt
+            uv = get_min_depth_around_pixels(uv, depth, n=10)
+        return deproject_pixels(cam, uv, depth, T_world_cam)
 
     def observation(self, obs):
         # Store global images (all cameras)
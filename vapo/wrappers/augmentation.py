@@ -0,0 +1,113 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugmentation():
+    '''
+        Fused augmentation for a batch of images (B, C, H, W) on the
+        device where the batch lives. Equivalent to the train transforms:
+            RandomResizedCrop/Resize -> ScaleImageTensor
+            -> Normalize -> AddGaussianNoise
+        but every sample gets its own random crop. Crop and resize are
+        applied in a single grid_sample call, scaling, normalization and
+        noise in a single affine pass.
+    '''
+    def __init__(self, out_size, scale=(1.0, 1.0), ratio=(1.0, 1.0),
+                 img_scale=1.0, mean=0.0, std=1.0,
+                 noise_mean=0.0, noise_std=0.0, clip=None):
+        self.out_size = out_size
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.img_scale = img_scale
+        self.mean = mean
+        self.std = std
+        self.noise_mean = noise_mean
+        self.noise_std = noise_std
+        self.clip = clip
+
+    @classmethod
+    def from_cfg(cls, transforms_cfg, img_size):
+        '''
+            Builds the fused augmentation from the hydra transforms list.
+            Returns None when the list contains a transform which cannot be
+            fused, the torchvision pipeline should be used instead.
+        '''
+        args = {"out_size": img_size}
+        for transf in transforms_cfg:
+            name = transf["_target_"].split('.')[-1]
+            if(name == "RandomResizedCrop"):
+                args["out_size"] = transf.size
+                args["scale"] = tuple(transf.get("scale", (0.08, 1.0)))
+                args["ratio"] = tuple(transf.get("ratio", (3 / 4, 4 / 3)))
+            elif(name == "Resize"):
+                args["out_size"] = transf.size
+            elif(name == "ScaleImageTensor"):
+                args["img_scale"] = 1 / 255
+            elif(name == "Normalize"):
+                args["mean"] = list(transf.mean)
+                args["std"] = list(transf.std)
+            elif(name == "AddGaussianNoise"):
+                args["noise_mean"] = list(transf.get("mean", [0.0]))
+                args["noise_std"] = list(transf.get("std", [1.0]))
+                if(transf.get("clip", None) is not None):
+                    args["clip"] = tuple(transf.clip)
+            else:
+                return None
+        return cls(**args)
+
+    def _as_tensor(self, value, x):
+        value = torch.as_tensor(value, dtype=x.dtype, device=x.device)
+        if(value.dim() == 1):
+            value = value.view(1, -1, 1, 1)
+        return value
+
+    def _crop_grid(self, x):
+        '''
+            Affine grid of an independent random resized crop per sample
+        '''
+        b, _, h, w = x.shape
+        device = x.device
+        area = torch.empty(b, device=device).uniform_(*self.scale)
+        log_ratio = torch.empty(b, device=device).uniform_(*self.log_ratio)
+        ratio = torch.exp(log_ratio)
+        # Crop size relative to image size
+        crop_w = torch.sqrt(area * ratio).clamp(max=1.0)
+        crop_h = torch.sqrt(area / ratio).clamp(max=1.0)
+        # Crop center in normalized coordinates [-1, 1]
+        center_x = (torch.rand(b, device=device) * 2 - 1) * (1 - crop_w)
+        center_y = (torch.rand(b, device=device) * 2 - 1) * (1 - crop_h)
+
+        theta = torch.zeros(b, 2, 3, device=device)
+        theta[:, 0, 0] = crop_w
+        theta[:, 0, 2] = center_x
+        theta[:, 1, 1] = crop_h
+        theta[:, 1, 2] = center_y
+        size = (b, x.shape[1], self.out_size, self.out_size)
+        return F.affine_grid(theta, size, align_corners=False)
+
+    def __call__(self, x):
+        x = x.float()
+        if(len(x.shape) == 3):
+            x = x.unsqueeze(0)
+        full_img = self.scale == (1.0, 1.0) and self.log_ratio == (0.0, 0.0)
+        if(not full_img):
+            grid = self._crop_grid(x)
+            x = F.grid_sample(x, grid, mode="bilinear",
+                              padding_mode="border", align_corners=False)
+        elif(x.shape[-1] != self.out_size or x.shape[-2] != self.out_size):
+            x = F.interpolate(x, size=(self.out_size, self.out_size),
+                              mode="bilinear", align_corners=False)
+
+        # (x * img_scale - mean) / std + noise
+        std = self._as_tensor(self.std, x)
+        mult = self.img_scale / std
+        add = - self._as_tensor(self.mean, x) / std
+        x = x * mult + add
+        if(self.noise_std != 0.0):
+            noise_std = self._as_tensor(self.noise_std, x)
+            noise_mean = self._as_tensor(self.noise_mean, x)
+            x = torch.addcmul(x + noise_mean, torch.randn_like(x), noise_std)
+        if(self.clip is not None):
+            x = x.clamp(*self.clip)
+        return x
@@ -14,6 +14,8 @@ from vr_env.envs.play_table_env import PlayTableSimEnv
 from vr_env.utils.utils import EglDeviceNotFoundError, get_egl_device_id
 from vapo.wrappers.play_table_rand_scene import PlayTableRandScene
 from vapo.utils.utils import get_3D_end_points, pos_orn_to_matrix
+from vapo.utils.profiling import phase_timers
+from vapo.utils.video_recorder import rollout_recorder
 logger = logging.getLogger(__name__)
 
 
@@ -44,6 +46,8 @@ class PlayTableRL(PlayTableSimEnv):
         self.reward_fail = args['reward_fail']
         self.reward_success = args['reward_success']
         self._obs_it = 0
+        # Names the image folders, advanced by the affordance wrapper
+        self.episode = 0
         self.viz = viz
         self.save_images = save_images
         self.cam_ids = find_cam_ids(self.cameras)
@@ -150,17 +154,19 @@ class PlayTableRL(PlayTableSimEnv):
                 update_target = False
         else:
             a = action
-        self.robot.apply_action(a, update_target)
-        for i in range(self.action_repeat):
-            self.p.stepSimulation(physicsClientId=self.cid)
-        self.scene.step()
+        with phase_timers.span("env/physics"):
+            self.robot.apply_action(a, update_target)
+            for i in range(self.action_repeat):
+                self.p.stepSimulation(physicsClientId=self.cid)
+            self.scene.step()
         # dict w/keys: "rgb_obs", "depth_obs", "robot_obs","scene_obs"
         done = self._termination()
         if(done and self.task == "pickup"):
             success = self.check_success()
         else:
             success = done
-        obs = self.get_obs()
+        with phase_timers.span("env/render"):
+            obs = self.get_obs()
         reward, r_info = self._reward(success)
         info = self.get_info()
         info.update({"success": success,
@@ -324,10 +330,10 @@ class PlayTableRL(PlayTableSimEnv):
             cv2.waitKey(1)
         if(self.save_images):
             for cam_name, _ in self.cam_ids.items():
-                os.makedirs('./images/%s_orig' % cam_name, exist_ok=True)
-                cv2.imwrite("./images/%s_orig/img_%04d.png"
-                            % (cam_name, self.obs_it),
-                            obs['rgb_obs']["rgb_%s" % cam_name][:, :, ::-1])
+                rollout_recorder.add(
+                    "./images/ep_%04d/%s_orig/img_%04d.png"
+                    % (self.episode, cam_name, self.obs_it),
+                    obs['rgb_obs']["rgb_%s" % cam_name][:, :, ::-1])
         self.obs_it += 1
 
     def move_to_box(self, sample=False):
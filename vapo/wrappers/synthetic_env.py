@@ -0,0 +1,394 @@
+import logging
+import time
+import numpy as np
+import gym
+from gym import spaces
+from vapo.wrappers.utils import find_cam_ids
+from vapo.utils.utils import get_3D_end_points
+from vapo.utils.profiling import phase_timers
+from vapo.utils.video_recorder import rollout_recorder
+logger = logging.getLogger(__name__)
+
+
+def view_matrix(eye, target, up):
+    '''
+        OpenGL view matrix (world to camera), as pybullet computeViewMatrix
+        returns: np.array (4, 4)
+    '''
+    eye, target, up = np.array(eye), np.array(target), np.array(up)
+    f = target - eye
+    f = f / np.linalg.norm(f)
+    s = np.cross(f, up)
+    s = s / np.linalg.norm(s)
+    u = np.cross(s, f)
+    view = np.eye(4)
+    view[0, :3], view[1, :3], view[2, :3] = s, u, -f
+    view[:3, 3] = -view[:3, :3] @ eye
+    return view
+
+
+class SyntheticCamera():
+    '''
+        Pinhole camera with the attributes of the vr_env cameras
+        used by the wrappers and the target search.
+    '''
+    def __init__(self, name, width=200, height=200, fov=60,
+                 look_from=(0.3, 0.6, 1.6), look_at=(0.3, 0.6, 0.6),
+                 up_vector=(0, 1, 0), **kwargs):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self._view = view_matrix(look_from, look_at, up_vector)
+        # Column major, as pybullet
+        self.viewMatrix = self._view.T.flatten().tolist()
+
+    def project(self, x):
+        '''
+            x: world point (3,) or homogeneous (4,)
+            returns: pixel (u, v)
+        '''
+        x = np.array([*x[:3], 1])
+        x_cam = self._view @ x
+        foc = self.height / (2 * np.tan(np.deg2rad(self.fov) / 2))
+        depth = max(-x_cam[2], 1e-6)
+        u = self.width // 2 + foc * x_cam[0] / depth
+        v = self.height // 2 - foc * x_cam[1] / depth
+        return int(round(u)), int(round(v))
+
+
+class SyntheticScene():
+    '''
+        Objects on the table as names and positions, same interface
+        as PlayTableRandScene for the tabletop task.
+    '''
+    def __init__(self, np_random, objects=None, positions=None,
+                 load_only_one=False, n_objs=5, **kwargs):
+        self.np_random = np_random
+        if(objects is not None and "movable_objects" in objects):
+            movable = objects["movable_objects"]
+            self.obj_names = list(movable.keys())
+            self.initial_pos = {k: np.array(v["initial_pos"], dtype=float)
+                                for k, v in movable.items()}
+        else:
+            self.obj_names = ["obj_%d" % i for i in range(n_objs)]
+            self.initial_pos = {k: np.array([0.1 * i, 0.7, 0.62])
+                                for i, k in enumerate(self.obj_names)}
+        self.object_cfg = objects
+        self.rand_positions = None
+        if(positions):
+            self.rand_positions = [list(pos) for pos in positions]
+        self.load_only_one = load_only_one
+        self.positions = dict(self.initial_pos)
+        self.in_box = set()
+        self._target = self.obj_names[0]
+        if(self.rand_positions):
+            self.pick_rand_scene(load=True)
+        else:
+            self.table_objs = self.obj_names
+            self.pick_table_obj()
+
+    @property
+    def target(self):
+        return self._target
+
+    @target.setter
+    def target(self, value):
+        self._target = value
+
+    def get_info(self):
+        movable = {name: {"uid": i,
+                          "initial_pos": self.initial_pos[name]}
+                   for i, name in enumerate(self.obj_names)}
+        return {"movable_objects": movable, "fixed_objects": {}}
+
+    def pick_table_obj(self, eval=False):
+        candidates = [o for o in self.table_objs if o not in self.in_box]
+        if(len(candidates) == 0):
+            candidates = self.table_objs
+        self.target = candidates[self.np_random.randint(len(candidates))]
+
+    def get_scene_with_objects(self, obj_lst, load_scene=False,
+                               positions=None):
+        self.table_objs = list(obj_lst)
+        self.reset()
+        self.pick_table_obj()
+
+    def pick_rand_scene(self, objs_success=None, load=False, eval=False):
+        n_objs = 1 if self.load_only_one else len(self.rand_positions)
+        n_objs = min(n_objs, len(self.obj_names))
+        idx = self.np_random.choice(len(self.obj_names), n_objs,
+                                    replace=False)
+        self.table_objs = [self.obj_names[i] for i in idx]
+        self.reset()
+        self.pick_table_obj()
+
+    def reset(self):
+        self.in_box = set()
+        for i, name in enumerate(self.table_objs):
+            pos = self.initial_pos[name].copy()
+            if(self.rand_positions):
+                pos[:2] = self.rand_positions[i % len(self.rand_positions)]
+            self.positions[name] = pos
+
+    def step(self):
+        return
+
+
+class SyntheticPlayTable(gym.Env):
+    '''
+        Stand-in for PlayTableRL without pybullet, to measure the
+        throughput of the wrappers and the agent. Implements the
+        interface they use (get_obs, step, reset, move_to_target,
+        cameras, cam_ids, scene, get_target_pos...) with:
+        - random camera images, cycled from n_frames pregenerated frames
+        - physics_latency/render_latency/move_latency: seconds slept in
+          step, get_obs and the scripted motions (move_to_target,
+          move_to_box), to emulate the simulation cost
+        - lift_steps: [min, max] steps until the target is lifted and
+          the episode ends, null to only end by timeout or by leaving
+          the termination radius. success_rate: probability that a
+          lifted object ends in the box.
+        Takes the same config as PlayTableRL, pybullet specific
+        arguments are ignored.
+    '''
+    def __init__(self, task="pickup", sparse_reward=False, viz=False,
+                 save_images=False, cameras=None, scene_cfg=None,
+                 offset=(0, 0, 0), reward_success=200, reward_fail=-1,
+                 seed=None, rand_scene=None, n_frames=16,
+                 physics_latency=0.0, render_latency=0.0, move_latency=0.0,
+                 lift_steps=(20, 60), success_rate=0.5, step_size=0.01,
+                 initial_tcp_pos=(0.1, 0.6, 0.9), **args):
+        self.task = task
+        self.sparse_reward = sparse_reward
+        self.viz = viz
+        self.save_images = save_images
+        self.offset = np.array([*offset, 1])
+        self.reward_success = reward_success
+        self.reward_fail = reward_fail
+        self.termination_radius = np.inf
+        self.np_random = np.random.RandomState(seed)
+        self.cid = 0
+        self._obs_it = 0
+        # Names the image folders, advanced by the affordance wrapper
+        self.episode = 0
+
+        _action_space = np.ones(7)
+        self.action_space = spaces.Box(_action_space * -1, _action_space)
+        self.observation_space = gym.spaces.Dict({
+            "scene_obs": gym.spaces.Box(low=0, high=1.5, shape=(3,)),
+            'robot_obs': gym.spaces.Box(low=-0.5, high=0.5, shape=(7,)),
+        })
+
+        # Cameras
+        if(cameras is None):
+            cameras = {"static": {"name": "static"},
+                       "gripper": {"name": "gripper",
+                                   "width": 84, "height": 84}}
+        self.cameras = [SyntheticCamera(**cam_cfg)
+                        for cam_cfg in cameras.values()]
+        self.cam_ids = find_cam_ids(self.cameras)
+        self.n_frames = n_frames
+        self._frames = {}
+        for cam in self.cameras:
+            shape = (n_frames, cam.height, cam.width)
+            self._frames[cam.name] = {
+                "rgb": self.np_random.randint(0, 256, (*shape, 3),
+                                              dtype=np.uint8),
+                "depth": self.np_random.uniform(0.5, 1.5, shape)
+                                       .astype(np.float32)}
+
+        # Episode structure
+        self.physics_latency = physics_latency
+        self.render_latency = render_latency
+        self.move_latency = move_latency
+        self.lift_steps = lift_steps
+        self.success_rate = success_rate
+        self.step_size = step_size
+        self._initial_tcp_pos = np.array(initial_tcp_pos, dtype=float)
+        self._tcp_pos = self._initial_tcp_pos.copy()
+        self._gripper_action = 1
+        self._ep_steps = 0
+        self._lift_at = None
+        self._start_orn = np.array([np.pi, 0, 0])
+
+        # Scene
+        self._rand_scene = rand_scene is not None
+        if(scene_cfg is None):
+            scene_cfg = {}
+        load_only_one = self._rand_scene and rand_scene["load_only_one"]
+        self.scene = SyntheticScene(self.np_random,
+                                    objects=scene_cfg.get("objects"),
+                                    positions=scene_cfg.get("positions"),
+                                    load_only_one=load_only_one)
+        self.rand_positions = self.scene.rand_positions
+        self._target = self.scene.target
+        self.box_pos = [0.7, 0.75, 0.6]
+        if(scene_cfg.get("objects") is not None
+           and "bin" in scene_cfg["objects"].get("fixed_objects", {})):
+            self.box_pos = \
+                list(scene_cfg["objects"]["fixed_objects"]["bin"]["initial_pos"])
+        w, h, d = 0.24, 0.4, 0.08
+        self.box_3D_end_points = get_3D_end_points(*self.box_pos, w, h, d)
+        self._sample_lift()
+
+    @property
+    def obs_it(self):
+        return self._obs_it
+
+    @obs_it.setter
+    def obs_it(self, value):
+        self._obs_it = value
+
+    @property
+    def rand_scene(self):
+        return self._rand_scene
+
+    @property
+    def start_orn(self):
+        return self._start_orn
+
+    @property
+    def target(self):
+        return self._target
+
+    @target.setter
+    def target(self, value):
+        self._target = value
+        self.scene.target = value
+
+    def _sleep(self, seconds):
+        if(seconds > 0):
+            time.sleep(seconds)
+
+    def _sample_lift(self):
+        self._ep_steps = 0
+        self._lift_at = None
+        if(self.lift_steps is not None):
+            low, high = self.lift_steps
+            self._lift_at = self.np_random.randint(low, high + 1)
+
+    def get_obs(self):
+        self._sleep(self.render_latency)
+        frame = self._obs_it % self.n_frames
+        rgb_obs, depth_obs = {}, {}
+        for cam in self.cameras:
+            rgb_obs["rgb_%s" % cam.name] = self._frames[cam.name]["rgb"][frame]
+            depth_obs["depth_%s" % cam.name] = \
+                self._frames[cam.name]["depth"][frame]
+        # tcp pos(3), tcp euler(3), gripper width(1),
+        # arm joints(7), gripper action(1)
+        robot_obs = np.zeros(15)
+        robot_obs[:3] = self._tcp_pos
+        robot_obs[3:6] = self._start_orn
+        robot_obs[6] = 0.08 if self._gripper_action > 0 else 0.0
+        robot_obs[-1] = self._gripper_action
+        scene_obs = np.concatenate([self.scene.positions[o]
+                                    for o in self.scene.table_objs])
+        return {"rgb_obs": rgb_obs, "depth_obs": depth_obs,
+                "robot_obs": robot_obs, "scene_obs": scene_obs}
+
+    def get_info(self):
+        return {}
+
+    def pick_table_obj(self, eval=False):
+        self.scene.pick_table_obj(eval)
+        self.target = self.scene.target
+
+    def get_scene_with_objects(self, obj_lst, load_scene=False):
+        self.scene.get_scene_with_objects(obj_lst, load_scene)
+        self.target = self.scene.target
+
+    def pick_rand_scene(self, objs_success=None, load=False, eval=False):
+        self.scene.pick_rand_scene(objs_success, load, eval)
+        self.target = self.scene.target
+
+    def reset(self, eval=False):
+        if(self.rand_scene and not eval):
+            self.pick_rand_scene()
+        self._tcp_pos = self._initial_tcp_pos.copy()
+        self._gripper_action = 1
+        self._sample_lift()
+        self.pick_table_obj(eval)
+        return self.get_obs()
+
+    def step(self, action, *args):
+        with phase_timers.span("env/physics"):
+            self._sleep(self.physics_latency)
+            action = np.asarray(action, dtype=float)
+            self._tcp_pos = self._tcp_pos + action[:3] * self.step_size
+            self._gripper_action = 1 if action[-1] > 0 else -1
+            self._ep_steps += 1
+            self._obs_it += 1
+        done = self._termination()
+        if(done and self.task == "pickup"):
+            success = self.check_success()
+        else:
+            success = done
+        with phase_timers.span("env/render"):
+            obs = self.get_obs()
+        reward, r_info = self._reward(success)
+        info = self.get_info()
+        info.update({"success": success,
+                     **r_info})
+        return obs, reward, done, info
+
+    def _reward(self, success):
+        target_pos, target_state = self.get_target_pos()
+        info = {"reward_state": target_state}
+        if(self.sparse_reward):
+            reward = self.reward_success if success else 0
+        else:
+            reward_near = -np.linalg.norm(target_pos - self._tcp_pos)
+            reward = reward_near + target_state
+            info = {"reward_state": target_state, "reward_near": reward_near}
+        return reward, info
+
+    def _termination(self):
+        _, target_state = self.get_target_pos()
+        return bool(target_state)
+
+    def get_target_pos(self):
+        target_pos = self.scene.positions[self.target]
+        lifted = self._lift_at is not None and self._ep_steps >= self._lift_at
+        return target_pos, lifted
+
+    def move_to_target(self, target_pos):
+        self._sleep(self.move_latency)
+        tcp_mat = np.eye(4)
+        tcp_mat[:3, 3] = target_pos
+        self._tcp_pos = (tcp_mat @ self.offset)[:3]
+        self.save_and_viz_obs(self.get_obs())
+
+    def save_and_viz_obs(self, obs):
+        if(self.save_images):
+            for cam_name, _ in self.cam_ids.items():
+                rollout_recorder.add(
+                    "./images/ep_%04d/%s_orig/img_%04d.png"
+                    % (self.episode, cam_name, self.obs_it),
+                    obs['rgb_obs']["rgb_%s" % cam_name][:, :, ::-1])
+        self.obs_it += 1
+
+    def move_to_box(self, sample=False):
+        self._sleep(self.move_latency)
+        success = self.np_random.rand() < self.success_rate
+        if(success):
+            self.scene.in_box.add(self.target)
+            self.scene.positions[self.target] = np.array(self.box_pos)
+        self._tcp_pos = self._initial_tcp_pos.copy()
+        return success
+
+    def obj_in_box(self, obj_name):
+        return obj_name in self.scene.in_box
+
+    def all_objs_in_box(self):
+        for obj_name in self.scene.table_objs:
+            if(not self.obj_in_box(obj_name)):
+                return False
+        return True
+
+    def check_success(self, any=False):
+        success = self.move_to_box()
+        if(any):
+            return len(self.scene.in_box) > 0
+        return success
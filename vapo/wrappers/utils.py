@@ -2,7 +2,6 @@ import gym
 import cv2
 import numpy as np
 import torch
-from affordance.utils.utils import get_transforms
 
 
 def get_name(cfg, model_name):
@@ -100,6 +99,7 @@ def depth_preprocessing(frame, img_size):
 
 
 def get_transforms_and_shape(transforms_cfg, in_size, out_size=None):
+    from affordance.utils.utils import get_transforms
     apply_transforms = get_transforms(transforms_cfg, img_size=out_size)
     test_tensor = torch.zeros((3, in_size, in_size))
     test_tensor = apply_transforms(test_tensor)